@@ -0,0 +1,328 @@
+import sys
+import os
+import argparse
+import concurrent.futures
+import datetime
+import json
+import shlex
+import subprocess
+import time
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+# stages of one dataset in dependency order, each run by one of the existing scripts
+batchStages = ['projections', 'sliced', 'movies', 'compression']
+
+class batchTask:
+    # one node of the batch DAG: a script run on a dataset (or a movies directory),
+    # with the resources it holds while running
+    def __init__(self, name, stage, zarrFile, command, logFile, deps=(), cores=1, memory=0, priority=0, isDone=None):
+        self.name = name
+        self.stage = stage
+        self.zarrFile = zarrFile
+        self.command = command
+        self.logFile = logFile
+        self.deps = list(deps)
+        self.cores = cores
+        self.memory = memory
+        self.priority = priority
+        self.isDone = isDone
+        self.status = 'pending'
+        self.returncode = None
+        self.seconds = None
+
+    def _summary(self):
+        return {'name': self.name, 'stage': self.stage, 'zarrFile': self.zarrFile, 'status': self.status,
+                'returncode': self.returncode, 'seconds': self.seconds, 'cores': self.cores, 'memoryBytes': self.memory,
+                'deps': [dep.name for dep in self.deps], 'logFile': self.logFile}
+
+def findDatasets(paths):
+    # zarr datasets given directly or found below the given directories, a dataset
+    # is a directory with parameters.json and the source group '0'
+    datasets = []
+    for path in paths:
+        path = os.path.abspath(path)
+        for dirPath, dirNames, fileNames in os.walk(path):
+            if 'parameters.json' in fileNames and '0' in dirNames:
+                datasets.append(dirPath)
+                dirNames[:] = []
+            else:
+                dirNames.sort()
+    return list(dict.fromkeys(datasets))
+
+def getMoviesDir(zarrFile):
+    # makeOrthoProjMovies.py writes to the movies folder next to the dataset
+    return os.path.join(os.path.dirname(zarrFile), 'movies')
+
+def getSourceArray(zarrFile, res_lvl=0):
+    return dv.openRootStore(zarrFile, mode='r')['0'][str(res_lvl)]
+
+def estimateProjectionResources(zarrFile):
+    # (cores, bytes) held by calcOrthoMaxProjs.py: the reader threads and the
+    # volumes in flight in the prefetch pipeline, or the tile budget when the
+    # dataset sets a memory limit
+    resArray = getSourceArray(zarrFile)
+    lenZ, lenY, lenX = resArray.shape[2:]
+    itemsize = resArray.dtype.itemsize
+    projectionParams = dv.getProjectionParamsFromJSON(zarrFile + '/parameters.json')
+    accumulatorBytes = dv.getAccumulatorBytes((lenZ, lenY, lenX), itemsize, dv.calcSlabBounds(resArray.shape))
+    memoryLimit = dv.getMemoryLimitFromJSON(zarrFile + '/parameters.json')
+    volumeBytes = lenZ*lenY*lenX*itemsize
+    if memoryLimit is not None:
+        volumeBytes = min(volumeBytes, memoryLimit)
+    if projectionParams['backend'] == 'dask':
+        if projectionParams['schedulerAddress'] is not None:
+            return 1, accumulatorBytes
+        nThreads = projectionParams['nWorkers']*projectionParams['threadsPerWorker']
+        return nThreads, nThreads*(volumeBytes + accumulatorBytes)
+    nVolumes = projectionParams['prefetchThreads'] + projectionParams['maxInFlight'] + 1
+    return projectionParams['prefetchThreads'] + 1, nVolumes*volumeBytes + accumulatorBytes
+
+def estimateMovieMemory(zarrFile):
+    # the movie classes hold the projections of one timepoint and a few float and
+    # BGR copies of each canvas
+    lenCh, lenZ, lenY, lenX = getSourceArray(zarrFile).shape[1:]
+    nSlices = len(dv.calcSlabBounds((1, lenCh, lenZ, lenY, lenX))['sliced_maxx'])
+    return 16*lenCh*(lenY*lenX + (lenZ*lenX + lenZ*lenY)*(1 + nSlices))
+
+def isProjectionDone(zarrFile, groupNames):
+    # projections count as done once every block of each group is marked complete
+    # and none of them is out of date with the source or parameters.json
+    if not os.path.exists(zarrFile + '/analysis') and not os.path.exists(zarrFile + '/analysis.sqlite'):
+        return False
+    root = dv.openRootStore(zarrFile, mode='r')
+    for groupName in groupNames:
+        progress = dv.getProjectionProgress(root, groupName)
+        if progress is None or progress[0] < progress[1]:
+            return False
+    slabBounds = dv.getSlabBoundsFromJSON(zarrFile+'/parameters.json', root, zarrFile+'/OME/METADATA.ome.xml')
+    return not dv.getStaleProjections(root, res_lvl=0, slabBounds=slabBounds, groupNames=groupNames)
+
+def isMoviesDone(zarrFile):
+    # movies are up to date when their last run finished after the last projection run
+    movieLog = zarrFile + '/makeOrthoMaxProjMovies_out.txt'
+    if not os.path.exists(movieLog):
+        return False
+    with open(movieLog) as f:
+        if 'Ortho max videos created' not in f.read():
+            return False
+    projectionLogs = [zarrFile + '/calcOrthoMaxProjs_out.txt', zarrFile + '/calcSlicedOrthoMaxProjs_out.txt']
+    return all(os.path.getmtime(movieLog) >= os.path.getmtime(log) for log in projectionLogs if os.path.exists(log))
+
+def getMoviesToCompress(moviesDir):
+    if not os.path.isdir(moviesDir):
+        return []
+    return [name for name in sorted(os.listdir(moviesDir))
+            if name.endswith('.avi') and not os.path.exists(os.path.join(moviesDir, name[:-4] + '.mp4'))]
+
+def getCompressionCRF(fileSize):
+    # larger movies are compressed harder, as in compressMovies.sh
+    if fileSize < 2**30:
+        return 28
+    if fileSize < 2*2**30:
+        return 32
+    return 36
+
+def compressMovies(moviesDir, ffmpegPath='ffmpeg', threads=4):
+    # H.264 mp4 next to every avi that has none yet. each movie is encoded to a
+    # temporary file first, so an interrupted run is redone instead of skipped
+    for name in getMoviesToCompress(moviesDir):
+        aviFile = os.path.join(moviesDir, name)
+        mp4File = aviFile[:-4] + '.mp4'
+        tmpFile = aviFile[:-4] + '.part.mp4'
+        print('Compressing', name, flush=True)
+        subprocess.run([ffmpegPath, '-y', '-loglevel', 'error', '-i', aviFile,
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', str(getCompressionCRF(os.path.getsize(aviFile))),
+                        '-threads', str(threads), tmpFile], check=True)
+        os.replace(tmpFile, mp4File)
+
+def buildBatchTasks(datasets, order='largest', compression=True, compressionThreads=4):
+    # DAG of projections -> sliced -> movies per dataset and one compression task per
+    # movies directory. movie runs sharing a movies directory are chained, because
+    # they pick their unique file names from the files already in it
+    sizes = {zarrFile: getSourceArray(zarrFile).nbytes for zarrFile in datasets}
+    datasets = sorted(datasets, key=lambda zarrFile: sizes[zarrFile], reverse=(order == 'largest'))
+    tasks = []
+    moviesTasks = {}
+    for rank, zarrFile in enumerate(datasets):
+        name = os.path.basename(zarrFile)
+        # earlier datasets first, and within a dataset the later stages first so
+        # movies start as soon as their projections are done
+        cores, memory = estimateProjectionResources(zarrFile)
+        projections = batchTask(name + ':projections', 'projections', zarrFile,
+                                [sys.executable, os.path.join(script_dir, 'calcOrthoMaxProjs.py'), zarrFile],
+                                zarrFile + '/batch_projections.log', cores=cores, memory=memory, priority=(rank, -1),
+                                isDone=lambda zarrFile=zarrFile: isProjectionDone(zarrFile, ['max_projections', 'sliced_max_projections', 'intensity_histograms']))
+        sliced = batchTask(name + ':sliced', 'sliced', zarrFile,
+                           [sys.executable, os.path.join(script_dir, 'calcSlicedOrthoMaxProjs.py'), zarrFile],
+                           zarrFile + '/batch_sliced.log', deps=[projections], cores=cores, memory=memory, priority=(rank, -2),
+                           isDone=lambda zarrFile=zarrFile: isProjectionDone(zarrFile, ['sliced_max_projections']))
+        moviesDir = getMoviesDir(zarrFile)
+        # segmented movies render one segment per worker process
+        segmentWorkers = dv.getMovieSpecsFromJSON(zarrFile + '/parameters.json')['encoder']['segmentWorkers']
+        movies = batchTask(name + ':movies', 'movies', zarrFile,
+                           [sys.executable, os.path.join(script_dir, 'makeOrthoProjMovies.py'), zarrFile],
+                           zarrFile + '/batch_movies.log', deps=[sliced] + moviesTasks.get(moviesDir, [])[-1:],
+                           cores=segmentWorkers, memory=segmentWorkers*estimateMovieMemory(zarrFile), priority=(rank, -3),
+                           isDone=lambda zarrFile=zarrFile: isMoviesDone(zarrFile))
+        moviesTasks.setdefault(moviesDir, []).append(movies)
+        tasks += [projections, sliced, movies]
+    if compression:
+        for moviesDir, deps in moviesTasks.items():
+            tasks.append(batchTask(moviesDir + ':compression', 'compression', None,
+                                   [sys.executable, os.path.abspath(__file__), '--compressMovies', moviesDir,
+                                    '--compressionThreads', str(compressionThreads)],
+                                   os.path.join(os.path.dirname(moviesDir), 'batch_compression.log'), deps=deps,
+                                   cores=compressionThreads, priority=(len(datasets), -4),
+                                   isDone=lambda moviesDir=moviesDir: not getMoviesToCompress(moviesDir)))
+    return tasks, sizes
+
+def runCommand(command, logFile):
+    # run one task in its own process, its output goes to the task log
+    t0 = time.perf_counter()
+    with open(logFile, 'w') as f:
+        returncode = subprocess.run(command, stdout=f, stderr=subprocess.STDOUT).returncode
+    return returncode, time.perf_counter() - t0
+
+def getLaunchCommand(task, launcher=None):
+    # optional prefix such as 'bsub -K -n {cores}' to run each task through a cluster
+    # scheduler, {cores} and {memoryGB} are filled in per task
+    if launcher is None:
+        return task.command
+    prefix = launcher.format(cores=task.cores, memoryGB=max(1, -(-task.memory // 2**30)))
+    return shlex.split(prefix) + task.command
+
+def runBatchTasks(tasks, executor=None, maxJobs=None, cores=None, memory=None, launcher=None, out=sys.stdout):
+    # run the DAG on any concurrent.futures executor. a task starts once all its
+    # dependencies finished or were skipped and while the running tasks leave
+    # enough cores, memory and job slots, a task larger than the limits runs alone.
+    # tasks whose outputs are already complete are skipped, tasks depending on a
+    # failed task are not run
+    cores = cores or os.cpu_count()
+    maxJobs = maxJobs or cores
+    if memory is None:
+        memory = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    ownExecutor = executor is None
+    if ownExecutor:
+        # every task is its own process, the threads only wait for them
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxJobs)
+    pending = sorted(tasks, key=lambda task: task.priority)
+    running = {}
+    usedCores = usedMemory = 0
+    try:
+        while pending or running:
+            for task in list(pending):
+                depStatus = [dep.status for dep in task.deps]
+                if any(status in ('failed', 'blocked') for status in depStatus):
+                    task.status = 'blocked'
+                elif any(status not in ('done', 'skipped') for status in depStatus):
+                    continue
+                elif task.isDone is not None and task.isDone():
+                    task.status = 'skipped'
+                elif running and (len(running) >= maxJobs or usedCores + task.cores > cores or usedMemory + task.memory > memory):
+                    continue
+                else:
+                    task.status = 'running'
+                    print(datetime.datetime.now(), 'Started', task.name, file=out, flush=True)
+                    running[executor.submit(runCommand, getLaunchCommand(task, launcher), task.logFile)] = task
+                    usedCores += task.cores
+                    usedMemory += task.memory
+                pending.remove(task)
+                if task.status in ('skipped', 'blocked'):
+                    print(datetime.datetime.now(), task.status.capitalize(), task.name, file=out, flush=True)
+            if not running:
+                continue
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                usedCores -= task.cores
+                usedMemory -= task.memory
+                try:
+                    task.returncode, task.seconds = future.result()
+                except Exception as e:
+                    print('Error running', task.name + ':', e, file=out)
+                task.status = 'done' if task.returncode == 0 else 'failed'
+                print(datetime.datetime.now(), 'Finished' if task.status == 'done' else 'FAILED', task.name,
+                      '' if task.seconds is None else f'in {task.seconds:.1f} s', file=out, flush=True)
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+    return tasks
+
+def formatBatchReport(tasks, sizes, wallTime, cores):
+    # one line per dataset with the status and run time of each stage
+    lines = []
+    byDataset = {}
+    for task in tasks:
+        byDataset.setdefault(task.zarrFile or task.name, {})[task.stage] = task
+    for key, stageTasks in byDataset.items():
+        cells = []
+        for stage in batchStages:
+            if stage in stageTasks:
+                task = stageTasks[stage]
+                cells.append(stage + ' ' + task.status + ('' if task.seconds is None else f' ({task.seconds:.0f} s)'))
+        size = '' if key not in sizes else f' [{sizes[key]/2**30:.1f} GB]'
+        lines.append(key + size + ': ' + ', '.join(cells))
+    # a task larger than the core limit ran alone on all cores
+    coreSeconds = sum(min(task.cores, cores)*task.seconds for task in tasks if task.seconds is not None)
+    counts = {status: sum(task.status == status for task in tasks) for status in ['done', 'skipped', 'failed', 'blocked']}
+    lines.append(f'{len(tasks)} tasks in {wallTime:.1f} s: ' + ', '.join(f'{n} {status}' for status, n in counts.items()) +
+                 f', {100*coreSeconds/max(wallTime*cores, 1e-9):.0f}% of {cores} cores used')
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate projections, make movies and compress them for many datasets.')
+    parser.add_argument('paths', nargs='*', help='zarr datasets or directories searched for datasets')
+    parser.add_argument('--maxJobs', type=int, default=None, help='tasks running at once, the number of cores by default')
+    parser.add_argument('--cores', type=int, default=None, help='cores shared by the running tasks, all cores by default')
+    parser.add_argument('--memoryGB', type=float, default=None, help='memory shared by the running tasks, all memory by default')
+    parser.add_argument('--order', choices=['largest', 'smallest'], default='largest', help='which datasets start first')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--launcher', default=None, help="command prefix for each task, e.g. 'bsub -K -n {cores}'")
+    parser.add_argument('--noCompression', action='store_true')
+    parser.add_argument('--compressionThreads', type=int, default=4)
+    parser.add_argument('--report', default=None, help='JSON report file, batch_report_<date>.json by default')
+    parser.add_argument('--compressMovies', default=None, metavar='MOVIES_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compressMovies is not None:
+        compressMovies(args.compressMovies, threads=args.compressionThreads)
+        return
+
+    datasets = findDatasets(args.paths)
+    if not datasets:
+        print('No zarr datasets found. Exiting.')
+        sys.exit(1)
+    print('Found', len(datasets), 'datasets')
+    tasks, sizes = buildBatchTasks(datasets, order=args.order, compression=not args.noCompression,
+                                   compressionThreads=args.compressionThreads)
+
+    cores = args.cores or os.cpu_count()
+    memory = None if args.memoryGB is None else int(args.memoryGB*2**30)
+    executor = None
+    if args.executor == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.maxJobs or cores)
+    t0 = time.perf_counter()
+    try:
+        runBatchTasks(tasks, executor=executor, maxJobs=args.maxJobs, cores=cores, memory=memory, launcher=args.launcher)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    wallTime = time.perf_counter() - t0
+
+    print(formatBatchReport(tasks, sizes, wallTime, cores))
+    reportFile = args.report or 'batch_report_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'
+    with open(reportFile, 'w') as f:
+        json.dump({'date': datetime.datetime.now().isoformat(), 'wallTime': wallTime, 'cores': cores,
+                   'sizes': sizes, 'tasks': [task._summary() for task in tasks]}, f, indent=4)
+    print('Report written to', reportFile)
+    if any(task.status in ('failed', 'blocked') for task in tasks):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
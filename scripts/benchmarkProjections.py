@@ -0,0 +1,272 @@
+import sys
+import os
+import argparse
+import datetime
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import zarr
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+def createSyntheticDataset(zarrFile, shape, voxelDims=(0.65, 0.65, 2.0), nLevels=2, seed=0):
+    # OME-zarr dataset with a noisy background and bright blobs drifting over time,
+    # plus the parameters.json and METADATA.ome.xml the scripts expect
+    lenT, lenCh, lenZ, lenY, lenX = shape
+    rng = np.random.default_rng(seed)
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile)
+    sourceGroup = root.create_group('0')
+    # nested chunk keys like the bioformats2raw output
+    levels = [sourceGroup.zeros(str(lvl), shape=(lenT, lenCh, lenZ, lenY >> lvl, lenX >> lvl),
+                                chunks=(1, 1, lenZ, lenY >> lvl, lenX >> lvl), dtype='uint16',
+                                dimension_separator=dv.chunkKeySeparator) for lvl in range(nLevels)]
+
+    # gaussian blob rendered once and pasted around each blob position
+    nBlobs = 50
+    radius = 8
+    zz, yy, xx = np.ogrid[-radius:radius+1, -radius:radius+1, -radius:radius+1]
+    blob = (20000*np.exp(-(zz**2 + yy**2 + xx**2)/(2*(radius/3)**2))).astype('uint16')
+    blobPos = (rng.uniform(0, 1, (lenCh, nBlobs, 3)) * [lenZ, lenY, lenX]).astype(int)
+    for i in range(lenT):
+        for j in range(lenCh):
+            volume = rng.poisson(100, (lenZ, lenY, lenX)).astype('uint16')
+            for z, y, x in blobPos[j] + [0, i, i]:
+                y, x = y % lenY, x % lenX
+                region = (slice(max(z-radius, 0), z+radius+1), slice(max(y-radius, 0), y+radius+1), slice(max(x-radius, 0), x+radius+1))
+                target = volume[region]
+                offsets = tuple(slice(max(radius-c, 0), max(radius-c, 0) + n) for c, n in zip((z, y, x), target.shape))
+                np.maximum(target, blob[offsets], out=target)
+            for lvl, levelArray in enumerate(levels):
+                levelArray[i, j] = volume[:, ::2**lvl, ::2**lvl]
+
+    parameters = {
+        "imagingParameters": {"imagingFrequency": 10},
+        "channels": [{"name": ["cells", "rocks"][j % 2], "channelNumber": j, "scaleMin": 0, "scaleMax": 20000}
+                     for j in range(min(lenCh, 2))],
+    }
+    with open(zarrFile + '/parameters.json', 'w') as f:
+        json.dump(parameters, f, indent=4)
+
+    os.makedirs(zarrFile + '/OME', exist_ok=True)
+    images = ''.join(f'<Image ID="Image:{lvl}"><Pixels PhysicalSizeX="{voxelDims[0]*2**lvl}" PhysicalSizeY="{voxelDims[1]*2**lvl}" '
+                     f'PhysicalSizeZ="{voxelDims[2]}"/></Image>' for lvl in range(nLevels))
+    with open(zarrFile + '/OME/METADATA.ome.xml', 'w') as f:
+        f.write('<?xml version="1.0"?><OME>' + images + '</OME>')
+    return root
+
+def getIOCounters():
+    # bytes read and written by this process (Linux only), None elsewhere
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError):
+        return None, None
+
+def timeStage(stages, name, func, nVoxels=None, nFrames=None):
+    # run one stage and record its wall time, throughput, peak RSS and I/O
+    readBefore, writtenBefore = getIOCounters()
+    t0 = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - t0
+    readAfter, writtenAfter = getIOCounters()
+    stage = {
+        'name': name,
+        'seconds': elapsed,
+        'voxelsPerSecond': None if nVoxels is None else nVoxels/elapsed,
+        'framesPerSecond': None if nFrames is None else nFrames/elapsed,
+        'peakRSSBytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+        'bytesRead': None if readBefore is None else readAfter - readBefore,
+        'bytesWritten': None if writtenBefore is None else writtenAfter - writtenBefore,
+    }
+    stages.append(stage)
+    print(name + ':', f"{elapsed:.2f} s", '' if nVoxels is None else f"{nVoxels/elapsed/1e6:.1f} Mvoxels/s",
+          '' if nFrames is None else f"{nFrames/elapsed:.1f} frames/s")
+    return result
+
+def calcReferenceProjections(frame, nSlices=20):
+    # projections of one (z,y,x) volume as calcMaxProjections and calcSlicedMaxProjections
+    # of the original scripts computed them: whole volume maxima, nSlices slabs of
+    # len//(nSlices-1) with the last slab running to the edge. the histogram bins
+    # split the range of the dtype into nHistogramBins equal bins
+    lenZ, lenY, lenX = frame.shape
+    sliceDepthX = lenX//(nSlices-1)
+    sliceDepthY = lenY//(nSlices-1)
+    rangesX = [[k*sliceDepthX, (k+1)*sliceDepthX] for k in range(nSlices-1)] + [[(nSlices-1)*sliceDepthX, lenX]]
+    rangesY = [[k*sliceDepthY, (k+1)*sliceDepthY] for k in range(nSlices-1)] + [[(nSlices-1)*sliceDepthY, lenY]]
+    maxZ = np.max(frame, axis=0)
+    histRange = int(np.iinfo(frame.dtype).max) + 1
+    return {
+        'maxz': maxZ,
+        'maxz_depth': np.argmax(frame, axis=0),
+        'maxx': np.max(frame, axis=2),
+        'maxy': np.max(frame, axis=1),
+        'sliced_maxx': np.stack([np.max(frame[:, :, start:stop], axis=2) for start, stop in rangesX]),
+        'sliced_maxy': np.stack([np.max(frame[:, start:stop, :], axis=1) for start, stop in rangesY]),
+        'histz': np.histogram(maxZ, bins=dv.nHistogramBins, range=(0, histRange))[0],
+    }
+
+def checkProjections(root, analysisPaths):
+    # compare every projection array written by each stage with the reference projections
+    resArray = root['0']['0']
+    lenT, lenCh = resArray.shape[:2]
+    mismatches = {analysisPath: set() for analysisPath in analysisPaths}
+    for i in range(lenT):
+        for j in range(lenCh):
+            reference = calcReferenceProjections(resArray[i, j])
+            for analysisPath in analysisPaths:
+                for groupName, projNames in dv.projectionGroupArrays.items():
+                    if groupName not in root[analysisPath]:
+                        continue
+                    for projName in projNames:
+                        if not np.array_equal(root[analysisPath][groupName][projName][i, j], reference[projName]):
+                            mismatches[analysisPath].add(projName)
+    return {analysisPath: sorted(projNames) for analysisPath, projNames in mismatches.items()}
+
+def createMovies(root, channels, movieSpecs, lookupTables=True):
+    # movie objects of every movie type without video writers. without lookup tables
+    # the frames are contrasted and coloured by adjustContrast and applyColorMap as
+    # in the original movie code
+    movies = {}
+    for channel in channels:
+        movies[channel.name + '_orthomax'] = dv.orthoMaxMovie(root, channel, movieSpecs['primaryColormap'], video=False)
+        for axis in ['X', 'Y']:
+            movies[channel.name + '_' + axis + '_sliced_orthomax'] = dv.slicedOrthoMaxMovie(root, channel, axis, movieSpecs['primaryColormap'], video=False)
+        movies[channel.name + '_zdepth_orthomax'] = dv.zDepthOrthoMaxMovie(root, channel, movieSpecs['zDepthColormap'], video=False)
+    if {channel.name for channel in channels} >= {'cells', 'rocks'}:
+        movies['comp_orthomax'] = dv.compOrthoMaxMovie(root, channels, video=False)
+    if not lookupTables:
+        for movie in movies.values():
+            for name in ['lut', 'lutCells', 'lutRocks', 'contrastLUT']:
+                if hasattr(movie, name):
+                    setattr(movie, name, None)
+    return movies
+
+def checkMovieFrames(root, channels, movieSpecs, nSamples=3, tolerance=1):
+    # render the first, last and evenly spaced timepoints of every movie type and
+    # compare them with frames rendered without lookup tables, which may round
+    # differently by one grey level. returns the largest difference of each movie
+    # type that exceeds tolerance
+    lenT = dv.getProjectionDimensions(root)[0]
+    movies = createMovies(root, channels, movieSpecs)
+    referenceMovies = createMovies(root, channels, movieSpecs, lookupTables=False)
+    projChannels = [projChannel for movie in movies.values() for projChannel in movie.projChannels]
+    projArrays = {projName: dv.getProjectionArray(root, projName) for projName, _ in projChannels}
+    mismatches = {}
+    for i in sorted(set(np.linspace(0, lenT - 1, nSamples).round().astype(int).tolist())):
+        projs = dv.readProjections(projArrays, projChannels, i)
+        for name, movie in movies.items():
+            frame = movie._renderFrame(i, projs).astype(int)
+            reference = referenceMovies[name]._renderFrame(i, projs).astype(int)
+            difference = int(np.abs(frame - reference).max())
+            if difference > tolerance:
+                mismatches[name] = max(mismatches.get(name, 0), difference)
+    return mismatches
+
+def getGitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=script_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Time projections and movie rendering on a synthetic dataset.')
+    parser.add_argument('--shape', type=int, nargs=5, default=[20, 2, 64, 512, 512], metavar=('T', 'C', 'Z', 'Y', 'X'))
+    parser.add_argument('--outputDir', default='benchmarks', help='directory the JSON results are written to')
+    parser.add_argument('--workDir', default=None, help='directory for the synthetic dataset, a temporary directory by default')
+    parser.add_argument('--dask', action='store_true', help='also time the dask backend')
+    parser.add_argument('--skipMovies', action='store_true')
+    args = parser.parse_args()
+    outputDir = os.path.abspath(args.outputDir)
+
+    shape = tuple(args.shape)
+    lenT, lenCh, lenZ, lenY, lenX = shape
+    nVoxels = int(np.prod(shape))
+    workDir = tempfile.mkdtemp(dir=args.workDir)
+    zarrFile = os.path.join(workDir, 'synthetic.zarr')
+    stages = []
+    stageTimer = dv.enableInstrumentation()
+    try:
+        root = timeStage(stages, 'create_dataset', lambda: createSyntheticDataset(zarrFile, shape), nVoxels=nVoxels)
+
+        # each projection path writes to its own analysis group
+        analysisPaths = ['analysis', 'benchmark/pipeline']
+        # the separate passes run one block at a time, the combined one through the pipeline
+        timeStage(stages, 'max_projections', lambda: dv.calcOrthoMaxProjections(
+            root, maxProjections=True, slicedMaxProjections=False, intensityHistograms=True, prefetchThreads=0), nVoxels=nVoxels)
+        timeStage(stages, 'sliced_max_projections', lambda: dv.calcOrthoMaxProjections(
+            root, maxProjections=False, slicedMaxProjections=True, intensityHistograms=False, prefetchThreads=0), nVoxels=nVoxels)
+        timeStage(stages, 'ortho_max_projections_pipeline', lambda: dv.calcOrthoMaxProjections(
+            root, prefetchThreads=2, analysisPath='benchmark/pipeline'), nVoxels=nVoxels)
+        if args.dask:
+            analysisPaths.append('benchmark/dask')
+            timeStage(stages, 'ortho_max_projections_dask', lambda: dv.calcOrthoMaxProjectionsDask(
+                root, analysisPath='benchmark/dask'), nVoxels=nVoxels)
+
+        print('Checking projections against the reference implementation')
+        mismatches = checkProjections(root, analysisPaths)
+        for analysisPath, projNames in mismatches.items():
+            print(analysisPath + ':', 'identical' if not projNames else 'MISMATCH in ' + ', '.join(projNames))
+
+        frameMismatches = {}
+        if not args.skipMovies:
+            channels = dv.getChannelsFromJSON(zarrFile + '/parameters.json', root)
+            for channel in channels:
+                channel.voxelDims = dv.getVoxelDimsFromXML(zarrFile + '/OME/METADATA.ome.xml')
+            movieSpecs = dv.getMovieSpecsFromJSON(zarrFile + '/parameters.json')
+            if len(channels) < 2:
+                # the composite movie needs both a cells and a rocks channel
+                movieSpecs['movies'].remove('comp_orthomax')
+            moviesDir = os.path.join(workDir, 'movies')
+            os.makedirs(moviesDir)
+            os.chdir(moviesDir)
+            timeStage(stages, 'movies', lambda: dv.makeOrthoMaxVideos(root, channels, movieSpecs))
+            os.chdir(script_dir)
+            stages[-1]['nMovies'] = len(os.listdir(moviesDir))
+            stages[-1]['framesPerSecond'] = stages[-1]['nMovies']*lenT/stages[-1]['seconds']
+            stages[-1]['movieBytes'] = sum(os.path.getsize(os.path.join(moviesDir, name)) for name in os.listdir(moviesDir))
+            print(stages[-1]['nMovies'], 'movies,', f"{stages[-1]['framesPerSecond']:.1f} frames/s")
+
+            print('Checking movie frames against the reference rendering')
+            frameMismatches = checkMovieFrames(root, channels, movieSpecs)
+            print('movies:', 'identical' if not frameMismatches else
+                  'MISMATCH in ' + ', '.join(name + ' (' + str(difference) + ')' for name, difference in frameMismatches.items()))
+
+        results = {
+            'date': datetime.datetime.now().isoformat(),
+            'gitCommit': getGitCommit(),
+            'shape': list(shape),
+            'sourceBytes': nVoxels*root['0']['0'].dtype.itemsize,
+            'platform': platform.platform(),
+            'cpuCount': os.cpu_count(),
+            'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'zarr': zarr.__version__},
+            'stages': stages,
+            'instrumentation': stageTimer._summary(),
+            'mismatches': mismatches,
+            'frameMismatches': frameMismatches,
+        }
+    finally:
+        os.chdir(script_dir)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    os.makedirs(outputDir, exist_ok=True)
+    outputFile = os.path.join(outputDir, 'benchmark_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(outputFile, 'w') as f:
+        json.dump(results, f, indent=4)
+    print('Results written to', outputFile)
+    if any(mismatches.values()) or frameMismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 import sys
 import os
 import datetime
-import zarr
 from tkinter import Tk, filedialog
+from dask.distributed import Client
 
 # Add src directory to the Python path
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -27,20 +27,88 @@ def main(zarrFile=None):
     with open(outputFile, 'w') as f:
         print('Zarr file:', zarrFile, '\n', file=f)
 
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
         # create root store and analysis group
         dv.createRootStore(zarrFile)
-        root = zarr.open(zarrFile, mode='r+')
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
         dv.createZarrGroup(root, 'analysis')
         print('Root store created at ', datetime.datetime.now(), file=f)
 
-        # check if projections have already been calculated
-        if 'max_projections' in root['analysis']:
-            print('Max projections already calculated, skipping calculation.', file=f)
-            return
+        # rewrite projections stored in the old float64 layout
+        migrated = dv.migrateProjectionArrays(root, storageSpecs=storageSpecs)
+        if migrated:
+            print('Migrated', ', '.join(migrated), 'to the compact projection layout at ', datetime.datetime.now(), file=f)
+
+        # recalculate projections from another source, slab layout or projection version,
+        # and timepoints whose source chunks changed since they were projected
+        slabBounds = dv.getSlabBoundsFromJSON(zarrFile+'/parameters.json', root, zarrFile+'/OME/METADATA.ome.xml')
+        # the source chunks are statted once and the stamps reused by the projections
+        stamps = dv.getSourceStamps(root, res_lvl=0)
+        stale = dv.checkProjectionFingerprints(root, res_lvl=0, slabBounds=slabBounds, stamps=stamps)
+        for groupName, (reason, changed) in stale.items():
+            if reason is not None:
+                print(groupName, 'out of date (' + reason + '), recalculating.', file=f)
+            else:
+                print(groupName, 'source changed at', len(changed), 'timepoints, recalculating them.', file=f)
+
+        # check which projections have already been calculated, resume partial ones
+        pending = {}
+        for groupName in ['max_projections', 'sliced_max_projections', 'intensity_histograms']:
+            progress = dv.getProjectionProgress(root, groupName)
+            if progress is None:
+                pending[groupName] = True
+            elif progress[0] == progress[1]:
+                print(groupName, 'already calculated, skipping calculation.', file=f)
+                pending[groupName] = False
+            else:
+                print(groupName, 'partially calculated (' + str(progress[0]) + '/' + str(progress[1]) + ' blocks), resuming.', file=f)
+                pending[groupName] = True
+        maxProjections = pending['max_projections']
+        slicedMaxProjections = pending['sliced_max_projections']
+        intensityHistograms = pending['intensity_histograms']
+
+        # histograms missing from finished max projections are built from the stored projections
+        if intensityHistograms and not maxProjections:
+            dv.calcIntensityHistograms(root, storageSpecs=storageSpecs)
+            print('Intensity histograms calculated at ', datetime.datetime.now(), file=f)
+            intensityHistograms = False
+
+        # calculate max and sliced max projections in a single pass over the data, every
+        # path ends with the metadata consolidated so the new groups are visible
+        if maxProjections or slicedMaxProjections:
+            f.flush()
+            projectionParams = dv.getProjectionParamsFromJSON(zarrFile+'/parameters.json')
+            if projectionParams['backend'] == 'dask':
+                # connect to an existing scheduler or start a local cluster
+                if projectionParams['schedulerAddress'] is not None:
+                    client = Client(projectionParams['schedulerAddress'])
+                else:
+                    client = Client(n_workers=projectionParams['nWorkers'], threads_per_worker=projectionParams['threadsPerWorker'])
+                print('Dask client created at ', datetime.datetime.now(), file=f)
+                try:
+                    dv.calcOrthoMaxProjectionsDask(root, res_lvl=0, maxProjections=maxProjections, slicedMaxProjections=slicedMaxProjections,
+                                                   intensityHistograms=intensityHistograms, client=client, slabBounds=slabBounds,
+                                                   storageSpecs=storageSpecs, stamps=stamps)
+                finally:
+                    client.close()
+            else:
+                stats = dv.calcOrthoMaxProjections(root, res_lvl=0, maxProjections=maxProjections, slicedMaxProjections=slicedMaxProjections,
+                                                   intensityHistograms=intensityHistograms,
+                                                   prefetchThreads=projectionParams['prefetchThreads'],
+                                                   maxInFlight=projectionParams['maxInFlight'],
+                                                   slabBounds=slabBounds, storageSpecs=storageSpecs,
+                                                   memoryLimit=dv.getMemoryLimitFromJSON(zarrFile+'/parameters.json'), stamps=stamps)
+                if stats is not None:
+                    print('Projection pipeline:', dv.formatPipelineStats(stats), file=f)
+            print('Max projections calculated at ', datetime.datetime.now(), file=f)
 
-        # calculate max projections
-        dv.calcMaxProjections(root, res_lvl=0)
-        print('Max projections calculated at ', datetime.datetime.now(), file=f)
+        # metadata of all groups and arrays in one key for the movie scripts
+        dv.consolidateMetadata(root)
+        dv.writeInstrumentation(zarrFile + '/calcOrthoMaxProjs_stages.json')
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
@@ -1,53 +1,82 @@
-import sys
-import os
-import datetime
-import zarr
-from tkinter import Tk, filedialog
-
-# Add src directory to the Python path
-script_dir = os.path.dirname(os.path.abspath(__file__))
-src_path = os.path.join(script_dir, '..', 'src')
-sys.path.append(src_path)
-
-import dictyviz as dv
-
-def main(zarrFile=None):
-    if zarrFile is None:
-        # select zarr file
-        Tk().withdraw() 
-        zarrFile = filedialog.askdirectory(initialdir='cryolite', title='Select a zarr file')
-        if not os.path.isdir(zarrFile):
-            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
-            sys.exit(1)
-    print(zarrFile)
-
-    os.chdir(zarrFile)
-    outputFile = zarrFile + '/calcSlicedOrthoMaxProjs_out.txt'
-    print(zarrFile)
-    with open(outputFile, 'w') as f:
-        print('Zarr file:', zarrFile, '\n', file=f)
-
-        # create root store and analysis group
-        dv.createRootStore(zarrFile)
-        root = zarr.open(zarrFile, mode='r+')
-        dv.createZarrGroup(root, 'analysis')
-        print('Root store created at ', datetime.datetime.now(), file=f)
-
-        # check if sliced projections have already been calculated
-        if 'sliced_max_projections' in root['analysis']:
-            print('Sliced max projections already calculated, skipping calculation.', file=f)
-            return
-
-        # calculate max projections
-        dv.calcSlicedMaxProjections(root, res_lvl=0)
-        print('Sliced max projections calculated at ', datetime.datetime.now(), file=f)
-
-if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        zarrFile = sys.argv[1]
-        if not os.path.isdir(zarrFile):
-            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
-            sys.exit(1)
-    else:
-        zarrFile = None
-    main(zarrFile)
+import sys
+import os
+import datetime
+from tkinter import Tk, filedialog
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+def main(zarrFile=None):
+    if zarrFile is None:
+        # select zarr file
+        Tk().withdraw() 
+        zarrFile = filedialog.askdirectory(initialdir='cryolite', title='Select a zarr file')
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    print(zarrFile)
+
+    os.chdir(zarrFile)
+    outputFile = zarrFile + '/calcSlicedOrthoMaxProjs_out.txt'
+    print(zarrFile)
+    with open(outputFile, 'w') as f:
+        print('Zarr file:', zarrFile, '\n', file=f)
+
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
+        # create root store and analysis group
+        dv.createRootStore(zarrFile)
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
+        dv.createZarrGroup(root, 'analysis')
+        print('Root store created at ', datetime.datetime.now(), file=f)
+
+        # rewrite projections stored in the old float64 layout
+        migrated = dv.migrateProjectionArrays(root, storageSpecs=storageSpecs)
+        if migrated:
+            print('Migrated', ', '.join(migrated), 'to the compact projection layout at ', datetime.datetime.now(), file=f)
+
+        # recalculate sliced projections from another source, slab layout or projection
+        # version, and timepoints whose source chunks changed since they were projected
+        slabBounds = dv.getSlabBoundsFromJSON(zarrFile+'/parameters.json', root, zarrFile+'/OME/METADATA.ome.xml')
+        # the source chunks are statted once and the stamps reused by the projections
+        stamps = dv.getSourceStamps(root, res_lvl=0)
+        stale = dv.checkProjectionFingerprints(root, res_lvl=0, slabBounds=slabBounds, groupNames=['sliced_max_projections'], stamps=stamps)
+        for groupName, (reason, changed) in stale.items():
+            if reason is not None:
+                print(groupName, 'out of date (' + reason + '), recalculating.', file=f)
+            else:
+                print(groupName, 'source changed at', len(changed), 'timepoints, recalculating them.', file=f)
+
+        # check if sliced projections have already been calculated, resume partial ones
+        progress = dv.getProjectionProgress(root, 'sliced_max_projections')
+        if progress is not None:
+            if progress[0] == progress[1]:
+                print('Sliced max projections already calculated, skipping calculation.', file=f)
+                return
+            print('Sliced max projections partially calculated (' + str(progress[0]) + '/' + str(progress[1]) + ' blocks), resuming.', file=f)
+            f.flush()
+
+        # calculate max projections
+        dv.calcSlicedMaxProjections(root, res_lvl=0, slabBounds=slabBounds, storageSpecs=storageSpecs,
+                                    memoryLimit=dv.getMemoryLimitFromJSON(zarrFile+'/parameters.json'), stamps=stamps)
+        print('Sliced max projections calculated at ', datetime.datetime.now(), file=f)
+        # metadata of all groups and arrays in one key for the movie scripts
+        dv.consolidateMetadata(root)
+        dv.writeInstrumentation(zarrFile + '/calcSlicedOrthoMaxProjs_stages.json')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        zarrFile = sys.argv[1]
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    else:
+        zarrFile = None
+    main(zarrFile)
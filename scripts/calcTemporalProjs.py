@@ -0,0 +1,76 @@
+import sys
+import os
+import datetime
+import cv2
+import cmapy
+import numpy as np
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+def writeKymographImage(fileName, kymograph, channel, cmap):
+    # time runs down the image, the line from left to right. one contrast range
+    # covers all timepoints when the channel scale is set per timepoint
+    scaleMin, scaleMax = float(np.min(channel.scaleMin)), float(np.max(channel.scaleMax))
+    contrastedIm = dv.adjustContrast(kymograph, scaleMax, scaleMin)
+    if channel.name == 'rocks':
+        contrastedIm = 255 - contrastedIm
+    image = cv2.applyColorMap(contrastedIm, cmapy.cmap(cmap))
+    image[kymograph==0] = 0
+    cv2.imwrite(fileName, image)
+
+def main(zarrFile):
+    outputFile = zarrFile + '/calcTemporalProjs_out.txt'
+    with open(outputFile, 'w') as f:
+        print('Zarr file:', zarrFile, '\n', file=f)
+
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
+        if 'analysis' not in root or 'max_projections' not in root['analysis']:
+            print('Max projections not found, run calcOrthoMaxProjs.py first.', file=f)
+            return
+        if dv.getLegacyProjectionArrays(root):
+            print('Projections are stored in the old layout, run calcOrthoMaxProjs.py to migrate them.', file=f)
+            return
+
+        temporalParams = dv.getTemporalParamsFromJSON(zarrFile+'/parameters.json')
+        group = dv.calcTemporalProjections(root, window=temporalParams['window'], stride=temporalParams['stride'],
+                                           storageSpecs=storageSpecs)
+        print('Temporal projections of', group.attrs['lenT'], 'timepoints calculated at ', datetime.datetime.now(), file=f)
+
+        # kymographs are stored in the analysis group and written as images to kymographs/
+        channels = dv.getChannelsFromJSON(zarrFile+'/parameters.json', root)
+        cmap = dv.getMovieSpecsFromJSON(zarrFile+'/parameters.json')['primaryColormap']
+        kymographDir = os.path.join(zarrFile, 'kymographs')
+        for spec in temporalParams['kymographs']:
+            try:
+                kymograph = dv.calcKymograph(root, spec['name'], spec['line'], spec['projection'], spec['width'],
+                                             storageSpecs=storageSpecs)
+            except ValueError as e:
+                print('Skipping kymograph', spec['name'] + ':', e, file=f)
+                continue
+            os.makedirs(kymographDir, exist_ok=True)
+            for channel in channels:
+                writeKymographImage(os.path.join(kymographDir, spec['name'] + '_' + channel.name + '.png'),
+                                    kymograph[channel.nChannel], channel, cmap)
+            print('Kymograph', spec['name'], 'calculated at ', datetime.datetime.now(), file=f)
+        dv.consolidateMetadata(root)
+        dv.writeInstrumentation(zarrFile + '/calcTemporalProjs_stages.json')
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python calcTemporalProjs.py <zarrFile>')
+        sys.exit(1)
+    zarrFile = sys.argv[1]
+    if not os.path.isdir(zarrFile):
+        print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+        sys.exit(1)
+    main(zarrFile)
@@ -9,21 +9,9 @@ if [ -z "$selected_folder" ]; then
     exit 1
 fi
 
-# Check if max projections have already been calculated
-if [ -d "${selected_folder}/analysis/max_projections/maxx" ]; then
-    echo "Max projections already calculated, skipping."
-else
-    # Submit max projection calculation job
-    bsub -n 8 -W 24:00 python calcOrthoMaxProjs.py "${selected_folder}"
-fi
-
-# Check if sliced max projections have already been calculated
-if [ -d "${selected_folder}/analysis/sliced_max_projections/sliced_maxx" ]; then
-    echo "Sliced max projections already calculated, skipping."
-else
-    # Submit sliced max projection calculation job
-    bsub -n 8 -W 24:00 -K python calcSlicedOrthoMaxProjs.py "${selected_folder}"
-fi
+# Submit a single job computing max and sliced max projections in one pass,
+# the job skips finished projections and resumes partially calculated ones
+bsub -n 8 -W 24:00 -K python calcOrthoMaxProjs.py "${selected_folder}"
 
 # Submit movie making jobs, waiting for max projs to finish
 bsub -n 8 -W 12:00 -K python makeOrthoProjMovies.py "${selected_folder}"
@@ -1,9 +1,7 @@
 import sys
 import os
 import datetime
-import zarr
 from tkinter import Tk, filedialog
-from dask.distributed import Client, wait
 
 # Add src directory to the Python path
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -27,12 +25,26 @@ def main(zarrFile=None):
     with open(outputFile, 'w') as f:
         print('Zarr file:', zarrFile, '\n', file=f)
 
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
         # create root store
         dv.createRootStore(zarrFile)
-        root = zarr.open(zarrFile, mode='r+')
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
+
+        # rewrite projections stored in the old float64 layout
+        migrated = dv.migrateProjectionArrays(root, storageSpecs=storageSpecs)
+        if migrated:
+            print('Migrated', ', '.join(migrated), 'to the compact projection layout at ', datetime.datetime.now(), file=f)
+
+        # reopen read only from consolidated metadata, one metadata read for all movies
+        dv.consolidateMetadata(root)
+        root = dv.openRootStore(zarrFile, mode='r', consolidated=True)
 
         # define channels
-        channels = dv.getChannelsFromJSON(zarrFile+'/parameters.json')
+        channels = dv.getChannelsFromJSON(zarrFile+'/parameters.json', root)
         for channel in channels:
             channel.voxelDims = dv.getVoxelDimsFromXML(zarrFile+'/OME/METADATA.ome.xml')
             print("Channel " + channel.name + ": Min = " + str(channel.scaleMin) + ", Max = " + str(channel.scaleMax))
@@ -44,38 +56,15 @@ def main(zarrFile=None):
             os.makedirs(movies_dir)
         os.chdir(movies_dir)
 
-        # # create dask client
-        try:
-            client = Client(threads_per_worker=8, n_workers=1)
-            print('Dask client created at ', datetime.datetime.now())
-        except:
-            print('Dask client could not be created')
-            sys.exit() 
-
-        # create ortho max videos
-        # for channel in channels:
-        #     dv.makeOrthoMaxVideo(root, channel)
-        #     dv.makeSlicedOrthoMaxVideos(root, channel)
-        #     dv.makeZDepthOrthoMaxVideo(root, channel, 'gist_rainbow_r')
-        # dv.makeCompOrthoMaxVideo(root, channels)
-        # print('Ortho max videos created at ', datetime.datetime.now()) 
-
-        #submit movie tasks
-        try:
-            wait([client.submit(dv.makeOrthoMaxVideo, root, channels[0]),
-                client.submit(dv.makeOrthoMaxVideo, root, channels[1]),
-                client.submit(dv.makeCompOrthoMaxVideo, root, channels),
-                client.submit(dv.makeSlicedOrthoMaxVideos, root, channels[0]),
-                client.submit(dv.makeSlicedOrthoMaxVideos, root, channels[1]),
-                client.submit(dv.makeZDepthOrthoMaxVideo, root, channels[0], 'gist_rainbow_r'),
-                client.submit(dv.makeZDepthOrthoMaxVideo, root, channels[1], 'gist_rainbow_r'),])
-            print('Ortho max videos created at ', datetime.datetime.now())   
-        except:
-            print('Dask tasks could not be submitted')
-            client.shutdown()
-            sys.exit()
-
-        client.shutdown()
+        # render all movies listed in movieSpecs in a single pass over the projections
+        movieSpecs = dv.getMovieSpecsFromJSON(zarrFile+'/parameters.json')
+        print('Rendering movies:', ', '.join(movieSpecs['movies']), file=f)
+        if movieSpecs['encoder']['segmentWorkers'] > 1:
+            print('Rendering', movieSpecs['encoder']['segmentWorkers'], 'time segments in parallel', file=f)
+        f.flush()
+        dv.makeOrthoMaxVideos(root, channels, movieSpecs)
+        print('Ortho max videos created at ', datetime.datetime.now(), file=f)
+        dv.writeInstrumentation(zarrFile + '/makeOrthoMaxProjMovies_stages.json')
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
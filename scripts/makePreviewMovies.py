@@ -0,0 +1,82 @@
+import sys
+import os
+import datetime
+from tkinter import Tk, filedialog
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+def main(zarrFile=None):
+    if zarrFile is None:
+        # select zarr file
+        Tk().withdraw() 
+        zarrFile = filedialog.askdirectory(initialdir='cryolite', title='Select zarr file(s)')
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    print(zarrFile)
+    
+    outputFile = zarrFile + '/makePreviewMovies_out.txt'
+    with open(outputFile, 'w') as f:
+        print('Zarr file:', zarrFile, '\n', file=f)
+
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
+        # create root store
+        dv.createRootStore(zarrFile)
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
+        analysisPath = 'analysis/preview'
+
+        # project a coarser pyramid level, picked from the target size and time budget
+        projectionParams = dv.getProjectionParamsFromJSON(zarrFile+'/parameters.json')
+        print('Preview projections started at ', datetime.datetime.now(), file=f)
+        res_lvl = dv.selectPreviewLevel(root, projectionParams['previewTargetSize'], projectionParams['previewTimeBudget'])
+        slabBounds = dv.getSlabBoundsFromJSON(zarrFile+'/parameters.json', root, zarrFile+'/OME/METADATA.ome.xml', res_lvl)
+        res_lvl, stats = dv.calcPreviewProjections(root, res_lvl=res_lvl, slabBounds=slabBounds, storageSpecs=storageSpecs,
+                                                   prefetchThreads=projectionParams['prefetchThreads'],
+                                                   maxInFlight=projectionParams['maxInFlight'],
+                                                   memoryLimit=dv.getMemoryLimitFromJSON(zarrFile+'/parameters.json'))
+        print('Preview projections calculated from resolution level', res_lvl, 'with shape', root['0'][str(res_lvl)].shape, file=f)
+        if stats is not None:
+            print(dv.formatPipelineStats(stats), file=f)
+        print('Preview projections finished at ', datetime.datetime.now(), file=f)
+
+        # reopen read only from consolidated metadata, one metadata read for all movies
+        dv.consolidateMetadata(root)
+        root = dv.openRootStore(zarrFile, mode='r', consolidated=True)
+
+        # define channels, voxel sizes are scaled to the preview level
+        channels = dv.getChannelsFromJSON(zarrFile+'/parameters.json', root, analysisPath)
+        for channel in channels:
+            channel.voxelDims = dv.getPyramidVoxelDims(root, zarrFile+'/OME/METADATA.ome.xml', res_lvl)
+            print("Channel " + channel.name + ": Min = " + str(channel.scaleMin) + ", Max = " + str(channel.scaleMax))
+
+        # create movies/preview directory in the parent folder of the zarr file
+        parent_dir = os.path.dirname(zarrFile)
+        movies_dir = os.path.join(parent_dir, 'movies', 'preview')
+        if not os.path.exists(movies_dir):
+            os.makedirs(movies_dir)
+        os.chdir(movies_dir)
+
+        movieSpecs = dv.getMovieSpecsFromJSON(zarrFile+'/parameters.json')
+        print('Rendering preview movies:', ', '.join(movieSpecs['movies']), file=f)
+        dv.makeOrthoMaxVideos(root, channels, movieSpecs, analysisPath=analysisPath)
+        print('Preview videos created at ', datetime.datetime.now(), file=f)
+        dv.writeInstrumentation(zarrFile + '/makePreviewMovies_stages.json')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        zarrFile = sys.argv[1]
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    else:
+        zarrFile = None
+    main(zarrFile)
@@ -0,0 +1,203 @@
+import sys
+import os
+import argparse
+import json
+import hashlib
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cv2
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+contentTypes = {'png': 'image/png', 'jpg': 'image/jpeg'}
+
+# browser page with the frame of the selected movie, channel, timepoint and contrast
+indexPage = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>dictyviz preview</title>
+<style>body{font-family:sans-serif;background:#222;color:#ddd} select,input{margin-right:1em} img{display:block;margin-top:1em;image-rendering:pixelated}</style>
+</head><body>
+<div id="dataset"></div>
+<label>movie <select id="movie"></select></label>
+<label>channel <select id="channel"></select></label>
+<label>axis <select id="axis"><option>X</option><option>Y</option></select></label>
+<label>min <input id="min" type="number" style="width:6em"></label>
+<label>max <input id="max" type="number" style="width:6em"></label>
+<br><label>t <input id="t" type="range" min="0" value="0" style="width:60%"></label> <span id="tLabel"></span>
+<img id="frame">
+<script>
+const el = id => document.getElementById(id);
+fetch('info').then(r => r.json()).then(info => {
+  el('dataset').textContent = info.dataset + ' (' + info.lenT + ' timepoints)';
+  info.movies.forEach(m => el('movie').add(new Option(m)));
+  info.channels.forEach(c => el('channel').add(new Option(c.name)));
+  el('t').max = info.lenT - 1;
+  const update = () => {
+    const params = new URLSearchParams({movie: el('movie').value, channel: el('channel').value, axis: el('axis').value, t: el('t').value, format: 'jpg'});
+    if (el('min').value !== '') params.set('min', el('min').value);
+    if (el('max').value !== '') params.set('max', el('max').value);
+    el('tLabel').textContent = el('t').value;
+    el('frame').src = 'frame?' + params;
+  };
+  ['movie', 'channel', 'axis', 'min', 'max', 't'].forEach(id => el(id).addEventListener('input', update));
+  update();
+});
+</script></body></html>
+"""
+
+class previewHandler(BaseHTTPRequestHandler):
+    # GET /                 browser page
+    # GET /info             dataset dimensions, channels and movie types as JSON
+    # GET /frame?movie=orthomax&channel=cells&t=0[&axis=X&min=&max=&size=&format=png]
+    # GET /panel?proj=maxz&channel=cells&t=0[&slab=0&level=0&min=&max=&format=png]
+    # GET /tile?proj=maxz&channel=cells&t=0&level=1&y=0&x=0[&tileSize=256&slab=0&min=&max=&format=png]
+    renderer = None
+    info = None
+    responseCache = None
+    projectionTag = ''
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if url.path == '/':
+                self._send(indexPage.encode(), 'text/html; charset=utf-8')
+            elif url.path == '/info':
+                self._send(json.dumps(self.info).encode(), 'application/json')
+            elif url.path in ('/frame', '/panel', '/tile'):
+                self._sendImage(url.path, query)
+            else:
+                self.send_error(404)
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+        except IndexError as e:
+            self.send_error(404, str(e))
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    def _sendImage(self, path, query):
+        # encoded images are cached by request, so repeated requests skip rendering and encoding.
+        # browsers revalidate them with an ETag of the projections and the request
+        imageFormat = query.get('format', 'png')
+        if imageFormat not in contentTypes:
+            raise ValueError('Unknown format ' + imageFormat)
+        key = (path, tuple(sorted(query.items())))
+        etag = '"' + hashlib.sha1((self.projectionTag + repr(key)).encode()).hexdigest() + '"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        data = self.responseCache._get(key)
+        if data is None:
+            image = self._renderImage(path, query)
+            ok, data = cv2.imencode('.' + imageFormat, image)
+            if not ok:
+                raise ValueError('Could not encode image as ' + imageFormat)
+            self.responseCache._put(key, data)
+        self._send(data.tobytes(), contentTypes[imageFormat], etag)
+
+    def _renderImage(self, path, query):
+        t = int(query['t'])
+        contrast = None
+        if 'min' in query or 'max' in query:
+            channelName = query.get('channel')
+            if channelName is None:
+                raise ValueError('Contrast needs a channel')
+            defaultMin, defaultMax = dv.getChannelScale(self.renderer._getChannel(channelName), t)
+            contrast = (float(query.get('min', defaultMin)), float(query.get('max', defaultMax)))
+        if path == '/frame':
+            maxSize = int(query['size']) if 'size' in query else None
+            return self.renderer.renderFrame(query['movie'], t, query.get('channel'), contrast, query.get('axis', 'X'), maxSize)
+        if path == '/panel':
+            return self.renderer.renderPanel(query['proj'], t, query['channel'], contrast, int(query.get('slab', 0)),
+                                             int(query.get('level', 0)))
+        return self.renderer.renderTile(query['proj'], t, query['channel'], int(query['level']), int(query['y']), int(query['x']),
+                                        int(query.get('tileSize', 256)), contrast, int(query.get('slab', 0)))
+
+    def _send(self, data, contentType, etag=None):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        if etag is not None:
+            # projections are recalculated when their source or settings change, so
+            # cached images are revalidated on every use
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def getDatasetInfo(zarrFile, root, renderer, analysisPath='analysis'):
+    lenT, lenZ, lenY, lenX = dv.getProjectionDimensions(root, analysisPath)
+    movies = ['orthomax', 'zdepth_orthomax']
+    if 'sliced_max_projections' in root[analysisPath]:
+        movies.append('sliced_orthomax')
+    if {c.name for c in renderer.channels} >= {'cells', 'rocks'}:
+        movies.append('comp_orthomax')
+    return {
+        'dataset': os.path.basename(os.path.normpath(zarrFile)),
+        'lenT': lenT, 'lenZ': lenZ, 'lenY': lenY, 'lenX': lenX,
+        'channels': [{'name': c.name, 'nChannel': c.nChannel} for c in renderer.channels],
+        'movies': movies,
+    }
+
+def getProjectionTag(zarrFile, root, analysisPath='analysis'):
+    # digest of what the images are rendered from: the fingerprints and source stamps
+    # of the projections (see getInputFingerprint) and the channel settings
+    lenT = dv.getProjectionDimensions(root, analysisPath)[0]
+    fingerprints = [dv.getInputFingerprint(root[analysisPath][groupName], lenT)
+                    for groupName in ['max_projections', 'sliced_max_projections'] if groupName in root[analysisPath]]
+    with open(zarrFile + '/parameters.json', 'rb') as f:
+        fingerprints.append(hashlib.sha1(f.read()).hexdigest())
+    return hashlib.sha1(''.join(fingerprints).encode()).hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description='Browse the projections of a dataset in a web browser.')
+    parser.add_argument('zarrFile')
+    parser.add_argument('--host', default='127.0.0.1', help='0.0.0.0 to share the preview on the network')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--analysisPath', default='analysis', help="e.g. 'analysis/preview' for the preview projections")
+    parser.add_argument('--cacheMB', type=int, default=1024, help='memory for the projection, frame and response caches')
+    args = parser.parse_args()
+    zarrFile = args.zarrFile
+    if not os.path.isdir(zarrFile):
+        print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+        sys.exit(1)
+
+    root = dv.openRootStore(zarrFile, mode='r', consolidated=True)
+    if dv.getLegacyProjectionArrays(root, args.analysisPath):
+        print('Error: projections are stored in the old layout, run calcOrthoMaxProjs.py to migrate them.')
+        sys.exit(1)
+    # preview projections record the pyramid level they were calculated from
+    res_lvl = root[args.analysisPath].attrs.get('res_lvl', 0)
+    channels = dv.getChannelsFromJSON(zarrFile+'/parameters.json', root, args.analysisPath)
+    for channel in channels:
+        channel.voxelDims = dv.getPyramidVoxelDims(root, zarrFile+'/OME/METADATA.ome.xml', res_lvl)
+
+    cacheBytes = args.cacheMB*2**20
+    renderer = dv.frameRenderer(root, channels, analysisPath=args.analysisPath,
+                                projectionCacheBytes=cacheBytes//2, frameCacheBytes=cacheBytes//4)
+    previewHandler.renderer = renderer
+    previewHandler.info = getDatasetInfo(zarrFile, root, renderer, args.analysisPath)
+    previewHandler.responseCache = dv.lruCache(cacheBytes//4)
+    previewHandler.projectionTag = getProjectionTag(zarrFile, root, args.analysisPath)
+
+    server = ThreadingHTTPServer((args.host, args.port), previewHandler)
+    print(f'Serving {zarrFile} at http://{args.host}:{server.server_port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import sys
+import os
+import datetime
+from tkinter import Tk, filedialog
+
+# Add src directory to the Python path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(script_dir, '..', 'src')
+sys.path.append(src_path)
+
+import dictyviz as dv
+
+def main(zarrFile=None):
+    if zarrFile is None:
+        # select zarr file
+        Tk().withdraw() 
+        zarrFile = filedialog.askdirectory(initialdir='cryolite', title='Select a zarr file')
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    print(zarrFile)
+
+    os.chdir(zarrFile)
+    outputFile = zarrFile + '/watchOrthoMaxProjs_out.txt'
+    with open(outputFile, 'w') as f:
+        print('Zarr file:', zarrFile, '\n', file=f)
+
+        # optional per stage timings, written as JSON next to this log
+        if dv.getInstrumentationFromJSON(zarrFile+'/parameters.json')['enabled']:
+            dv.enableInstrumentation()
+
+        # create root store and analysis group
+        dv.createRootStore(zarrFile)
+        storageSpecs = dv.getProjectionStorageFromJSON(zarrFile+'/parameters.json')
+        root = dv.openRootStore(zarrFile, mode='r+', analysisStore=storageSpecs['analysisStore'])
+        dv.createZarrGroup(root, 'analysis')
+        print('Root store created at ', datetime.datetime.now(), file=f)
+
+        # rewrite projections stored in the old float64 layout
+        migrated = dv.migrateProjectionArrays(root, storageSpecs=storageSpecs)
+        if migrated:
+            print('Migrated', ', '.join(migrated), 'to the compact projection layout at ', datetime.datetime.now(), file=f)
+
+        projectionParams = dv.getProjectionParamsFromJSON(zarrFile+'/parameters.json')
+        slabBounds = dv.getSlabBoundsFromJSON(zarrFile+'/parameters.json', root, zarrFile+'/OME/METADATA.ome.xml')
+
+        def logProgress(root, lenT):
+            print('Max projections updated to', lenT, 'timepoints at ', datetime.datetime.now(), file=f)
+            f.flush()
+
+        # project new timepoints as the acquisition writes them
+        print('Watching for new timepoints at ', datetime.datetime.now(), file=f)
+        f.flush()
+        lenT = dv.watchMaxProjections(root, res_lvl=0,
+                                      pollInterval=projectionParams['watchInterval'],
+                                      settleFrames=projectionParams['settleFrames'],
+                                      timeout=projectionParams['watchTimeout'],
+                                      callback=logProgress,
+                                      slabBounds=slabBounds,
+                                      storageSpecs=storageSpecs,
+                                      memoryLimit=dv.getMemoryLimitFromJSON(zarrFile+'/parameters.json'))
+        print('Acquisition finished, max projections calculated for', lenT, 'timepoints at ', datetime.datetime.now(), file=f)
+        # metadata of all groups and arrays in one key for the movie scripts
+        dv.consolidateMetadata(root)
+        dv.writeInstrumentation(zarrFile + '/watchOrthoMaxProjs_stages.json')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        zarrFile = sys.argv[1]
+        if not os.path.isdir(zarrFile):
+            print(f"Error: The provided path '{zarrFile}' is not a valid directory.")
+            sys.exit(1)
+    else:
+        zarrFile = None
+    main(zarrFile)
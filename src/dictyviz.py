@@ -1,22 +1,194 @@
 # Dicty data functions for ome-zarr datasets
 
-import copy
+import collections
+import concurrent.futures
+import hashlib
+import itertools
 import math
 import os
+import queue
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 
 import xml.etree.ElementTree as et
 import zarr
+import numcodecs
+import dask
+import dask.array as da
 import cv2
 import cmapy
 import json
 import numpy as np
 from tqdm import tqdm
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# chunk keys of new arrays are nested like those of the bioformats2raw source
+chunkKeySeparator = '/'
 
 def createRootStore(zarrFile):
     nestedStore = zarr.NestedDirectoryStore(zarrFile, dimension_separator='/')
     root = zarr.group(store=nestedStore, overwrite=False)
 
+class routedStore(zarr.storage.Store):
+    # zarr store serving every key under the top level prefix group from a second
+    # store, so the analysis outputs can live in a single sqlite file next to the
+    # nested directory store of the source data. the sqlite store shares one
+    # cursor, so it is only accessed by one thread at a time
+    def __init__(self, baseStore, prefixStore, prefix='analysis'):
+        self.baseStore = baseStore
+        self.prefixStore = prefixStore
+        self.prefix = prefix
+        self.path = baseStore.path
+        # arrays without a recorded separator fall back to the one of the base store
+        self._dimension_separator = getattr(baseStore, '_dimension_separator', None)
+        self.prefixLock = threading.RLock()
+
+    def __getstate__(self):
+        # locks cannot be pickled, each process that unpickles the store (e.g. a
+        # dask distributed worker) gets its own
+        state = self.__dict__.copy()
+        del state['prefixLock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prefixLock = threading.RLock()
+
+    def _isPrefixKey(self, key):
+        return key == self.prefix or key.startswith(self.prefix + '/')
+
+    def __getitem__(self, key):
+        if self._isPrefixKey(key):
+            with self.prefixLock:
+                return self.prefixStore[key]
+        return self.baseStore[key]
+
+    def __setitem__(self, key, value):
+        if self._isPrefixKey(key):
+            with self.prefixLock:
+                self.prefixStore[key] = value
+        else:
+            self.baseStore[key] = value
+
+    def __delitem__(self, key):
+        if self._isPrefixKey(key):
+            with self.prefixLock:
+                del self.prefixStore[key]
+        else:
+            del self.baseStore[key]
+
+    def __contains__(self, key):
+        if self._isPrefixKey(key):
+            with self.prefixLock:
+                return key in self.prefixStore
+        return key in self.baseStore
+
+    def __iter__(self):
+        for key in self.baseStore:
+            if not self._isPrefixKey(key):
+                yield key
+        with self.prefixLock:
+            prefixKeys = list(self.prefixStore)
+        yield from prefixKeys
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def listdir(self, path=''):
+        path = path.strip('/')
+        if self._isPrefixKey(path):
+            with self.prefixLock:
+                return self.prefixStore.listdir(path)
+        names = [name for name in self.baseStore.listdir(path) if not (path == '' and name == self.prefix)]
+        if path == '':
+            with self.prefixLock:
+                names = sorted(names + [name for name in self.prefixStore.listdir('') if name == self.prefix])
+        return names
+
+    def rmdir(self, path=''):
+        path = path.strip('/')
+        if path == '':
+            self.baseStore.rmdir('')
+            with self.prefixLock:
+                self.prefixStore.rmdir('')
+        elif self._isPrefixKey(path):
+            with self.prefixLock:
+                self.prefixStore.rmdir(path)
+        else:
+            self.baseStore.rmdir(path)
+
+    def rename(self, src_path, dst_path):
+        src_path, dst_path = src_path.strip('/'), dst_path.strip('/')
+        if self._isPrefixKey(src_path) != self._isPrefixKey(dst_path):
+            raise ValueError('Cannot move ' + src_path + ' to ' + dst_path + ' across stores')
+        if not self._isPrefixKey(src_path):
+            self.baseStore.rename(src_path, dst_path)
+            return
+        with self.prefixLock:
+            store = self.prefixStore
+            if hasattr(store, 'rename'):
+                store.rename(src_path, dst_path)
+                return
+            for key in [key for key in store.keys() if key.startswith(src_path + '/')]:
+                store[dst_path + key[len(src_path):]] = store[key]
+                del store[key]
+
+    def close(self):
+        with self.prefixLock:
+            self.prefixStore.close()
+
+def getAnalysisStoreKind(zarrFile, analysisStore=None):
+    # an existing analysis store decides, otherwise the requested kind
+    if os.path.exists(zarrFile + '/analysis.sqlite'):
+        return 'sqlite'
+    if os.path.exists(zarrFile + '/analysis'):
+        return 'directory'
+    return analysisStore or 'directory'
+
+def openRootStore(zarrFile, mode='r+', analysisStore=None, consolidated=False):
+    # open a dataset with its analysis outputs, stored either in the nested
+    # directory store or in zarrFile/analysis.sqlite (analysisStore 'sqlite').
+    # with consolidated the whole hierarchy is opened from the single .zmetadata
+    # key written by consolidateMetadata, if it exists. the plain directory store
+    # reads each array with the separator recorded in its .zarray, nested for the
+    # source and new outputs, '.' for arrays written by zarr.open without one
+    store = zarr.DirectoryStore(zarrFile)
+    if getAnalysisStoreKind(zarrFile, analysisStore) == 'sqlite':
+        store = routedStore(store, zarr.SQLiteStore(zarrFile + '/analysis.sqlite', dimension_separator='/'))
+    if consolidated and '.zmetadata' in store:
+        return zarr.open_consolidated(store, mode=mode)
+    return zarr.open(store, mode=mode)
+
+def consolidateMetadata(root):
+    # write the metadata of every group and array to .zmetadata. the hierarchy is
+    # walked group by group instead of listing every chunk key of the store
+    store = root.store
+    metadata = {}
+    def addMetadata(path):
+        for name in ['.zgroup', '.zarray', '.zattrs']:
+            key = path + '/' + name if path else name
+            if key in store:
+                metadata[key] = json.loads(store[key])
+    addMetadata('')
+    root.visit(addMetadata)
+    store['.zmetadata'] = json.dumps({'zarr_consolidated_format': 1, 'metadata': metadata}, indent=4, sort_keys=True).encode()
+
+def getRootPath(root):
+    # directory of the dataset, also when opened through a consolidated metadata store
+    store = root.store
+    while not hasattr(store, 'path'):
+        store = store.store
+    return store.path
+
 def createZarrGroup(root, groupName):
 
     if groupName in root:
@@ -33,16 +205,45 @@ class channel:
         self.scaleMax = scaleMax
         self.scaleMin = scaleMin
 
-def getChannelsFromJSON(jsonFile):
+def getChannelScale(channel, i, scales=None):
+    # scaleMin and scaleMax of a channel at timepoint i, per timepoint auto
+    # contrast stores one value per timepoint. scales maps channel names to a
+    # (scaleMin, scaleMax) used instead of the channel settings
+    if scales is not None and channel.name in scales:
+        return scales[channel.name]
+    scaleMin = channel.scaleMin[i] if np.ndim(channel.scaleMin) else channel.scaleMin
+    scaleMax = channel.scaleMax[i] if np.ndim(channel.scaleMax) else channel.scaleMax
+    return scaleMin, scaleMax
+
+def getChannelsFromJSON(jsonFile, root=None, analysisPath='analysis'):
+    # scaleMin and scaleMax that are missing or set to "auto" are derived from the
+    # intensity histograms stored with the max projections of root
     with open(jsonFile) as f:
-        channelSpecs = json.load(f)["channels"]
+        params = json.load(f)
+    channelSpecs = params["channels"]
+    autoContrastParams = {
+        "lowPercentile": 0.5,
+        "highPercentile": 99.9,
+        "perTimepoint": False,
+        "smoothing": 5,
+    }
+    autoContrastParams.update(params.get("autoContrast", {}))
+
     channels = []
     for channelInfo in channelSpecs:
+        scaleMax = channelInfo.get("scaleMax", "auto")
+        scaleMin = channelInfo.get("scaleMin", "auto")
+        if scaleMax == "auto" or scaleMin == "auto":
+            if root is None or 'intensity_histograms' not in root[analysisPath]:
+                raise ValueError('Channel ' + channelInfo["name"] + ' uses auto contrast but no intensity histograms were found')
+            autoMin, autoMax = calcAutoContrast(root, channelInfo["channelNumber"], analysisPath=analysisPath, **autoContrastParams)
+            scaleMax = autoMax if scaleMax == "auto" else scaleMax
+            scaleMin = autoMin if scaleMin == "auto" else scaleMin
         channels.append(channel(name=channelInfo["name"],
                                 nChannel=channelInfo["channelNumber"],
                                 voxelDims=None,
-                                scaleMax=channelInfo["scaleMax"],
-                                scaleMin=channelInfo["scaleMin"]))
+                                scaleMax=scaleMax,
+                                scaleMin=scaleMin))
     return channels
 
 def getImagingFreqFromJSON(jsonFile):
@@ -50,6 +251,73 @@ def getImagingFreqFromJSON(jsonFile):
         imagingFreq = json.load(f)["imagingParameters"]["imagingFrequency"]
     return imagingFreq
 
+def getProjectionParamsFromJSON(jsonFile):
+    # optional projection settings, missing keys fall back to the defaults
+    projectionParams = {
+        "backend": "numpy",
+        "nWorkers": 1,
+        "threadsPerWorker": 8,
+        "schedulerAddress": None,
+        "watchInterval": 60,
+        "watchTimeout": 1800,
+        "settleFrames": 1,
+        "prefetchThreads": 2,
+        "maxInFlight": 2,
+        "previewTargetSize": 512,
+        "previewTimeBudget": None,
+        "slabThickness": None,
+        "slabStride": None,
+        "memoryLimitGB": None,
+    }
+    with open(jsonFile) as f:
+        projectionParams.update(json.load(f).get("projectionParameters", {}))
+    return projectionParams
+
+def getMemoryLimitFromJSON(jsonFile):
+    # memory cap of the projection of one volume in bytes, None when unlimited
+    memoryLimitGB = getProjectionParamsFromJSON(jsonFile)['memoryLimitGB']
+    return None if memoryLimitGB is None else int(memoryLimitGB*2**30)
+
+def getTemporalParamsFromJSON(jsonFile):
+    # optional time-collapsed projections and kymographs, window None for the
+    # projections over all timepoints only, stride None for non-overlapping windows.
+    # each kymograph is {"name", "projection", "line": [[x0,y0],[x1,y1]], "width"}
+    temporalParams = {
+        "window": None,
+        "stride": None,
+        "kymographs": [],
+    }
+    with open(jsonFile) as f:
+        temporalParams.update(json.load(f).get("temporalProjections", {}))
+    for kymograph in temporalParams["kymographs"]:
+        kymograph.setdefault("projection", "maxz")
+        kymograph.setdefault("width", 1)
+    return temporalParams
+
+# compression and chunking of the projection arrays, compressor None stores them uncompressed.
+# analysisStore 'sqlite' keeps all analysis outputs in a single file instead of one file per chunk
+projectionStorageDefaults = {
+    "compressor": "zstd",
+    "compressionLevel": 5,
+    "shuffle": "bitshuffle",
+    "timepointsPerChunk": 1,
+    "analysisStore": "directory",
+}
+
+def getProjectionStorageFromJSON(jsonFile):
+    # optional projection storage settings, missing keys fall back to the defaults
+    storageSpecs = dict(projectionStorageDefaults)
+    with open(jsonFile) as f:
+        storageSpecs.update(json.load(f).get("projectionStorage", {}))
+    return storageSpecs
+
+def getProjectionCompressor(storageSpecs):
+    if storageSpecs['compressor'] is None:
+        return None
+    shuffle = {'noshuffle': numcodecs.Blosc.NOSHUFFLE, 'shuffle': numcodecs.Blosc.SHUFFLE,
+               'bitshuffle': numcodecs.Blosc.BITSHUFFLE}[storageSpecs['shuffle']]
+    return numcodecs.Blosc(cname=storageSpecs['compressor'], clevel=storageSpecs['compressionLevel'], shuffle=shuffle)
+
 def getVoxelDimsFromXML(xmlFile, res_lvl=0):
     XMLTree = et.parse(xmlFile)
     XMLRoot = XMLTree.getroot()
@@ -59,76 +327,1312 @@ def getVoxelDimsFromXML(xmlFile, res_lvl=0):
     pixelSizeZ = float(imageMetaData.get('PhysicalSizeZ'))
     return [pixelSizeX, pixelSizeY, pixelSizeZ]
 
-def calcMaxProjections(root, res_lvl=0):
+# projection arrays written by each analysis group
+projectionGroupArrays = {
+    'max_projections': ['maxz', 'maxz_depth', 'maxx', 'maxy'],
+    'sliced_max_projections': ['sliced_maxx', 'sliced_maxy'],
+    'intensity_histograms': ['histz'],
+}
+
+# number of bins of the per (t,ch) histograms of the z max projection
+nHistogramBins = 1024
+
+def getHistogramBinWidth(dtype):
+    # bins cover the full range of integer data, 16 bit range otherwise
+    if np.issubdtype(dtype, np.integer):
+        return math.ceil((int(np.iinfo(dtype).max) + 1)/nHistogramBins)
+    return math.ceil(65536/nHistogramBins)
+
+def calcHistogram(im, binWidth):
+    # widen first, the last bin index does not fit narrow dtypes. values below
+    # zero count in the first bin and values above the range in the last
+    bins = np.clip(im.astype(np.int64) // binWidth, 0, nHistogramBins-1)
+    return np.bincount(bins.ravel(), minlength=nHistogramBins)
+
+def getSliceStarts(length, nSlices):
+    # start index of each slab along an axis, the last slab absorbs the remainder
+    sliceDepth = length//(nSlices-1)
+    return [k*sliceDepth for k in range(nSlices)]
+
+def getSlabBounds(length, nSlices=20, voxelSize=None, thickness=None, stride=None):
+    # (start, stop) index of each slab along an axis. without a thickness the axis
+    # is split into nSlices slabs, otherwise slabs thickness microns wide are placed
+    # every stride microns (default thickness), overlapping if stride < thickness
+    if thickness is None:
+        sliceStarts = getSliceStarts(length, nSlices)
+        return [[start, stop] for start, stop in zip(sliceStarts, sliceStarts[1:] + [length])]
+    if stride is None:
+        stride = thickness
+    slabDepth = min(max(1, round(thickness/voxelSize)), length)
+    slabStride = max(1, round(stride/voxelSize))
+    bounds = [[start, start + slabDepth] for start in range(0, length - slabDepth + 1, slabStride)]
+    # a last slab of the same thickness ends at the edge so the whole axis is covered
+    if bounds[-1][1] < length:
+        bounds.append([length - slabDepth, length])
+    return bounds
+
+def calcSlabBounds(shape, voxelDims=None, thickness=None, stride=None, nSlices=20):
+    # slab bounds of both sliced projections for a (..., y, x) shape, voxelDims in x, y, z order
+    lenY, lenX = shape[-2:]
+    voxelX, voxelY = (None, None) if voxelDims is None else voxelDims[:2]
+    return {
+        'sliced_maxx': getSlabBounds(lenX, nSlices, voxelX, thickness, stride),
+        'sliced_maxy': getSlabBounds(lenY, nSlices, voxelY, thickness, stride),
+    }
+
+def getSlabSegments(slabBounds, length):
+    # split possibly overlapping slabs into disjoint segments. returns the start of
+    # each segment and the range of segments covered by each slab
+    segmentStarts = sorted({bound for bounds in slabBounds for bound in bounds if bound < length} | {0})
+    segmentIndex = {start: k for k, start in enumerate(segmentStarts)}
+    segmentIndex[length] = len(segmentStarts)
+    slabSegments = [(segmentIndex[start], segmentIndex[stop]) for start, stop in slabBounds]
+    return segmentStarts, slabSegments
+
+def reduceSlabs(frame, slabBounds, axis):
+    # max of every slab along axis, slabs first. the volume is reduced once per
+    # disjoint segment, overlapping slabs then combine the small segment maxima
+    if len(set(start for start, _ in slabBounds)) < len(slabBounds):
+        # degenerate slab layout, reduce each slab directly
+        segmentStarts = [start for start, _ in slabBounds]
+        return np.moveaxis(np.maximum.reduceat(frame, segmentStarts, axis=axis), axis, 0)
+    return reduceSegments(frame, slabBounds, axis)
+
+def reduceSegments(frame, slabBounds, axis):
+    segmentStarts, slabSegments = getSlabSegments(slabBounds, frame.shape[axis])
+    segmentMaxes = np.moveaxis(np.maximum.reduceat(frame, segmentStarts, axis=axis), axis, 0)
+    if slabSegments == [(k, k+1) for k in range(len(segmentStarts))]:
+        return segmentMaxes
+    return np.stack([segmentMaxes[first:last].max(axis=0) for first, last in slabSegments])
+
+def getCompletedBlocks(group, lenT, lenCh):
+    # completion bitmap of (t,ch) blocks, stored in the group attrs as one
+    # string of '0'/'1' per timepoint
+    if 'completed' not in group.attrs:
+        # groups written before completion tracking existed are complete
+        return np.full((lenT, lenCh), len(group) > 0)
+    completed = np.zeros((lenT, lenCh), dtype=bool)
+    for i, row in enumerate(group.attrs['completed'][:lenT]):
+        completed[i] = [c == '1' for c in row]
+    return completed
+
+def setCompletedBlocks(group, completed):
+    group.attrs['completed'] = [''.join('1' if c else '0' for c in row) for row in completed]
+
+# number of (t,ch) blocks completed between two writes of a completion bitmap
+completionCheckpointInterval = 64
+
+class completionCheckpoint:
+    # completion bitmap of a group written back to its attrs every interval blocks
+    # rather than after each one, the whole bitmap is rewritten on every write.
+    # blocks done since the last write are recalculated after an interruption,
+    # call _flush once done
+    def __init__(self, group, completed, interval=completionCheckpointInterval):
+        self.group = group
+        self.completed = completed
+        self.interval = interval
+        self.nPending = 0
+
+    def _mark(self, index):
+        self.completed[index] = True
+        self.nPending += self.completed[index].size
+        if self.nPending >= self.interval:
+            self._flush()
+
+    def _flush(self):
+        if self.nPending > 0:
+            setCompletedBlocks(self.group, self.completed)
+            self.nPending = 0
+
+def getGroupCompletedBlocks(group, groupName):
+    # completion bitmap sized to the current projection arrays of a group
+    lenT, lenCh = group[projectionGroupArrays[groupName][0]].shape[:2]
+    return getCompletedBlocks(group, lenT, lenCh)
+
+def getProjectionProgress(root, groupName, analysisPath='analysis'):
+    # return (completed blocks, total blocks) of a projection group, or None
+    # if the group has not been created yet. timepoints added to the source since
+    # the group was calculated count as missing blocks
+    if analysisPath not in root or groupName not in root[analysisPath]:
+        return None
+    group = root[analysisPath][groupName]
+    if len(group) == 0:
+        return None
+    completed = getGroupCompletedBlocks(group, groupName)
+    lenT, lenCh = completed.shape
+    fingerprint = group.attrs.get('fingerprint')
+    if fingerprint is not None:
+        lenT = max(lenT, root['0'][str(fingerprint['source']['res_lvl'])].shape[0])
+    return int(completed.sum()), lenT*lenCh
+
+# version of the projection code, bumped whenever a change alters the projections
+# calculated from the same source so outputs of older versions are recalculated
+projectionVersion = 1
+
+def getProjectionFingerprint(root, groupName, res_lvl=0, slabBounds=None):
+    # source level, shape, chunks and dtype, projection settings and code version a
+    # projection group is calculated from. the length of the time axis is left out,
+    # new timepoints extend the projections instead of invalidating them
+    resArray = root['0'][str(res_lvl)]
+    fingerprint = {
+        'version': projectionVersion,
+        'source': {'res_lvl': res_lvl, 'shape': resArray.shape[1:], 'chunks': resArray.chunks, 'dtype': resArray.dtype.str},
+    }
+    if groupName == 'sliced_max_projections':
+        fingerprint['slabBounds'] = slabBounds if slabBounds is not None else calcSlabBounds(resArray.shape)
+    if groupName == 'intensity_histograms':
+        fingerprint['binWidth'] = getHistogramBinWidth(resArray.dtype)
+    # same types as after a round trip through the group attrs
+    return json.loads(json.dumps(fingerprint))
+
+def getSourceStamps(root, res_lvl=0, timepoints=None, stamps=None):
+    # modification time in ns of the newest chunk of every timepoint of the source,
+    # from a stat of the chunk files instead of reading them. None when the source
+    # is not stored in a directory. only the given timepoints are statted when the
+    # stamps of the others are passed in, e.g. the timepoints added since a poll
+    resArray = root['0'][str(res_lvl)]
+    try:
+        arrayPath = os.path.join(getRootPath(root), resArray.path)
+    except AttributeError:
+        return None
+    if not os.path.isdir(arrayPath):
+        return None
+    lenT = resArray.shape[0]
+    if timepoints is None or stamps is None:
+        timepoints = range(lenT)
+        stamps = []
+    stamps = (list(stamps) + [0]*lenT)[:lenT]
+    timepoints = set(t for t in timepoints if t < lenT)
+    for t in timepoints:
+        stamps[t] = 0
+    if resArray._dimension_separator == '/':
+        for t in timepoints:
+            for dirPath, _, fileNames in os.walk(os.path.join(arrayPath, str(t))):
+                for fileName in fileNames:
+                    stamps[t] = max(stamps[t], os.stat(os.path.join(dirPath, fileName)).st_mtime_ns)
+    else:
+        with os.scandir(arrayPath) as entries:
+            for entry in entries:
+                t = entry.name.split('.')[0]
+                if t.isdigit() and int(t) in timepoints:
+                    stamps[int(t)] = max(stamps[int(t)], entry.stat().st_mtime_ns)
+    return stamps
+
+def getLegacyFingerprintMismatch(group, groupName, fingerprint, shape, slabBounds):
+    # groups written before fingerprints existed are kept if their arrays match the
+    # source, otherwise the reason they do not
+    projSpecs = getProjectionSpecs(shape, np.dtype(fingerprint['source']['dtype']), slabBounds)
+    for projName in projectionGroupArrays[groupName]:
+        if projName in group and group[projName].shape[1:] != projSpecs[projName][0][1:]:
+            return projName + ' shape does not match level ' + str(fingerprint['source']['res_lvl']) + ' of the source'
+    if groupName == 'sliced_max_projections' and group.attrs.get('slabBounds', slabBounds) != slabBounds:
+        return 'slabBounds changed'
+    if groupName == 'intensity_histograms' and group.attrs.get('binWidth', fingerprint['binWidth']) != fingerprint['binWidth']:
+        return 'binWidth changed'
+    return None
+
+def getStaleProjections(root, res_lvl=0, slabBounds=None, analysisPath='analysis', groupNames=None, stamps=None):
+    # projection groups that no longer match the source or settings they would be
+    # calculated from now, as {groupName: (reason, changed timepoints)}. reason is set
+    # when the whole group is out of date, changed timepoints lists the timepoints
+    # whose source chunks were modified after they were projected
+    stale = {}
+    if analysisPath not in root:
+        return stale
+    resArray = root['0'][str(res_lvl)]
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(resArray.shape)
+    for groupName in groupNames or projectionGroupArrays:
+        if groupName not in root[analysisPath] or len(root[analysisPath][groupName]) == 0:
+            continue
+        group = root[analysisPath][groupName]
+        fingerprint = getProjectionFingerprint(root, groupName, res_lvl, slabBounds)
+        recorded = group.attrs.get('fingerprint')
+        if recorded is None:
+            reason = getLegacyFingerprintMismatch(group, groupName, fingerprint, resArray.shape, slabBounds)
+        else:
+            changedKeys = [key for key in fingerprint if recorded.get(key) != fingerprint[key]]
+            reason = None if not changedKeys else ', '.join(changedKeys) + ' changed'
+        if reason is not None:
+            stale[groupName] = (reason, [])
+            continue
+        recordedStamps = group.attrs.get('sourceStamps')
+        if recordedStamps is None:
+            continue
+        if stamps is None:
+            stamps = getSourceStamps(root, res_lvl)
+            if stamps is None:
+                return stale
+        completed = getGroupCompletedBlocks(group, groupName)
+        nT = min(len(recordedStamps), len(stamps), completed.shape[0])
+        changed = [t for t in range(nT) if recordedStamps[t] != stamps[t] and completed[t].any()]
+        if changed:
+            stale[groupName] = (None, changed)
+    return stale
+
+def checkProjectionFingerprints(root, res_lvl=0, slabBounds=None, analysisPath='analysis', groupNames=None, stamps=None):
+    # invalidate stale projections before they are resumed (see getStaleProjections):
+    # out of date groups are deleted and recalculated from scratch, timepoints with
+    # modified source chunks are marked incomplete. returns the stale groups.
+    # stamps (see getSourceStamps) are taken now unless passed in
+    groupNames = groupNames or list(projectionGroupArrays)
+    if stamps is None:
+        stamps = getSourceStamps(root, res_lvl)
+    stale = getStaleProjections(root, res_lvl, slabBounds, analysisPath, groupNames, stamps)
+    for groupName, (reason, changed) in stale.items():
+        group = root[analysisPath][groupName]
+        if reason is not None:
+            del root[analysisPath][groupName]
+            continue
+        completed = getGroupCompletedBlocks(group, groupName)
+        completed[changed] = False
+        setCompletedBlocks(group, completed)
+    # stamps of the source as it is now, the blocks projected from here on match them
+    for groupName in groupNames:
+        if analysisPath in root and groupName in root[analysisPath] and stamps is not None:
+            root[analysisPath][groupName].attrs['sourceStamps'] = stamps
+    return stale
+
+def recordProjectionFingerprints(root, projGroups, res_lvl=0, slabBounds=None, stamps=None):
+    # fingerprint of groups created or adopted by this run
+    for groupName, group in projGroups.items():
+        if 'fingerprint' in group.attrs:
+            continue
+        group.attrs['fingerprint'] = getProjectionFingerprint(root, groupName, res_lvl, slabBounds)
+        if 'sourceStamps' not in group.attrs:
+            stamps = stamps or getSourceStamps(root, res_lvl)
+            if stamps is not None:
+                group.attrs['sourceStamps'] = stamps
+
+def getInputFingerprint(group, lenT):
+    # digest of the fingerprint of a projection group and the source stamps of its
+    # first lenT timepoints, recorded by the outputs derived from it
+    stamps = group.attrs.get('sourceStamps')
+    content = json.dumps([group.attrs.get('fingerprint'), None if stamps is None else stamps[:lenT]])
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def getDepthDtype(lenZ):
+    # smallest unsigned dtype holding every z index
+    return 'u1' if lenZ <= 256 else 'u2'
+
+def getProjectionSpecs(shape, dtype, slabBounds, nTimepointsPerChunk=1):
+    # shapes, chunks and dtypes of each projection array. projections keep the
+    # source dtype, one chunk holds the full projection of a single channel so the
+    # renderers read only the channels they use
+    lenT, lenCh, lenZ, lenY, lenX = shape
+    nSlicesX = len(slabBounds['sliced_maxx'])
+    nSlicesY = len(slabBounds['sliced_maxy'])
+    tc = nTimepointsPerChunk
+    return {
+        'maxz': ((lenT,lenCh,lenY,lenX), (tc,1,lenY,lenX), dtype),
+        'maxz_depth': ((lenT,lenCh,lenY,lenX), (tc,1,lenY,lenX), getDepthDtype(lenZ)),
+        'maxx': ((lenT,lenCh,lenZ,lenY), (tc,1,lenZ,lenY), dtype),
+        'maxy': ((lenT,lenCh,lenZ,lenX), (tc,1,lenZ,lenX), dtype),
+        'sliced_maxx': ((lenT,lenCh,nSlicesX,lenZ,lenY), (tc,1,nSlicesX,lenZ,lenY), dtype),
+        'sliced_maxy': ((lenT,lenCh,nSlicesY,lenZ,lenX), (tc,1,nSlicesY,lenZ,lenX), dtype),
+        'histz': ((lenT,lenCh,nHistogramBins), (tc,lenCh,nHistogramBins), 'i4'),
+    }
+
+def getRequestedGroups(maxProjections=True, slicedMaxProjections=True, intensityHistograms=True):
+    groupNames = []
+    if maxProjections:
+        groupNames.append('max_projections')
+    if slicedMaxProjections:
+        groupNames.append('sliced_max_projections')
+    if intensityHistograms:
+        groupNames.append('intensity_histograms')
+    return groupNames
+
+def createProjectionArrays(root, shape, maxProjections=True, slicedMaxProjections=True, intensityHistograms=True, nSlices=20, histBinWidth=64,
+                           analysisPath='analysis', slabBounds=None, dtype=None, storageSpecs=None):
+    lenT, lenCh, lenZ, lenY, lenX = shape
+    analysisGroup = root.require_group(analysisPath)
+    projGroups = {}
+    projArrays = {}
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(shape, nSlices=nSlices)
+    if dtype is None:
+        dtype = root['0']['0'].dtype
+    if storageSpecs is None:
+        storageSpecs = projectionStorageDefaults
+    projSpecs = getProjectionSpecs(shape, dtype, slabBounds, storageSpecs['timepointsPerChunk'])
+    compressor = getProjectionCompressor(storageSpecs)
+
+    for groupName in getRequestedGroups(maxProjections, slicedMaxProjections, intensityHistograms):
+        group = createZarrGroup(analysisGroup, groupName)
+        if len(group) == 0:
+            # start an empty completion bitmap before any array exists
+            setCompletedBlocks(group, np.zeros((lenT, lenCh), dtype=bool))
+            if groupName == 'intensity_histograms':
+                group.attrs['binWidth'] = histBinWidth
+            if groupName == 'sliced_max_projections':
+                group.attrs['slabBounds'] = slabBounds
+        elif groupName == 'sliced_max_projections' and group.attrs.get('slabBounds', slabBounds) != slabBounds:
+            raise ValueError('Sliced max projections in ' + analysisPath + ' were calculated with a different slab layout')
+        elif 'completed' not in group.attrs:
+            # record older groups as complete before they are extended
+            setCompletedBlocks(group, getGroupCompletedBlocks(group, groupName))
+        projGroups[groupName] = group
+
+        # create zarr arrays for each projection, reuse them when resuming and
+        # extend their time axis when the source has grown
+        for projName in projectionGroupArrays[groupName]:
+            projShape, projChunks, projDtype = projSpecs[projName]
+            if projName in group:
+                projArrays[projName] = group[projName]
+                if projArrays[projName].ndim != len(projShape) or projArrays[projName].dtype != projDtype:
+                    raise ValueError(projName + ' in ' + analysisPath + ' uses the old projection layout, run migrateProjectionArrays first')
+                if projArrays[projName].shape[0] < lenT:
+                    projArrays[projName].resize(projShape)
+            else:
+                projArrays[projName] = group.zeros(projName,shape=projShape,chunks=projChunks,dtype=projDtype,compressor=compressor,
+                                                       dimension_separator=chunkKeySeparator)
+
+    return projGroups, projArrays
+
+def calcFusedProjectionsNumpy(frame):
+    # z max, z argmax, x max and y max of a (z,y,x) volume in one sweep over its
+    # z planes, each plane is reduced while it is in cache. the z index is only
+    # replaced by strictly larger values, so ties keep the first z like np.argmax
+    lenZ, lenY, lenX = frame.shape
+    maxZ = frame[0].copy()
+    depth = np.zeros((lenY, lenX), dtype=np.intp)
+    maxX = np.empty((lenZ, lenY), dtype=frame.dtype)
+    maxY = np.empty((lenZ, lenX), dtype=frame.dtype)
+    newer = np.empty((lenY, lenX), dtype=bool)
+    for z in range(lenZ):
+        plane = frame[z]
+        np.max(plane, axis=1, out=maxX[z])
+        np.max(plane, axis=0, out=maxY[z])
+        if z > 0:
+            np.greater(plane, maxZ, out=newer)
+            np.copyto(maxZ, plane, where=newer)
+            np.copyto(depth, z, where=newer)
+    return maxZ, depth, maxX, maxY
+
+if numba is not None:
+    @numba.njit(parallel=True, nogil=True)
+    def _fusedProjectionsKernel(frame, blockLen):
+        # rows of Y are split into blocks reduced in parallel. every block sweeps
+        # its rows plane by plane and keeps its own partial y max, which are
+        # combined after the parallel loop
+        lenZ, lenY, lenX = frame.shape
+        nBlocks = (lenY + blockLen - 1) // blockLen
+        maxZ = np.empty((lenY, lenX), dtype=frame.dtype)
+        depth = np.zeros((lenY, lenX), dtype=np.intp)
+        maxX = np.empty((lenZ, lenY), dtype=frame.dtype)
+        partialMaxY = np.empty((nBlocks, lenZ, lenX), dtype=frame.dtype)
+        for b in numba.prange(nBlocks):
+            y0 = b*blockLen
+            y1 = min(y0 + blockLen, lenY)
+            for z in range(lenZ):
+                for x in range(lenX):
+                    partialMaxY[b, z, x] = frame[z, y0, x]
+                for y in range(y0, y1):
+                    rowMax = frame[z, y, 0]
+                    for x in range(lenX):
+                        v = frame[z, y, x]
+                        if v > rowMax:
+                            rowMax = v
+                        if v > partialMaxY[b, z, x]:
+                            partialMaxY[b, z, x] = v
+                        if z == 0:
+                            maxZ[y, x] = v
+                        elif v > maxZ[y, x]:
+                            maxZ[y, x] = v
+                            depth[y, x] = z
+                    maxX[z, y] = rowMax
+        maxY = partialMaxY[0].copy()
+        for b in range(1, nBlocks):
+            for z in range(lenZ):
+                for x in range(lenX):
+                    if partialMaxY[b, z, x] > maxY[z, x]:
+                        maxY[z, x] = partialMaxY[b, z, x]
+        return maxZ, depth, maxX, maxY
+
+# numba's default thread pool must not be entered from several threads at once
+fusedKernelLock = threading.Lock()
+
+def calcFusedProjections(frame):
+    # (maxz, maxz_depth, maxx, maxy) of a (z,y,x) integer volume, identical to
+    # np.max and np.argmax along each axis. compiled and multithreaded over Y
+    # rows when numba is installed, a single pass in NumPy otherwise
+    if numba is None:
+        return calcFusedProjectionsNumpy(frame)
+    # a few blocks per thread to balance the load
+    blockLen = math.ceil(frame.shape[1]/(numba.get_num_threads()*4))
+    with fusedKernelLock:
+        return _fusedProjectionsKernel(np.ascontiguousarray(frame), blockLen)
+
+def canFuseProjections(frame):
+    # floating point volumes keep the NumPy reductions, whose NaN handling the
+    # strict comparisons of the fused sweep do not reproduce
+    return np.issubdtype(frame.dtype, np.integer) and frame.ndim == 3 and min(frame.shape) > 0
+
+def projectVolume(frame, projNames, nSlices=20, histBinWidth=64, slabBounds=None):
+    # compute all requested projections of a single (z,y,x) volume held in memory
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(frame.shape, nSlices=nSlices)
+    projs = {}
+    if set(projNames) & {'maxz', 'maxz_depth', 'histz', 'maxx', 'maxy'} and canFuseProjections(frame):
+        # z max, z argmax, x max and y max in a single sweep over the volume
+        fused = dict(zip(['maxz', 'maxz_depth', 'maxx', 'maxy'], calcFusedProjections(frame)))
+        projs.update({projName: fused[projName] for projName in fused if projName in projNames})
+        if 'histz' in projNames:
+            projs['histz'] = calcHistogram(fused['maxz'], histBinWidth)
+    else:
+        if 'maxz' in projNames:
+            projs['maxz'] = np.max(frame,axis=0)
+        if 'maxz_depth' in projNames:
+            projs['maxz_depth'] = np.argmax(frame,axis=0)
+        if 'histz' in projNames:
+            # intensity histogram of the z max projection, used for auto contrast
+            maxZ = projs['maxz'] if 'maxz' in projs else np.max(frame,axis=0)
+            projs['histz'] = calcHistogram(maxZ, histBinWidth)
+        if 'maxx' in projNames:
+            projs['maxx'] = np.max(frame,axis=2)
+        if 'maxy' in projNames:
+            projs['maxy'] = np.max(frame,axis=1)
+    if 'sliced_maxx' in projNames:
+        # one segmented reduction over all x slabs, (z,y,slab) -> (slab,z,y)
+        projs['sliced_maxx'] = reduceSlabs(frame, slabBounds['sliced_maxx'], axis=2)
+    if 'sliced_maxy' in projNames:
+        # one segmented reduction over all y slabs, (z,slab,x) -> (slab,z,x)
+        projs['sliced_maxy'] = reduceSlabs(frame, slabBounds['sliced_maxy'], axis=1)
+    return projs
+
+class stageTimer:
+    # accumulates wall time, bytes and chunk counts per named stage. times of
+    # stages running in several threads are summed over the threads
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.startTime = time.perf_counter()
+
+    def _add(self, name, seconds, nBytes=0, nChunks=0):
+        peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0, 'chunks': 0, 'peakRSSBytes': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['bytes'] += int(nBytes)
+            stage['chunks'] += int(nChunks)
+            stage['peakRSSBytes'] = max(stage['peakRSSBytes'], peakRSS)
+
+    def _summary(self):
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        return {
+            'wallTime': time.perf_counter() - self.startTime,
+            'peakRSSBytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+            'stages': stages,
+        }
+
+    def _writeJSON(self, jsonFile):
+        with open(jsonFile, 'w') as f:
+            json.dump(self._summary(), f, indent=4)
+
+# stage timer of the running script, instrumentation is off while it is None
+activeStageTimer = None
+
+def enableInstrumentation():
+    global activeStageTimer
+    activeStageTimer = stageTimer()
+    return activeStageTimer
+
+def disableInstrumentation():
+    global activeStageTimer
+    activeStageTimer = None
+
+def writeInstrumentation(jsonFile):
+    # write the stage timings of the active timer as JSON, nothing when instrumentation is off
+    if activeStageTimer is not None:
+        activeStageTimer._writeJSON(jsonFile)
+
+def getInstrumentationFromJSON(jsonFile):
+    # optional instrumentation settings, missing keys fall back to the defaults
+    instrumentation = {"enabled": False}
+    with open(jsonFile) as f:
+        instrumentation.update(json.load(f).get("instrumentation", {}))
+    return instrumentation
+
+def startStage():
+    # start time of a timed stage, None when instrumentation is off
+    return None if activeStageTimer is None else time.perf_counter()
+
+def endStage(name, t0, nBytes=0, nChunks=0):
+    # record the time since t0 under name and return the start of the next stage
+    timer = activeStageTimer
+    if t0 is None or timer is None:
+        return None
+    t1 = time.perf_counter()
+    timer._add(name, t1 - t0, nBytes, nChunks)
+    return t1
+
+def getChunkCount(array, selection):
+    # number of chunks of a zarr array touched by a basic selection
+    nChunks = 1
+    for index, length, chunkLen in zip(selection + (slice(None),)*(array.ndim - len(selection)), array.shape, array.chunks):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(length)
+            nChunks *= 0 if stop <= start else (stop - 1)//chunkLen - start//chunkLen + 1
+    return nChunks
+
+def getTileShape(volumeShape, chunks, itemsize, memoryLimit):
+    # largest (z,y,x) tile aligned to the chunk grid whose data and reduction
+    # temporaries fit in memoryLimit bytes, never smaller than one chunk.
+    # the axis spanning the most chunks is halved first, Y and X before Z
+    tileShape = list(volumeShape)
+    while 2*int(np.prod(tileShape))*itemsize > memoryLimit:
+        axes = [k for k in (1, 2, 0) if tileShape[k] > chunks[k]]
+        if not axes:
+            break
+        k = max(axes, key=lambda k: tileShape[k]/chunks[k])
+        tileShape[k] = math.ceil(math.ceil(tileShape[k]/chunks[k])/2)*chunks[k]
+    return tuple(tileShape)
+
+def getAccumulatorBytes(volumeShape, itemsize, slabBounds):
+    # memory held by the running projections of one volume
+    lenZ, lenY, lenX = volumeShape
+    nSlicesX = len(slabBounds['sliced_maxx'])
+    nSlicesY = len(slabBounds['sliced_maxy'])
+    return (lenY*lenX*(itemsize + 8) + (lenZ*lenY)*(1 + nSlicesX)*itemsize + (lenZ*lenX)*(1 + nSlicesY)*itemsize)
+
+def projectVolumeTiled(resArray, i, j, projNames, tileShape, nSlices=20, histBinWidth=64, slabBounds=None):
+    # same projections as projectVolume for volume (i,j) of resArray, read one
+    # (z,y,x) tile at a time into running max accumulators. z tiles are visited in
+    # order and the z index is only replaced by strictly larger values, so ties
+    # keep the first z like np.argmax
+    _, _, lenZ, lenY, lenX = resArray.shape
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(resArray.shape, nSlices=nSlices)
+    dtype = resArray.dtype
+    lowest = np.iinfo(dtype).min if np.issubdtype(dtype, np.integer) else -np.inf
+    accShapes = {
+        'maxz': (lenY, lenX),
+        'maxx': (lenZ, lenY),
+        'maxy': (lenZ, lenX),
+        'sliced_maxx': (len(slabBounds['sliced_maxx']), lenZ, lenY),
+        'sliced_maxy': (len(slabBounds['sliced_maxy']), lenZ, lenX),
+    }
+    accNames = set(projNames) & set(accShapes)
+    if 'maxz_depth' in projNames or 'histz' in projNames:
+        accNames.add('maxz')
+    accs = {name: np.full(accShapes[name], lowest, dtype=dtype) for name in accNames}
+    depth = np.zeros((lenY, lenX), dtype=np.intp) if 'maxz_depth' in projNames else None
+
+    tileZ, tileY, tileX = tileShape
+    for z0, y0, x0 in itertools.product(range(0, lenZ, tileZ), range(0, lenY, tileY), range(0, lenX, tileX)):
+        zs, ys, xs = slice(z0, min(z0 + tileZ, lenZ)), slice(y0, min(y0 + tileY, lenY)), slice(x0, min(x0 + tileX, lenX))
+        t = startStage()
+        tile = resArray[i, j, zs, ys, xs]
+        t = endStage('read', t, tile.nbytes, getChunkCount(resArray, (i, j, zs, ys, xs)))
+
+        if not accNames.isdisjoint({'maxz', 'maxx', 'maxy'}):
+            if canFuseProjections(tile):
+                tileMax, tileDepth, tileMaxX, tileMaxY = calcFusedProjections(tile)
+            else:
+                tileMax, tileDepth, tileMaxX, tileMaxY = np.max(tile, axis=0), None, np.max(tile, axis=2), np.max(tile, axis=1)
+        if 'maxz' in accs:
+            accMax = accs['maxz'][ys, xs]
+            if depth is not None:
+                newer = tileMax > accMax
+                if tileDepth is None:
+                    tileDepth = np.argmax(tile, axis=0)
+                depth[ys, xs][newer] = z0 + tileDepth[newer]
+            np.maximum(accMax, tileMax, out=accMax)
+        if 'maxx' in accs:
+            accMax = accs['maxx'][zs, ys]
+            np.maximum(accMax, tileMaxX, out=accMax)
+        if 'maxy' in accs:
+            accMax = accs['maxy'][zs, xs]
+            np.maximum(accMax, tileMaxY, out=accMax)
+        for projName, axis, tileSlice in [('sliced_maxx', 2, xs), ('sliced_maxy', 1, ys)]:
+            if projName not in accs:
+                continue
+            # slabs overlapping the tile, clipped to it
+            overlapping = [(k, max(start, tileSlice.start) - tileSlice.start, min(stop, tileSlice.stop) - tileSlice.start)
+                           for k, (start, stop) in enumerate(slabBounds[projName]) if start < tileSlice.stop and stop > tileSlice.start]
+            if not overlapping:
+                continue
+            slabIndex = [k for k, _, _ in overlapping]
+            slabMaxes = reduceSegments(tile, [[start, stop] for _, start, stop in overlapping], axis)
+            otherSlice = ys if axis == 2 else xs
+            accs[projName][slabIndex, zs, otherSlice] = np.maximum(accs[projName][slabIndex, zs, otherSlice], slabMaxes)
+        endStage('reduce', t, tile.nbytes)
+
+    projs = {projName: accs[projName] for projName in projNames if projName in accs}
+    if depth is not None:
+        projs['maxz_depth'] = depth
+    if 'histz' in projNames:
+        projs['histz'] = calcHistogram(accs['maxz'], histBinWidth)
+    return projs
+
+def runBlockPipeline(blocks, readBlock, reduceBlock, writeBlock, nReadThreads=2, maxInFlight=2):
+    # bounded three stage pipeline: a thread pool reads blocks ahead, the calling
+    # thread reduces them and a single writer thread writes the results behind.
+    # at most maxInFlight volumes are read or being reduced at once.
+    # returns per stage busy and stall times
+    stats = {'blocks': len(blocks), 'bytesRead': 0,
+             'readTime': 0., 'reduceTime': 0., 'reduceWaitRead': 0., 'reduceWaitWrite': 0.,
+             'writeTime': 0., 'writeWaitReduce': 0.}
+    statsLock = threading.Lock()
+    writeQueue = queue.Queue(maxsize=maxInFlight)
+    writeErrors = []
+
+    def timedRead(block):
+        t0 = time.perf_counter()
+        frame = readBlock(block)
+        with statsLock:
+            stats['readTime'] += time.perf_counter() - t0
+            if frame is not None:
+                stats['bytesRead'] += frame.nbytes
+        return frame
+
+    def writer():
+        while True:
+            t0 = time.perf_counter()
+            item = writeQueue.get()
+            stats['writeWaitReduce'] += time.perf_counter() - t0
+            if item is None:
+                return
+            if writeErrors:
+                continue
+            t0 = time.perf_counter()
+            try:
+                writeBlock(*item)
+            except Exception as e:
+                writeErrors.append(e)
+            stats['writeTime'] += time.perf_counter() - t0
+
+    startTime = time.perf_counter()
+    writerThread = threading.Thread(target=writer, daemon=True)
+    writerThread.start()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nReadThreads) as readPool:
+            blockIter = iter(blocks)
+            reads = collections.deque()
+            for block in itertools.islice(blockIter, maxInFlight):
+                reads.append((block, readPool.submit(timedRead, block)))
+
+            for _ in tqdm(range(len(blocks))):
+                block, read = reads.popleft()
+                t0 = time.perf_counter()
+                frame = read.result()
+                stats['reduceWaitRead'] += time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                projs = reduceBlock(block, frame)
+                del frame
+                stats['reduceTime'] += time.perf_counter() - t0
+
+                # the reduced volume frees a slot for the next read
+                for nextBlock in itertools.islice(blockIter, 1):
+                    reads.append((nextBlock, readPool.submit(timedRead, nextBlock)))
+
+                t0 = time.perf_counter()
+                writeQueue.put((block, projs))
+                stats['reduceWaitWrite'] += time.perf_counter() - t0
+                if writeErrors:
+                    break
+    finally:
+        writeQueue.put(None)
+        writerThread.join()
+    if writeErrors:
+        raise writeErrors[0]
+
+    stats['wallTime'] = time.perf_counter() - startTime
+    stats['blocksPerSecond'] = stats['blocks']/stats['wallTime'] if stats['wallTime'] > 0 else 0.
+    stats['readMBPerSecond'] = stats['bytesRead']/1e6/stats['wallTime'] if stats['wallTime'] > 0 else 0.
+    return stats
+
+def formatPipelineStats(stats):
+    return (f"{stats['blocks']} blocks in {stats['wallTime']:.1f} s ({stats['blocksPerSecond']:.2f} blocks/s, "
+            f"{stats['readMBPerSecond']:.1f} MB/s read); "
+            f"read {stats['readTime']:.1f} s busy over all threads; "
+            f"reduce {stats['reduceTime']:.1f} s busy, {stats['reduceWaitRead']:.1f} s waiting for reads, "
+            f"{stats['reduceWaitWrite']:.1f} s waiting for writes; "
+            f"write {stats['writeTime']:.1f} s busy, {stats['writeWaitReduce']:.1f} s idle")
+
+def calcOrthoMaxProjections(root, res_lvl=0, maxProjections=True, slicedMaxProjections=True, intensityHistograms=True,
+                            nSlices=20, nTimepoints=None, prefetchThreads=2, maxInFlight=2, analysisPath='analysis', slabBounds=None,
+                            storageSpecs=None, memoryLimit=None, stamps=None):
+    # single pass projection engine: each (t,ch) volume is read from disk once
+    # and every requested projection is computed from the in-memory copy.
+    # finished blocks are recorded so an interrupted run resumes where it stopped,
+    # nTimepoints limits the projection to the first timepoints of the source.
+    # with prefetchThreads > 0 (the default, as in getProjectionParamsFromJSON) reads,
+    # reductions and writes overlap in a bounded pipeline and the per stage timings
+    # are returned, 0 projects one block at a time. slabBounds (see calcSlabBounds)
+    # replaces the nSlices layout of the sliced projections, storageSpecs sets the
+    # compression and chunking of new arrays (see getProjectionStorageFromJSON).
+    # volumes that do not fit in memoryLimit bytes are projected tile by tile.
+    # stamps of the source taken by the caller (see getSourceStamps) save a stat
+    # of every source chunk
 
     # define resolution level
     resArray = root['0'][str(res_lvl)]
 
     # get dataset dimensions
     lenT, lenCh, lenZ, lenY, lenX = resArray.shape
-    
-    analysisGroup = root['analysis']
-
-    # create max projections group
-    maxProjectionsGroup = createZarrGroup(analysisGroup, 'max_projections')
-
-    # create zarr arrays for each max projection 
-    maxZ = maxProjectionsGroup.zeros('maxz',shape=(lenT,lenCh,2,lenY,lenX),chunks=(1,lenCh,2,lenY,lenX))
-    maxX = maxProjectionsGroup.zeros('maxx',shape=(lenT,lenCh,lenZ,lenY),chunks=(1,lenCh,lenZ,lenY))
-    maxY = maxProjectionsGroup.zeros('maxy',shape=(lenT,lenCh,lenZ,lenX),chunks=(1,lenCh,lenZ,lenX))
-
-    # iterate through each timepoint and compute max projections
-    for i in tqdm(range(lenT)):
+    if nTimepoints is not None:
+        lenT = min(lenT, nTimepoints)
+
+    histBinWidth = getHistogramBinWidth(resArray.dtype)
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(resArray.shape, nSlices=nSlices)
+
+    tileShape = None
+    itemsize = resArray.dtype.itemsize
+    if memoryLimit is not None and 2*lenZ*lenY*lenX*itemsize > memoryLimit:
+        accumulatorBytes = getAccumulatorBytes((lenZ, lenY, lenX), itemsize, slabBounds)
+        tileShape = getTileShape((lenZ, lenY, lenX), resArray.chunks[2:], itemsize, memoryLimit - accumulatorBytes)
+    if stamps is None:
+        stamps = getSourceStamps(root, res_lvl)
+    checkProjectionFingerprints(root, res_lvl, slabBounds, analysisPath,
+                                getRequestedGroups(maxProjections, slicedMaxProjections, intensityHistograms), stamps)
+    projGroups, projArrays = createProjectionArrays(root, (lenT, lenCh, lenZ, lenY, lenX), maxProjections, slicedMaxProjections,
+                                                    intensityHistograms, nSlices, histBinWidth, analysisPath, slabBounds,
+                                                    resArray.dtype, storageSpecs)
+    recordProjectionFingerprints(root, projGroups, res_lvl, slabBounds, stamps)
+    completed = {groupName: getGroupCompletedBlocks(group, groupName) for groupName, group in projGroups.items()}
+
+    # (t,ch) blocks still missing from at least one projection group
+    pendingBlocks = []
+    for i in range(lenT):
         for j in range(lenCh):
-            frame = resArray[i, j, :, :, :]
-            maxZ[i,j] = [np.max(frame,axis=0), np.argmax(frame,axis=0)]
-            maxX[i,j] = np.max(frame,axis=2)
-            maxY[i,j] = np.max(frame,axis=1)
+            pendingGroups = [groupName for groupName in projGroups if not completed[groupName][i,j]]
+            if pendingGroups:
+                pendingBlocks.append((i, j, pendingGroups))
+
+    def readBlock(block):
+        i, j, _ = block
+        if tileShape is not None:
+            # tiles are read while reducing
+            return None
+        t0 = startStage()
+        frame = resArray[i, j, :, :, :]
+        endStage('read', t0, frame.nbytes, getChunkCount(resArray, (i, j)))
+        return frame
+
+    def reduceBlock(block, frame):
+        _, _, pendingGroups = block
+        projNames = [projName for groupName in pendingGroups for projName in projectionGroupArrays[groupName]]
+        if tileShape is not None:
+            i, j, _ = block
+            return projectVolumeTiled(resArray, i, j, projNames, tileShape, nSlices, histBinWidth, slabBounds)
+        t0 = startStage()
+        projs = projectVolume(frame, projNames, nSlices, histBinWidth, slabBounds)
+        endStage('reduce', t0, frame.nbytes)
+        return projs
+
+    checkpoints = {groupName: completionCheckpoint(group, completed[groupName]) for groupName, group in projGroups.items()}
+
+    def writeBlock(block, projs):
+        i, j, pendingGroups = block
+        t0 = startStage()
+        for projName, proj in projs.items():
+            projArrays[projName][i,j] = proj
+        for groupName in pendingGroups:
+            checkpoints[groupName]._mark((i, j))
+        endStage('write', t0, sum(np.asarray(proj).nbytes for proj in projs.values()),
+                 sum(getChunkCount(projArrays[projName], (i, j)) for projName in projs))
+
+    try:
+        if prefetchThreads > 0:
+            return runBlockPipeline(pendingBlocks, readBlock, reduceBlock, writeBlock, prefetchThreads, maxInFlight)
+
+        # compute the missing projections one block at a time
+        for block in tqdm(pendingBlocks):
+            writeBlock(block, reduceBlock(block, readBlock(block)))
+    finally:
+        # blocks written before an error are kept
+        for checkpoint in checkpoints.values():
+            checkpoint._flush()
+
+def reduceSlabsDask(srcArray, slabBounds, axis):
+    # lazy slab maxima along axis of a (t,ch,z,y,x) dask array, stacked on axis 2.
+    # each disjoint segment is reduced once and shared by the slabs covering it
+    segmentStarts, slabSegments = getSlabSegments(slabBounds, srcArray.shape[axis])
+    segmentBounds = segmentStarts + [srcArray.shape[axis]]
+    index = [slice(None)]*srcArray.ndim
+    segmentMaxes = []
+    for k in range(len(segmentStarts)):
+        index[axis] = slice(segmentBounds[k], segmentBounds[k+1])
+        segmentMaxes.append(srcArray[tuple(index)].max(axis=axis))
+    return da.stack([segmentMaxes[first] if last - first == 1 else da.stack(segmentMaxes[first:last]).max(axis=0)
+                     for first, last in slabSegments], axis=2)
+
+def buildDaskProjections(srcArray, projNames, nSlices=20, histBinWidth=64, slabBounds=None):
+    # lazy chunk-aligned dask reductions over a (t,ch,z,y,x) dask array
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(srcArray.shape, nSlices=nSlices)
+    projs = {}
+    if 'maxz' in projNames:
+        projs['maxz'] = srcArray.max(axis=2)
+    if 'maxz_depth' in projNames:
+        projs['maxz_depth'] = srcArray.argmax(axis=2)
+    if 'histz' in projNames:
+        # one histogram per (t,ch) of the z max projection
+        maxZ = srcArray.max(axis=2).rechunk({0: 1, 1: 1, 2: -1, 3: -1})
+        projs['histz'] = maxZ.map_blocks(lambda block: calcHistogram(block, histBinWidth)[np.newaxis, np.newaxis],
+                                         drop_axis=[2, 3], new_axis=2, chunks=(1, 1, nHistogramBins), dtype='i4')
+    if 'maxx' in projNames:
+        projs['maxx'] = srcArray.max(axis=4)
+    if 'maxy' in projNames:
+        projs['maxy'] = srcArray.max(axis=3)
+    if 'sliced_maxx' in projNames:
+        projs['sliced_maxx'] = reduceSlabsDask(srcArray, slabBounds['sliced_maxx'], axis=4)
+    if 'sliced_maxy' in projNames:
+        projs['sliced_maxy'] = reduceSlabsDask(srcArray, slabBounds['sliced_maxy'], axis=3)
+    return projs
+
+def getRegionChunks(t0, t1, chunkLen):
+    # chunk lengths of the time axis of region t0:t1 aligned to the chunks of the
+    # zarr array, so no two dask tasks write to the same chunk
+    bounds = [t0] + list(range((t0//chunkLen + 1)*chunkLen, t1, chunkLen)) + [t1]
+    return tuple(stop - start for start, stop in zip(bounds, bounds[1:]))
+
+def getPendingBatches(pendingT, batchSize):
+    # split pending timepoints into runs of consecutive timepoints of at most batchSize
+    batches = []
+    for t in pendingT:
+        if batches and t == batches[-1][1] and t - batches[-1][0] < batchSize:
+            batches[-1][1] = t + 1
+        else:
+            batches.append([t, t + 1])
+    return batches
 
+def calcOrthoMaxProjectionsDask(root, res_lvl=0, maxProjections=True, slicedMaxProjections=True, intensityHistograms=True,
+                                nSlices=20, nTimepoints=None, client=None, batchSize=16, analysisPath='analysis', slabBounds=None,
+                                storageSpecs=None, stamps=None):
+    # dask backend for calcOrthoMaxProjections, runs on the default scheduler
+    # or on the given dask.distributed client (LocalCluster or remote cluster).
+    # timepoints are computed in batches and checkpointed every completionCheckpointInterval blocks
 
-def calcSlicedMaxProjections(root, res_lvl=0):
     # define resolution level
     resArray = root['0'][str(res_lvl)]
+    srcArray = da.from_zarr(resArray)
+    lenT, lenCh = resArray.shape[:2]
+    if nTimepoints is not None:
+        lenT = min(lenT, nTimepoints)
+
+    histBinWidth = getHistogramBinWidth(resArray.dtype)
+    if slabBounds is None:
+        slabBounds = calcSlabBounds(resArray.shape, nSlices=nSlices)
+    if stamps is None:
+        stamps = getSourceStamps(root, res_lvl)
+    checkProjectionFingerprints(root, res_lvl, slabBounds, analysisPath,
+                                getRequestedGroups(maxProjections, slicedMaxProjections, intensityHistograms), stamps)
+    projGroups, projArrays = createProjectionArrays(root, (lenT,) + resArray.shape[1:], maxProjections, slicedMaxProjections,
+                                                    intensityHistograms, nSlices, histBinWidth, analysisPath, slabBounds,
+                                                    resArray.dtype, storageSpecs)
+    recordProjectionFingerprints(root, projGroups, res_lvl, slabBounds, stamps)
+    completed = {groupName: getGroupCompletedBlocks(group, groupName) for groupName, group in projGroups.items()}
+
+    pendingT = [t for t in range(lenT) if not all(completed[groupName][t].all() for groupName in projGroups)]
+    checkpoints = {groupName: completionCheckpoint(group, completed[groupName]) for groupName, group in projGroups.items()}
+    try:
+        for t0, t1 in tqdm(getPendingBatches(pendingT, batchSize)):
+            pendingGroups = [groupName for groupName in projGroups if not completed[groupName][t0:t1].all()]
+            projNames = [projName for groupName in pendingGroups for projName in projectionGroupArrays[groupName]]
+            projs = buildDaskProjections(srcArray[t0:t1], projNames, nSlices, histBinWidth, slabBounds)
+
+            # all outputs are stored in one graph so every source chunk is read once
+            writes = []
+            for projName, proj in projs.items():
+                projArray = projArrays[projName]
+                projChunks = (getRegionChunks(t0, t1, projArray.chunks[0]),) + projArray.chunks[1:]
+                writes.append(da.to_zarr(proj.astype(projArray.dtype).rechunk(projChunks), projArray,
+                                         region=(slice(t0, t1),), compute=False))
+            tStage = startStage()
+            dask.compute(*writes, scheduler=client)
+            endStage('dask_compute', tStage, srcArray[t0:t1].nbytes, getChunkCount(resArray, (slice(t0, t1),)))
+
+            for groupName in pendingGroups:
+                checkpoints[groupName]._mark(slice(t0, t1))
+    finally:
+        for checkpoint in checkpoints.values():
+            checkpoint._flush()
+
+def watchMaxProjections(root, res_lvl=0, maxProjections=True, slicedMaxProjections=True, intensityHistograms=True, nSlices=20,
+                        pollInterval=60, settleFrames=1, timeout=None, callback=None, slabBounds=None, storageSpecs=None,
+                        memoryLimit=None):
+    # live acquisition mode: poll the source array and project new timepoints as
+    # they land. the newest settleFrames timepoints are left alone while they may
+    # still be written. stops once the time axis has not grown for timeout seconds,
+    # then projects the remaining timepoints. callback(root, lenT) runs after each update.
+    # the source chunks of every timepoint are statted on the first update only,
+    # later updates stat the timepoints not projected yet
+    lastGrowth = time.time()
+    lenTSource = 0
+    lenTProjected = 0
+    stamps = None
+    while True:
+        # reopen the source array so its metadata reflects the current shape
+        lenTCurrent = root['0'][str(res_lvl)].shape[0]
+        if lenTCurrent > lenTSource:
+            lenTSource = lenTCurrent
+            lastGrowth = time.time()
+
+        finished = timeout is not None and time.time() - lastGrowth > timeout
+        lenT = lenTSource if finished else lenTSource - settleFrames
+        if lenT > lenTProjected:
+            stamps = getSourceStamps(root, res_lvl, range(lenTProjected, lenTSource), stamps)
+            calcOrthoMaxProjections(root, res_lvl, maxProjections, slicedMaxProjections, intensityHistograms,
+                                    nSlices=nSlices, nTimepoints=lenT, slabBounds=slabBounds, storageSpecs=storageSpecs,
+                                    memoryLimit=memoryLimit, stamps=stamps)
+            lenTProjected = lenT
+            if callback is not None:
+                callback(root, lenT)
+
+        if finished:
+            return lenTProjected
+        time.sleep(pollInterval)
+
+def getPyramidLevels(root):
+    # resolution levels of the source pyramid, finest first
+    return sorted((int(lvl) for lvl in root['0'].array_keys() if lvl.isdigit()))
+
+def getPyramidVoxelDims(root, xmlFile, res_lvl=0):
+    # the OME XML describes the full resolution image, voxel sizes of coarser
+    # levels are scaled by how much each axis was downsampled
+    voxelDims = getVoxelDimsFromXML(xmlFile, res_lvl=0)
+    _, _, lenZ0, lenY0, lenX0 = root['0']['0'].shape
+    _, _, lenZ, lenY, lenX = root['0'][str(res_lvl)].shape
+    return [voxelDims[0]*lenX0/lenX, voxelDims[1]*lenY0/lenY, voxelDims[2]*lenZ0/lenZ]
+
+def getSlabBoundsFromJSON(jsonFile, root, xmlFile, res_lvl=0):
+    # slab layout of the sliced projections from the slabThickness and slabStride
+    # projection parameters (in microns), None keeps the default nSlices layout
+    projectionParams = getProjectionParamsFromJSON(jsonFile)
+    if projectionParams['slabThickness'] is None:
+        return None
+    voxelDims = getPyramidVoxelDims(root, xmlFile, res_lvl)
+    return calcSlabBounds(root['0'][str(res_lvl)].shape, voxelDims, projectionParams['slabThickness'], projectionParams['slabStride'])
+
+def selectPreviewLevel(root, targetSize=None, timeBudget=None):
+    # finest pyramid level whose XY size fits targetSize (in px), and whose
+    # projection is estimated to finish within timeBudget (in s). the estimate
+    # times the projection of one volume at each level, coarsest first
+    levels = getPyramidLevels(root)
+    candidates = levels
+    if targetSize is not None:
+        candidates = [lvl for lvl in levels if max(root['0'][str(lvl)].shape[-2:]) <= targetSize] or levels[-1:]
+    if timeBudget is None:
+        return candidates[0]
+
+    selected = candidates[-1]
+    for lvl in reversed(candidates):
+        resArray = root['0'][str(lvl)]
+        lenT, lenCh = resArray.shape[:2]
+        t0 = time.perf_counter()
+        projectVolume(resArray[0, 0, :, :, :], projectionGroupArrays['max_projections'])
+        if (time.perf_counter() - t0)*lenT*lenCh > timeBudget:
+            break
+        selected = lvl
+    return selected
+
+def calcPreviewProjections(root, targetSize=512, timeBudget=None, res_lvl=None, slicedMaxProjections=True, analysisPath='analysis/preview', **kwargs):
+    # quick look projections from a coarser pyramid level, picked automatically
+    # unless res_lvl is given, written to a separate analysis group
+    if res_lvl is None:
+        res_lvl = selectPreviewLevel(root, targetSize, timeBudget)
+    # projections of another level are recalculated, see checkProjectionFingerprints
+    previewGroup = root.require_group(analysisPath)
+    previewGroup.attrs['res_lvl'] = res_lvl
+    stats = calcOrthoMaxProjections(root, res_lvl, maxProjections=True, slicedMaxProjections=slicedMaxProjections,
+                                    analysisPath=analysisPath, **kwargs)
+    return res_lvl, stats
 
-    # get dataset dimensions
-    lenT, lenCh, lenZ, lenY, lenX = resArray.shape
-
-    analysisGroup = root['analysis']
-
-    # create max projections group
-    slicedMaxProjectionsGroup = createZarrGroup(analysisGroup, 'sliced_max_projections')
-
-    # set number of slices
-    #sliceDepth = 83 # 83px*2.41um/px = 200 um
-    nSlices = 20
-    sliceDepthX = lenX//(nSlices-1)
-    sliceDepthY = lenY//(nSlices-1)
-    #nSlicesX = math.ceil(lenX/sliceDepth)
-    #nSlicesY = math.ceil(lenY/sliceDepth)
-
-    # create zarr arrays for each max projection
-    slicedMaxX = slicedMaxProjectionsGroup.zeros('sliced_maxx',shape=(lenT,lenCh,nSlices,lenZ,lenY),chunks=(1,1,2,lenZ,lenY))
-    slicedMaxY = slicedMaxProjectionsGroup.zeros('sliced_maxy',shape=(lenT,lenCh,nSlices,lenZ,lenX),chunks=(1,1,2,lenZ,lenX))
+def calcMaxProjections(root, res_lvl=0):
+    calcOrthoMaxProjections(root, res_lvl, maxProjections=True, slicedMaxProjections=False, intensityHistograms=True)
+
+def calcSlicedMaxProjections(root, res_lvl=0, slabBounds=None, storageSpecs=None, memoryLimit=None, stamps=None):
+    calcOrthoMaxProjections(root, res_lvl, maxProjections=False, slicedMaxProjections=True, intensityHistograms=False,
+                            slabBounds=slabBounds, storageSpecs=storageSpecs, memoryLimit=memoryLimit, stamps=stamps)
+
+def calcIntensityHistograms(root, analysisPath='analysis', storageSpecs=None):
+    # histograms for datasets whose max projections were calculated without them,
+    # reads the stored z max projections instead of the source volumes
+    maxZ = root[analysisPath]['max_projections']['maxz']
+    lenT, lenCh = maxZ.shape[:2]
+    histBinWidth = getHistogramBinWidth(root['0']['0'].dtype)
+    projGroups, projArrays = createProjectionArrays(root, (lenT, lenCh, 1, 1, 1), maxProjections=False, slicedMaxProjections=False,
+                                                    intensityHistograms=True, histBinWidth=histBinWidth, analysisPath=analysisPath,
+                                                    storageSpecs=storageSpecs)
+    group = projGroups['intensity_histograms']
+    maxGroup = root[analysisPath]['max_projections']
+    if 'fingerprint' not in group.attrs and 'fingerprint' in maxGroup.attrs:
+        # same source as the max projections they are calculated from
+        fingerprint = {key: maxGroup.attrs['fingerprint'][key] for key in ['version', 'source']}
+        group.attrs['fingerprint'] = dict(fingerprint, binWidth=histBinWidth)
+        if 'sourceStamps' in maxGroup.attrs:
+            group.attrs['sourceStamps'] = maxGroup.attrs['sourceStamps']
+    completed = getGroupCompletedBlocks(group, 'intensity_histograms')
+    checkpoint = completionCheckpoint(group, completed)
+    try:
+        for i in tqdm(range(lenT)):
+            if completed[i].all():
+                continue
+            maxZi = maxZ[i]
+            projArrays['histz'][i] = [calcHistogram(maxZi[j], histBinWidth) for j in range(lenCh)]
+            checkpoint._mark(i)
+    finally:
+        checkpoint._flush()
+
+def getTimeBlocks(array, t0, t1):
+    # (start, stop) of the time chunks of a projection array within t0:t1, so each
+    # read decodes whole chunks and holds at most one chunk of timepoints
+    if t0 >= t1:
+        return []
+    bounds = np.cumsum((t0,) + getRegionChunks(t0, t1, array.chunks[0]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def getCompletedTimepoints(group, groupName):
+    # number of leading timepoints with projections finished for every channel
+    completed = getGroupCompletedBlocks(group, groupName).all(axis=1)
+    return len(completed) if completed.all() else int(np.argmin(completed))
+
+def getWindowStarts(lenT, window, stride=None):
+    # first timepoint of every full sliding window of window timepoints
+    stride = stride or window
+    if window is None or window > lenT:
+        return []
+    return list(range(0, lenT - window + 1, stride))
+
+def calcTemporalProjections(root, window=None, stride=None, projNames=('maxz', 'maxy'), analysisPath='analysis', storageSpecs=None):
+    # max and mean over all timepoints of the z and y max projections, and over
+    # sliding windows of window timepoints every stride timepoints. the stored
+    # projections are streamed one time chunk at a time into running max and sum
+    # accumulators, only the windows overlapping the current chunk are held
+    if storageSpecs is None:
+        storageSpecs = projectionStorageDefaults
+    compressor = getProjectionCompressor(storageSpecs)
+    maxGroup = root[analysisPath]['max_projections']
+    lenT = getCompletedTimepoints(maxGroup, 'max_projections')
+    windowStarts = getWindowStarts(lenT, window, stride)
+    settings = {'lenT': lenT, 'window': window, 'stride': stride, 'windowStarts': windowStarts, 'projNames': list(projNames),
+                'input': getInputFingerprint(maxGroup, lenT)}
+
+    group = createZarrGroup(root[analysisPath], 'temporal_projections')
+    if all(group.attrs.get(key) == value for key, value in settings.items()):
+        return group
+    for name in list(group.array_keys()):
+        del group[name]
+
+    for projName in projNames:
+        projArray = maxGroup[projName]
+        lenCh = projArray.shape[1]
+        frameShape = projArray.shape[2:]
+        tMax = np.zeros((lenCh,) + frameShape, dtype=projArray.dtype)
+        tSum = np.zeros((lenCh,) + frameShape, dtype='float64')
+        windowMax = {}
+        windowSum = {}
+        if windowStarts:
+            windowMaxArray = group.zeros('window_tmax_' + projName, shape=(len(windowStarts), lenCh) + frameShape,
+                                         chunks=(1, 1) + frameShape, dtype=projArray.dtype, compressor=compressor,
+                                         dimension_separator=chunkKeySeparator)
+            windowMeanArray = group.zeros('window_tmean_' + projName, shape=(len(windowStarts), lenCh) + frameShape,
+                                          chunks=(1, 1) + frameShape, dtype='float32', compressor=compressor,
+                                          dimension_separator=chunkKeySeparator)
+
+        for t0, t1 in tqdm(getTimeBlocks(projArray, 0, lenT)):
+            tStage = startStage()
+            block = projArray[t0:t1]
+            tStage = endStage('read_projections', tStage, block.nbytes, getChunkCount(projArray, (slice(t0, t1),)))
+            # accumulators start from the first block, so float projections keep negative values
+            tMax = block.max(axis=0) if t0 == 0 else np.maximum(tMax, block.max(axis=0), out=tMax)
+            tSum += block.sum(axis=0, dtype='float64')
+            for k, start in enumerate(windowStarts):
+                stop = start + window
+                if stop <= t0 or start >= t1:
+                    continue
+                part = block[max(start, t0) - t0:min(stop, t1) - t0]
+                if k not in windowMax:
+                    windowMax[k] = part.max(axis=0)
+                    windowSum[k] = part.sum(axis=0, dtype='float64')
+                else:
+                    np.maximum(windowMax[k], part.max(axis=0), out=windowMax[k])
+                    windowSum[k] += part.sum(axis=0, dtype='float64')
+                if stop <= t1:
+                    # window complete, write it and free its accumulators
+                    windowMaxArray[k] = windowMax.pop(k)
+                    windowMeanArray[k] = windowSum.pop(k)/window
+            endStage('reduce', tStage, block.nbytes)
+
+        group.array('tmax_' + projName, tMax, chunks=(1,) + frameShape, compressor=compressor,
+                    dimension_separator=chunkKeySeparator)
+        group.array('tmean_' + projName, (tSum/max(lenT, 1)).astype('float32'), chunks=(1,) + frameShape, compressor=compressor,
+                    dimension_separator=chunkKeySeparator)
+    group.attrs.update(settings)
+    return group
 
-    for i in tqdm(range(lenT)):
-        for j in range(lenCh):
-            for k in range(nSlices-1):
-                rangeX = [k*sliceDepthX, (k+1)*sliceDepthX]
-                frame = resArray[i,j,:,:,rangeX[0]:rangeX[1]]
-                slicedMaxX[i,j,k] = np.max(frame,axis=2)
-            #fill last chunk with the rest of the data
-            rangeX = [(nSlices-1)*sliceDepthX, lenX]
-            frame = resArray[i,j,:,:,rangeX[0]:rangeX[1]]
-            slicedMaxX[i,j,nSlices-1] = np.max(frame,axis=2)
-
-            for k in range(nSlices-1):
-                rangeY = [k*sliceDepthY, (k+1)*sliceDepthY]
-                frame = resArray[i,j,:,rangeY[0]:rangeY[1],:]
-                slicedMaxY[i,j,k] = np.max(frame,axis=1)
-            #fill last chunk with the rest of the data
-            rangeY = [(nSlices-1)*sliceDepthY, lenY]
-            frame = resArray[i,j,:,rangeY[0]:rangeY[1],:]
-            slicedMaxY[i,j,nSlices-1] = np.max(frame,axis=1)
+def getKymographPoints(line, width=1):
+    # (rows, cols) of the pixels sampled along a line ((x0,y0),(x1,y1)) of a
+    # projection at one pixel spacing, shape (width, nSamples). with width > 1
+    # parallel lines on both sides are sampled as well
+    (x0, y0), (x1, y1) = line
+    length = math.hypot(x1 - x0, y1 - y0)
+    nSamples = int(round(length)) + 1
+    xs = np.linspace(x0, x1, nSamples)
+    ys = np.linspace(y0, y1, nSamples)
+    # unit normal of the line
+    normal = (0.0, 0.0) if length == 0 else (-(y1 - y0)/length, (x1 - x0)/length)
+    offsets = np.arange(width) - (width - 1)/2
+    cols = np.rint(xs[np.newaxis] + offsets[:, np.newaxis]*normal[0]).astype(int)
+    rows = np.rint(ys[np.newaxis] + offsets[:, np.newaxis]*normal[1]).astype(int)
+    return rows, cols
+
+# kymograph rows are tiny, so many timepoints share a chunk
+kymographTimepointsPerChunk = 256
+
+def calcKymograph(root, name, line, projName='maxz', width=1, analysisPath='analysis', storageSpecs=None):
+    # intensity along a line through a projection at every timepoint, stored as
+    # analysis/kymographs/<name> with shape (ch, t, sample). line is ((x0,y0),(x1,y1))
+    # in pixels of the XY projection for 'maxz', or ((x0,z0),(x1,z1)) of the XZ
+    # projection for 'maxy'. with width > 1 the max across the line is taken. the
+    # projections are streamed one time chunk at a time and the rows buffered until
+    # they fill whole kymograph chunks. a kymograph with the same line is only
+    # extended by the timepoints added since it was calculated
+    if storageSpecs is None:
+        storageSpecs = projectionStorageDefaults
+    maxGroup = root[analysisPath]['max_projections']
+    projArray = maxGroup[projName]
+    lenCh = projArray.shape[1]
+    rows, cols = getKymographPoints(line, width)
+    if rows.min() < 0 or cols.min() < 0 or rows.max() >= projArray.shape[2] or cols.max() >= projArray.shape[3]:
+        raise ValueError('Kymograph ' + name + ' leaves the ' + projName + ' projection of shape ' + str(projArray.shape[2:]))
+    lenT = getCompletedTimepoints(maxGroup, 'max_projections')
+
+    group = createZarrGroup(root[analysisPath], 'kymographs')
+    settings = {'line': [list(point) for point in line], 'projName': projName, 'width': width}
+    t0 = 0
+    # extend only if the timepoints already sampled have not been recalculated since
+    resumable = name in group and all(group[name].attrs.get(key) == value for key, value in settings.items())
+    if resumable and group[name].attrs.get('input') == getInputFingerprint(maxGroup, group[name].attrs.get('lenT', 0)):
+        kymograph = group[name]
+        t0 = kymograph.attrs.get('lenT', 0)
+        if kymograph.shape[1] < lenT:
+            kymograph.resize((lenCh, lenT, rows.shape[1]))
+    else:
+        if name in group:
+            del group[name]
+        chunkT = max(storageSpecs['timepointsPerChunk'], kymographTimepointsPerChunk)
+        kymograph = group.zeros(name, shape=(lenCh, lenT, rows.shape[1]), chunks=(1, chunkT, rows.shape[1]),
+                                dtype=projArray.dtype, compressor=getProjectionCompressor(storageSpecs),
+                                dimension_separator=chunkKeySeparator)
+        kymograph.attrs.update(settings)
+
+    # read only the bounding box of the line
+    box = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+    chunkT = kymograph.chunks[1]
+    buffer = np.empty((lenCh, 0, rows.shape[1]), dtype=kymograph.dtype)
+    for tStart, tStop in getTimeBlocks(projArray, t0, lenT):
+        tStage = startStage()
+        block = projArray[(slice(tStart, tStop), slice(None)) + box]
+        tStage = endStage('read_projections', tStage, block.nbytes, getChunkCount(projArray, (slice(tStart, tStop),)))
+        samples = block[:, :, rows - box[0].start, cols - box[1].start].max(axis=2)
+        buffer = np.concatenate([buffer, np.moveaxis(samples, 0, 1)], axis=1)
+        endStage('reduce', tStage, block.nbytes)
+        # write the rows of every completed chunk, the last rows once all are sampled
+        tWrite = lenT if tStop == lenT else tStop//chunkT*chunkT
+        if tWrite > t0:
+            tStage = startStage()
+            rowsDone = buffer[:, :tWrite - t0]
+            kymograph[:, t0:tWrite] = rowsDone
+            buffer = buffer[:, tWrite - t0:]
+            t0 = tWrite
+            kymograph.attrs.update({'lenT': t0, 'input': getInputFingerprint(maxGroup, t0)})
+            endStage('write', tStage, rowsDone.nbytes)
+    return kymograph
+
+def getLegacyProjectionArrays(root, analysisPath='analysis'):
+    # projection arrays of a group written before projections kept the source dtype,
+    # maxz then held the max and its z index on a length 2 axis
+    legacy = []
+    dtype = root['0']['0'].dtype
+    for groupName in ['max_projections', 'sliced_max_projections']:
+        if analysisPath not in root or groupName not in root[analysisPath]:
+            continue
+        group = root[analysisPath][groupName]
+        for projName in projectionGroupArrays[groupName]:
+            if projName == 'maxz_depth' or projName not in group:
+                continue
+            if group[projName].dtype != dtype or (projName == 'maxz' and group[projName].ndim == 5):
+                legacy.append((groupName, projName))
+    return legacy
+
+def migrateProjectionArrays(root, analysisPath='analysis', storageSpecs=None):
+    # rewrite projections of the old layout in the source dtype with a separate
+    # maxz_depth array, one timepoint at a time. new arrays are written next to the
+    # old ones and swapped in once complete, so an interrupted migration can be rerun
+    if storageSpecs is None:
+        storageSpecs = projectionStorageDefaults
+    dtype = root['0']['0'].dtype
+    compressor = getProjectionCompressor(storageSpecs)
+    migrated = []
+    for groupName, projName in getLegacyProjectionArrays(root, analysisPath):
+        group = root[analysisPath][groupName]
+        oldArray = group[projName]
+        lenT, lenCh = oldArray.shape[:2]
+        if projName == 'maxz':
+            lenZ = group['maxx'].shape[2]
+            _, _, _, lenY, lenX = oldArray.shape
+            newSpecs = {'maxz': ((lenT,lenCh,lenY,lenX), dtype), 'maxz_depth': ((lenT,lenCh,lenY,lenX), getDepthDtype(lenZ))}
+        else:
+            newSpecs = {projName: (oldArray.shape, dtype)}
+        newArrays = {}
+        for newName, (newShape, newDtype) in newSpecs.items():
+            chunks = (storageSpecs['timepointsPerChunk'], 1) + newShape[2:]
+            newArrays[newName] = group.zeros(newName + '_migrated', shape=newShape, chunks=chunks, dtype=newDtype,
+                                             compressor=compressor, dimension_separator=chunkKeySeparator, overwrite=True)
+        for i in tqdm(range(lenT)):
+            oldData = oldArray[i]
+            if projName == 'maxz':
+                newArrays['maxz'][i] = oldData[:, 0]
+                newArrays['maxz_depth'][i] = oldData[:, 1]
+            else:
+                newArrays[projName][i] = oldData
+        del group[projName]
+        for newName in newArrays:
+            group.move(newName + '_migrated', newName)
+        migrated.append(projName)
+    return migrated
+
+def smoothTimeSeries(values, window):
+    # centred moving average, the window shrinks at the ends of the series
+    window = min(window, len(values))
+    if window <= 1:
+        return values
+    kernel = np.ones(window)
+    return np.convolve(values, kernel, mode='same')/np.convolve(np.ones(len(values)), kernel, mode='same')
+
+def getPercentileValue(hist, percentile, binWidth, upperEdge=False):
+    # intensity at a percentile of a binned histogram
+    cumHist = np.cumsum(hist)
+    if cumHist[-1] == 0:
+        return 0
+    nBin = int(np.searchsorted(cumHist, cumHist[-1]*percentile/100))
+    return (nBin+1)*binWidth - 1 if upperEdge else nBin*binWidth
+
+def calcAutoContrast(root, nChannel, lowPercentile=0.5, highPercentile=99.9, perTimepoint=False, smoothing=5, analysisPath='analysis'):
+    # percentile based scaleMin and scaleMax from the stored intensity histograms,
+    # either for the whole movie or per timepoint smoothed over time
+    histGroup = root[analysisPath]['intensity_histograms']
+    binWidth = histGroup.attrs['binWidth']
+    hists = histGroup['histz'][:, nChannel]
+    if not perTimepoint:
+        hist = hists.sum(axis=0)
+        return (getPercentileValue(hist, lowPercentile, binWidth),
+                getPercentileValue(hist, highPercentile, binWidth, upperEdge=True))
+    scaleMins = np.array([getPercentileValue(hist, lowPercentile, binWidth) for hist in hists])
+    scaleMaxes = np.array([getPercentileValue(hist, highPercentile, binWidth, upperEdge=True) for hist in hists])
+    scaleMins = np.round(smoothTimeSeries(scaleMins, smoothing)).astype(int)
+    scaleMaxes = np.round(smoothTimeSeries(scaleMaxes, smoothing)).astype(int)
+    # keep a usable range where the smoothed values cross
+    scaleMaxes = np.maximum(scaleMaxes, scaleMins + 1)
+    return scaleMins, scaleMaxes
 
 def generateUniqueFilename(filename, ext):
     i = 1
@@ -141,15 +1645,20 @@ def generateUniqueFilename(filename, ext):
     return filename + ext
 
 # replace with an adjustable auto contrast of some sort
-def calcScaleMax(root):
-    maxZ = root['analysis']['max_projections']['maxz']
-    scaleMax = np.max(maxZ)
+def calcScaleMax(root, analysisPath='analysis'):
+    maxZ = root[analysisPath]['max_projections']['maxz']
+    if 'intensity_histograms' in root[analysisPath]:
+        # upper edge of the highest occupied histogram bin, no projection data is read
+        histGroup = root[analysisPath]['intensity_histograms']
+        hist = histGroup['histz'][:].sum(axis=(0, 1))
+        return (np.nonzero(hist)[0].max()+1)*histGroup.attrs['binWidth'] - 1
+    scaleMax = float(np.max(maxZ[:]))
     return scaleMax
 
-def getProjectionDimensions(root):
+def getProjectionDimensions(root, analysisPath='analysis'):
     # return the dimensions of the max projections
-    maxX = root['analysis']['max_projections']['maxx']
-    maxY = root['analysis']['max_projections']['maxy']
+    maxX = root[analysisPath]['max_projections']['maxx']
+    maxY = root[analysisPath]['max_projections']['maxy']
     lenT = maxX.shape[0]
     lenZ = maxX.shape[-2]
     lenY = maxX.shape[-1]
@@ -164,6 +1673,49 @@ def adjustContrast(im, adjMax, scaleMin):
     contrastedIm = np.multiply(scaledIm,255).astype('uint8')
     return(contrastedIm)
 
+def canUseLUT(dtype):
+    # 8 and 16 bit unsigned intensities index a lookup table directly
+    return np.dtype(dtype) in (np.dtype('uint8'), np.dtype('uint16'))
+
+def calcContrastLUT(dtype, scaleMin, scaleMax, invert=False):
+    # uint8 contrast of every value of dtype, adjustContrast applied once to all
+    # possible values instead of to every pixel of every frame
+    lut = adjustContrast(np.arange(np.iinfo(dtype).max + 1, dtype='float64'), scaleMax, scaleMin)
+    return 255 - lut if invert else lut
+
+def calcColormapLUT(contrastLUT, cmap):
+    # BGR colour of every raw value, zero stays black like frame[im==0] = 0
+    lut = cmap.reshape(-1, 3)[contrastLUT]
+    lut[0] = 0
+    return lut
+
+class intensityLUT:
+    # lookup table from raw intensities to contrast or colour, rebuilt only when
+    # scaleMin or scaleMax change. colorize turns the uint8 contrast table into
+    # the final table, e.g. BGR colours of a colormap
+    def __init__(self, dtype, invert=False, colorize=None):
+        self.dtype = dtype
+        self.invert = invert
+        self.colorize = colorize
+        # (scale, table) replaced as a whole, so concurrent readers never mix them
+        self.cached = (None, None)
+
+    def _get(self, scaleMin, scaleMax):
+        scale, lut = self.cached
+        if scale != (scaleMin, scaleMax):
+            lut = calcContrastLUT(self.dtype, scaleMin, scaleMax, self.invert)
+            if self.colorize is not None:
+                lut = self.colorize(lut)
+            self.cached = ((scaleMin, scaleMax), lut)
+        return lut
+
+def createColormapLUT(dtype, channel, cmap):
+    # contrast, inversion of the rocks channel, colormap and zero masking of a
+    # channel in one table, or None when dtype cannot index a table
+    if not canUseLUT(dtype):
+        return None
+    return intensityLUT(dtype, invert=(channel.name == 'rocks'), colorize=lambda lut: calcColormapLUT(lut, cmap))
+
 class scaleBar:
     def __init__(self, posY, posX, heightInPx, lengthInPx, length, textOffset):
         self.posY = posY
@@ -188,13 +1740,13 @@ class scaleBar:
         textPos = (self.posX + (self.lengthInPx//2) - (textWidth//2), self.posY - self.heightInPx//2)
         cv2.putText(frame, self.text, textPos, font.font, font.fontSize, [255,255,255], font.lineThickness, cv2.LINE_AA)
         
-def getScaleBarLength(root, voxelDims):
+def getScaleBarLength(root, voxelDims, analysisPath='analysis'):
     #TODO: add scaling factor for sliced movies where the scale bar should be smaller
     #approxScaleBarLength = projDimsUM[1]/scaleFactor
     #alternatively, for sliced movies, projDims should be switched out with movieDims
     scaleBarLengths = [10, 50, 100, 500, 1000, 5000, 10000, 50000] # in um
 
-    projDimsPx = getProjectionDimensions(root)
+    projDimsPx = getProjectionDimensions(root, analysisPath)
     projDimsUm = [projDimsPx[3]*voxelDims[0], projDimsPx[2]*voxelDims[1], projDimsPx[1]*voxelDims[2]]
     approxScaleBarLength = projDimsUm[1]/5
     scaleBarLength = min(scaleBarLengths, key=lambda x:abs(x-approxScaleBarLength))
@@ -207,10 +1759,27 @@ class font:
         self.lineThickness = fontSize*2
 
     def _getFontSize(self, scaleBar):
-        (textWidth, _), _ = cv2.getTextSize(scaleBar.text, self.font, self.fontSize, self.lineThickness)
-        while textWidth <= scaleBar.lengthInPx/2:
-            self.fontSize += .1
-            (textWidth, _), _ = cv2.getTextSize(scaleBar.text, self.font, self.fontSize, self.lineThickness)
+        # smallest font size in .1 steps whose text is wider than half the scale bar.
+        # text width grows linearly with font size, so start from an estimate based
+        # on the width at size 1 and only check the neighbouring steps
+        targetWidth = scaleBar.lengthInPx/2
+
+        def textWidth(fontSize):
+            (width, _), _ = cv2.getTextSize(scaleBar.text, self.font, fontSize, self.lineThickness)
+            return width
+
+        def stepFontSize(nSteps):
+            fontSize = self.fontSize
+            for _ in range(nSteps):
+                fontSize += .1
+            return fontSize
+
+        nSteps = max(0, math.ceil((targetWidth/max(textWidth(1), 1) - self.fontSize)/.1))
+        while nSteps > 0 and textWidth(stepFontSize(nSteps-1)) > targetWidth:
+            nSteps -= 1
+        while textWidth(stepFontSize(nSteps)) <= targetWidth:
+            nSteps += 1
+        self.fontSize = stepFontSize(nSteps)
         self.lineThickness = round(self.fontSize*2)
         return self.fontSize, self.lineThickness
 
@@ -218,29 +1787,65 @@ def getTimeStampPos(upperLeft, t, font):
     (_, timeStampHeight), _ = cv2.getTextSize(t, font.font, font.size, font.lineThickness)
     return (upperLeft[0], upperLeft[1] + timeStampHeight)
 
-def makeOrthoMaxVideo(root, channel, ext='.avi'):
-
-    filename = generateUniqueFilename(channel.name + '_orthomax', ext)
-    nChannel = channel.nChannel
-    adjMax = channel.scaleMax
-    scaleMin = channel.scaleMin
-
-    imagingFreq = getImagingFreqFromJSON(root.store.path + '/parameters.json')
-
-    maxZ = root['analysis']['max_projections']['maxz']
-    maxY = root['analysis']['max_projections']['maxy']
-    maxX = root['analysis']['max_projections']['maxx']
-    
-    lenT, lenZ, lenY, lenX = getProjectionDimensions(root)
-    
-    gap = 20
+class compositor:
+    # frame buffers allocated once per movie and static overlays rendered once,
+    # so each frame only needs the projections blitted and the time stamp drawn
+    def __init__(self, movieHeight, movieWidth, nCanvases=1, dtype='float64'):
+        self.movieHeight = movieHeight
+        self.movieWidth = movieWidth
+        self.canvases = [np.zeros([movieHeight,movieWidth], dtype=dtype) for _ in range(nCanvases)]
+        self.frame = np.zeros([movieHeight,movieWidth,3], dtype='uint8')
+        self.overlays = []
+        self.timeStampPos = (0, 0)
+        self.timeStampFont = None
+
+    def _addOverlay(self, drawOverlay):
+        # render a white overlay on black and keep the pixels inside its bounding box
+        overlay = np.zeros([self.movieHeight,self.movieWidth,3], dtype='uint8')
+        drawOverlay(overlay)
+        ys, xs = np.nonzero(overlay[:,:,0])
+        if len(ys) == 0:
+            return
+        box = (slice(ys.min(), ys.max()+1), slice(xs.min(), xs.max()+1))
+        self.overlays.append((box, overlay[box].astype('uint16')))
+
+    def _addScaleBar(self, scaleBar, font):
+        self._addOverlay(lambda overlay: scaleBar._addScaleBar(overlay, font))
+
+    def _addScaleBarZ(self, scaleBar, font):
+        self._addOverlay(lambda overlay: scaleBar._addScaleBarZ(overlay, font))
+
+    def _setTimeStamp(self, upperLeft, font):
+        # time stamps are digits only, so their height is the same in every frame
+        self.timeStampPos = getTimeStampPos(upperLeft, '00:00', font)
+        self.timeStampFont = font
+
+    def _applyOverlays(self, frame):
+        # alpha blend the white overlays, same result as drawing them with cv2.LINE_AA
+        for box, overlay in self.overlays:
+            region = frame[box]
+            blend = ((255 - region.astype('uint16'))*overlay + 127)//255
+            np.add(region, blend, out=region, casting='unsafe')
+
+    def _addTimeStamp(self, frame, t):
+        font = self.timeStampFont
+        cv2.putText(frame,t,self.timeStampPos,font.font,font.fontSize,[255,255,255],font.lineThickness,cv2.LINE_AA)
+
+def createOrthoCompositor(root, channel, nCanvases=1, gap=20, analysisPath='analysis', dtype='float64'):
+    # compositor for the XZ / XY / YZ ortho layout with scale bars
+    _, lenZ, lenY, lenX = getProjectionDimensions(root, analysisPath)
 
     movieWidth = lenX + lenZ + gap
     movieHeight = lenY + lenZ + gap
     upperLeftXY = (0, lenZ+gap)
 
+    comp = compositor(movieHeight, movieWidth, nCanvases, dtype)
+    comp.panelXZ = (slice(0, lenZ), slice(0, lenX))
+    comp.panelXY = (slice(lenZ+gap, movieHeight), slice(0, lenX))
+    comp.panelYZ = (slice(lenZ+gap, movieHeight), slice(lenX+gap, movieWidth))
+
     # define scale bars
-    scaleBarLength = getScaleBarLength(root, channel.voxelDims)
+    scaleBarLength = getScaleBarLength(root, channel.voxelDims, analysisPath)
     scaleBarLengthInPx = int(scaleBarLength//channel.voxelDims[0])
     scaleBarXY = scaleBar(
         posY = movieHeight - (scaleBarLengthInPx//10), #76
@@ -270,166 +1875,29 @@ def makeOrthoMaxVideo(root, channel, ext='.avi'):
 
     fontXZ= font(cv2.FONT_HERSHEY_SIMPLEX)
     fontXZ.size, fontXZ.lineThickness = fontXZ._getFontSize(scaleBarXZ)
-    
-    vid = cv2.VideoWriter(filename,cv2.VideoWriter_fourcc(*'MJPG'),10,(movieWidth,movieHeight),1)
 
-    try: 
-        for i in tqdm(range(lenT)):
+    # pre-render scale bars
+    comp._addScaleBar(scaleBarXY, fontXY)
+    comp._addScaleBarZ(scaleBarXZ, fontXZ)
+    comp._setTimeStamp(upperLeftXY, fontXY)
 
-            # initialize frame 
-            im = np.zeros([movieHeight,movieWidth])
+    return comp
 
-            # copy max projections 
-            im[0:lenZ,0:lenX] = copy.copy(np.flip(maxY[i,nChannel],axis=0))
-            im[(lenZ+gap):movieHeight,0:lenX] = copy.copy(maxZ[i,nChannel,0])
-            im[(lenZ+gap):movieHeight,(lenX+gap):movieWidth] = copy.copy(np.transpose(maxX[i,nChannel]))
-            
-            contrastedIm = adjustContrast(im, adjMax, scaleMin)
+def createSlicedCompositor(root, channel, nSlices, movieWidth, gap=20, analysisPath='analysis', dtype='float64'):
+    # compositor for sliced projections stacked vertically with a scale bar
+    _, lenZ, _, _ = getProjectionDimensions(root, analysisPath)
 
-            # invert if rock channel
-            if channel.name == 'rocks':
-                contrastedIm = 255 - contrastedIm
-
-            frame = cv2.applyColorMap(contrastedIm,cmapy.cmap('viridis'))
-
-            frame[np.where(im==0)] = [0,0,0]
-            
-            # time stamp
-            t = f'{i*imagingFreq // 60:02d}' + ':' + f'{i*imagingFreq % 60:02d}'
-            timeStampPos = getTimeStampPos(upperLeftXY, t, fontXY)
-            cv2.putText(frame,t,timeStampPos,fontXY.font,fontXY.fontSize,[255,255,255],fontXY.lineThickness,cv2.LINE_AA)
+    movieHeight = (lenZ * nSlices) + (gap * (nSlices-1))
 
-            # add scale bars
-            scaleBarXY._addScaleBar(frame, fontXY)
-            scaleBarXZ._addScaleBarZ(frame, fontXZ)
-
-            # write frame 
-            vid.write(frame)
-
-        vid.release()
-        cv2.destroyAllWindows()
-    except:
-        vid.release()
-        cv2.destroyAllWindows()
-
-def makeSlicedOrthoMaxVideos(root, channel, ext='.avi'):
-
-    filenames = [generateUniqueFilename(channel.name + '_X_sliced_orthomax', ext),
-                 generateUniqueFilename(channel.name + '_Y_sliced_orthomax', ext)]
-    nChannel = channel.nChannel
-    adjMax = channel.scaleMax
-    scaleMin = channel.scaleMin
-
-    imagingFreq = getImagingFreqFromJSON(root.store.path + '/parameters.json')
-        
-    slicedMaxes = [root['analysis']['sliced_max_projections']['sliced_maxx'], root['analysis']['sliced_max_projections']['sliced_maxy']]
-
-    lenT, lenZ, _, _ = getProjectionDimensions(root)
-
-    gap = 20
-
-    for filename, slicedMax in zip(filenames, slicedMaxes):
-        
-        nSlices = slicedMax.shape[2]
-
-        movieWidth = slicedMax.shape[-1]
-        movieHeight = (lenZ * nSlices) + (gap * (nSlices-1))
-
-        # define scale bar
-        scaleBarLength = getScaleBarLength(root, channel.voxelDims)
-        scaleBarLengthInPx = int(scaleBarLength//channel.voxelDims[0])
-        scaleBarXY = scaleBar(
-            posY = movieHeight - (scaleBarLengthInPx//10), #76
-            posX = movieWidth - scaleBarLengthInPx, #468
-            heightInPx = scaleBarLengthInPx//10, #30
-            lengthInPx = scaleBarLengthInPx, #416
-            length = scaleBarLength,
-            textOffset = scaleBarLength//100, #50
-        )
-        if scaleBarXY.length >= 1000:
-            scaleBarXY.length = scaleBarXY.length/1000
-            scaleBarXY.units = 'mm'
-            scaleBarXY.text = str(scaleBarXY.length) + ' ' + scaleBarXY.units
-
-        # define font
-        fontXY = font(cv2.FONT_HERSHEY_SIMPLEX)
-        fontXY.size, fontXY.lineThickness = fontXY._getFontSize(scaleBarXY)
-
-        vid = cv2.VideoWriter(filename,cv2.VideoWriter_fourcc(*'MJPG'),10,(movieWidth,movieHeight),1)
-
-        try:
-            for i in tqdm(range(lenT)):
-
-                # initialize frame
-                im = np.zeros([movieHeight,movieWidth])
-
-                # copy max projections 
-                for j in range(nSlices):
-                    im[(lenZ*j+gap*j):(lenZ*(j+1)+gap*j),:] = copy.copy(np.flip(slicedMax[i,nChannel,j], axis=0))
-
-                # adjust contrast
-                contrastedIm = adjustContrast(im, adjMax, scaleMin)
-
-                # invert if rock channel
-                if channel.name == 'rocks':
-                    contrastedIm = 255 - contrastedIm
-
-                frame = cv2.applyColorMap(contrastedIm,cmapy.cmap('viridis'))
-
-                frame[np.where(im==0)] = [0,0,0]
-
-                # add time stamp
-                t = f'{i*imagingFreq // 60:02d}' + ':' + f'{i*imagingFreq % 60:02d}'
-                timeStampPos = getTimeStampPos((0,0), t, fontXY)
-                cv2.putText(frame,t,timeStampPos,fontXY.font,fontXY.fontSize,[255,255,255],fontXY.lineThickness,cv2.LINE_AA)
-
-                # add scale bars
-                scaleBarXY._addScaleBar(frame, fontXY)
-
-                # write frame
-                vid.write(frame)
-
-            vid.release()
-            cv2.destroyAllWindows()
-        except:
-            vid.release()
-            cv2.destroyAllWindows()
-
-def makeCompOrthoMaxVideo(root, channels, ext='.avi'):
-
-    filename = generateUniqueFilename('comp_orthomax', ext)
-
-    # set channel values
-    for channel in channels:
-        if channel.name == 'cells':
-            nChannelCells = channel.nChannel
-            scaleMaxCells = channel.scaleMax
-            scaleMinCells = channel.scaleMin
-        else:
-            nChannelRocks = channel.nChannel
-            scaleMaxRocks = channel.scaleMax
-            scaleMinRocks = channel.scaleMin
-
-    imagingFreq = getImagingFreqFromJSON(root.store.path + '/parameters.json')
-
-    maxZ = root['analysis']['max_projections']['maxz']
-    maxY = root['analysis']['max_projections']['maxy']
-    maxX = root['analysis']['max_projections']['maxx']
-    
-    lenT, lenZ, lenY, lenX = getProjectionDimensions(root)
-
-    gap = 20
-
-    movieWidth = lenX + lenZ + gap
-    movieHeight = lenY + lenZ + gap
-    upperLeftXY = (0, lenZ+gap)
+    comp = compositor(movieHeight, movieWidth, dtype=dtype)
+    comp.panels = [(slice(lenZ*j+gap*j, lenZ*(j+1)+gap*j), slice(0, movieWidth)) for j in range(nSlices)]
 
-    # define scale bars
-    scaleBarLength = getScaleBarLength(root, channel.voxelDims)
+    # define scale bar
+    scaleBarLength = getScaleBarLength(root, channel.voxelDims, analysisPath)
     scaleBarLengthInPx = int(scaleBarLength//channel.voxelDims[0])
     scaleBarXY = scaleBar(
         posY = movieHeight - (scaleBarLengthInPx//10), #76
-        posX = lenX - scaleBarLengthInPx, #468
+        posX = movieWidth - scaleBarLengthInPx, #468
         heightInPx = scaleBarLengthInPx//10, #30
         lengthInPx = scaleBarLengthInPx, #416
         length = scaleBarLength,
@@ -439,67 +1907,277 @@ def makeCompOrthoMaxVideo(root, channels, ext='.avi'):
         scaleBarXY.length = scaleBarXY.length/1000
         scaleBarXY.units = 'mm'
         scaleBarXY.text = str(scaleBarXY.length) + ' ' + scaleBarXY.units
-    
-    scaleBarXZ = scaleBar(
-        posY = lenZ,
-        posX = lenX + gap,
-        heightInPx = lenZ//10, #30
-        lengthInPx = lenZ,
-        length = int(lenZ*channel.voxelDims[2]),
-        textOffset = 5, #50
-    )
 
     # define font
     fontXY = font(cv2.FONT_HERSHEY_SIMPLEX)
     fontXY.size, fontXY.lineThickness = fontXY._getFontSize(scaleBarXY)
 
-    fontXZ= font(cv2.FONT_HERSHEY_SIMPLEX)
-    fontXZ.size, fontXZ.lineThickness = fontXZ._getFontSize(scaleBarXZ)
+    # pre-render scale bar
+    comp._addScaleBar(scaleBarXY, fontXY)
+    comp._setTimeStamp((0, 0), fontXY)
+
+    return comp
+
+class ffmpegWriter:
+    # streams raw BGR frames into an ffmpeg subprocess, same interface as cv2.VideoWriter.
+    # writes block while ffmpeg's input pipe is full, so rendering cannot run ahead
+    # of the encoder
+    def __init__(self, filename, fps, frameSize, codec='libx264', crf=28, preset='medium', threads=0, ffmpegPath='ffmpeg'):
+        self.filename = filename
+        width, height = frameSize
+        command = [ffmpegPath, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                   # yuv420p needs even frame dimensions
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-c:v', codec, '-pix_fmt', 'yuv420p', '-crf', str(crf), '-preset', preset,
+                   '-threads', str(threads), filename]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def write(self, frame):
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        if self.proc is None:
+            return
+        proc = self.proc
+        self.proc = None
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg already exited, its return code says why
+            pass
+        if proc.wait() != 0:
+            raise RuntimeError('ffmpeg failed to encode ' + self.filename)
+
+def getVideoExt(encoderSpecs):
+    return '.avi' if encoderSpecs['codec'] == 'mjpg' else '.mp4'
+
+def createVideoWriter(filename, frameSize, encoderSpecs=None):
+    # MJPG avi through cv2 by default, or H.264/HEVC through an ffmpeg pipe
+    if encoderSpecs is None or encoderSpecs['codec'] == 'mjpg':
+        fps = 10 if encoderSpecs is None else encoderSpecs['fps']
+        return cv2.VideoWriter(filename,cv2.VideoWriter_fourcc(*'MJPG'),fps,frameSize,1)
+    return ffmpegWriter(filename, encoderSpecs['fps'], frameSize,
+                        codec=encoderSpecs['codec'],
+                        crf=encoderSpecs['crf'],
+                        preset=encoderSpecs['preset'],
+                        threads=encoderSpecs['threads'],
+                        ffmpegPath=encoderSpecs['ffmpegPath'])
+
+def getTimeStamp(i, imagingFreq):
+    return f'{i*imagingFreq // 60:02d}' + ':' + f'{i*imagingFreq % 60:02d}'
+
+def getProjectionArray(root, projName, analysisPath='analysis'):
+    for groupName, projNames in projectionGroupArrays.items():
+        if projName in projNames:
+            return root[analysisPath][groupName][projName]
+
+class orthoMaxMovie:
+    def __init__(self, root, channel, cmap='viridis', ext='.avi', encoderSpecs=None, analysisPath='analysis', video=True):
+        self.filename = generateUniqueFilename(channel.name + '_orthomax', ext) if video else None
+        self.channel = channel
+        self.projChannels = [('maxz', channel.nChannel), ('maxy', channel.nChannel), ('maxx', channel.nChannel)]
+        self.imagingFreq = getImagingFreqFromJSON(getRootPath(root) + '/parameters.json')
+        self.cmap = cmapy.cmap(cmap)
+        dtype = getProjectionArray(root, 'maxz', analysisPath).dtype
+        self.lut = createColormapLUT(dtype, channel, self.cmap)
+        self.comp = createOrthoCompositor(root, channel, analysisPath=analysisPath, dtype=dtype)
+        self.vid = createVideoWriter(self.filename, (self.comp.movieWidth,self.comp.movieHeight), encoderSpecs) if video else None
+
+    def _renderFrame(self, i, projs, scales=None):
+        nChannel = self.channel.nChannel
+        comp = self.comp
+        im = comp.canvases[0]
+        frame = comp.frame
+        t = startStage()
+
+        # copy max projections 
+        im[comp.panelXZ] = np.flip(projs['maxy'][nChannel],axis=0)
+        im[comp.panelXY] = projs['maxz'][nChannel]
+        im[comp.panelYZ] = np.transpose(projs['maxx'][nChannel])
+        
+        scaleMin, scaleMax = getChannelScale(self.channel, i, scales)
+        if self.lut is not None:
+            t = endStage('composite', t)
+            # contrast, rock inversion, colormap and zero masking in a single gather
+            np.take(self.lut._get(scaleMin, scaleMax), im, axis=0, out=frame, mode='clip')
+        else:
+            contrastedIm = adjustContrast(im, scaleMax, scaleMin)
+            t = endStage('composite', t)
+
+            # invert if rock channel
+            if self.channel.name == 'rocks':
+                contrastedIm = 255 - contrastedIm
 
-    vid = cv2.VideoWriter(filename,cv2.VideoWriter_fourcc(*'MJPG'),10,(movieWidth,movieHeight),1)
+            cv2.applyColorMap(contrastedIm,self.cmap,dst=frame)
 
-    try:
-        for i in tqdm(range(lenT)):
-            
-            imCells = np.zeros([movieHeight,movieWidth])
-            imRocks = np.zeros([movieHeight,movieWidth])
-
-            # copy max projections 
-            imCells[0:lenZ,0:lenX] = copy.copy(np.flip(maxY[i,nChannelCells],axis=0))
-            imCells[(lenZ+gap):movieHeight,0:lenX] = copy.copy(maxZ[i,nChannelCells,0])
-            imCells[(lenZ+gap):movieHeight,(lenX+gap):movieWidth] = copy.copy(np.transpose(maxX[i,nChannelCells]))
-
-            imRocks[0:lenZ,0:lenX] = copy.copy(np.flip(maxY[i,nChannelRocks],axis=0))
-            imRocks[(lenZ+gap):movieHeight,0:lenX] = copy.copy(maxZ[i,nChannelRocks,0])
-            imRocks[(lenZ+gap):movieHeight,(lenX+gap):movieWidth] = copy.copy(np.transpose(maxX[i,nChannelRocks]))
-            
+            frame[im==0] = 0
+        t = endStage('colormap', t)
+        
+        # time stamp
+        comp._addTimeStamp(frame, getTimeStamp(i, self.imagingFreq))
+
+        # add scale bars
+        comp._applyOverlays(frame)
+        endStage('overlays', t)
+        return frame
+
+    def _writeFrame(self, i, projs):
+        frame = self._renderFrame(i, projs)
+        t = startStage()
+        self.vid.write(frame)
+        endStage('video_write', t, frame.nbytes)
+
+    def _release(self):
+        if self.vid is not None:
+            self.vid.release()
+
+class slicedOrthoMaxMovie:
+    def __init__(self, root, channel, axis, cmap='viridis', ext='.avi', encoderSpecs=None, analysisPath='analysis', video=True):
+        # axis is 'X' or 'Y', the axis along which the volume was sliced
+        self.filename = generateUniqueFilename(channel.name + '_' + axis + '_sliced_orthomax', ext) if video else None
+        self.channel = channel
+        self.projName = 'sliced_max' + axis.lower()
+        self.projChannels = [(self.projName, channel.nChannel)]
+        self.imagingFreq = getImagingFreqFromJSON(getRootPath(root) + '/parameters.json')
+        self.cmap = cmapy.cmap(cmap)
+        slicedMax = getProjectionArray(root, self.projName, analysisPath)
+        self.nSlices = slicedMax.shape[2]
+        self.lut = createColormapLUT(slicedMax.dtype, channel, self.cmap)
+        self.comp = createSlicedCompositor(root, channel, self.nSlices, slicedMax.shape[-1], analysisPath=analysisPath, dtype=slicedMax.dtype)
+        self.vid = createVideoWriter(self.filename, (self.comp.movieWidth,self.comp.movieHeight), encoderSpecs) if video else None
+
+    def _renderFrame(self, i, projs, scales=None):
+        slicedMax = projs[self.projName][self.channel.nChannel]
+        comp = self.comp
+        im = comp.canvases[0]
+        frame = comp.frame
+        t = startStage()
+
+        # copy max projections 
+        for j in range(self.nSlices):
+            im[comp.panels[j]] = np.flip(slicedMax[j], axis=0)
+
+        # adjust contrast
+        scaleMin, scaleMax = getChannelScale(self.channel, i, scales)
+        if self.lut is not None:
+            t = endStage('composite', t)
+            # contrast, rock inversion, colormap and zero masking in a single gather
+            np.take(self.lut._get(scaleMin, scaleMax), im, axis=0, out=frame, mode='clip')
+        else:
+            contrastedIm = adjustContrast(im, scaleMax, scaleMin)
+            t = endStage('composite', t)
+
+            # invert if rock channel
+            if self.channel.name == 'rocks':
+                contrastedIm = 255 - contrastedIm
+
+            cv2.applyColorMap(contrastedIm,self.cmap,dst=frame)
+
+            frame[im==0] = 0
+        t = endStage('colormap', t)
+
+        # add time stamp
+        comp._addTimeStamp(frame, getTimeStamp(i, self.imagingFreq))
+
+        # add scale bars
+        comp._applyOverlays(frame)
+        endStage('overlays', t)
+        return frame
+
+    def _writeFrame(self, i, projs):
+        frame = self._renderFrame(i, projs)
+        t = startStage()
+        self.vid.write(frame)
+        endStage('video_write', t, frame.nbytes)
+
+    def _release(self):
+        if self.vid is not None:
+            self.vid.release()
+
+class compOrthoMaxMovie:
+    def __init__(self, root, channels, ext='.avi', encoderSpecs=None, analysisPath='analysis', video=True):
+        self.filename = generateUniqueFilename('comp_orthomax', ext) if video else None
+
+        # set channel values
+        for channel in channels:
+            if channel.name == 'cells':
+                self.channelCells = channel
+            else:
+                self.channelRocks = channel
+        self.projChannels = [(projName, nChannel) for projName in ['maxz', 'maxy', 'maxx']
+                             for nChannel in [self.channelCells.nChannel, self.channelRocks.nChannel]]
+
+        self.imagingFreq = getImagingFreqFromJSON(getRootPath(root) + '/parameters.json')
+        dtype = getProjectionArray(root, 'maxz', analysisPath).dtype
+        self.lutCells = self.lutRocks = None
+        if canUseLUT(dtype):
+            # cells go to blue and red, the green entry 255 keeps the rocks and 0
+            # clears them where the cells are black
+            self.lutCells = intensityLUT(dtype, colorize=lambda lut: np.stack([lut, np.where(lut > 0, 255, 0).astype('uint8'), lut], axis=1))
+            self.lutRocks = intensityLUT(dtype, invert=True)
+        self.comp = createOrthoCompositor(root, channel, nCanvases=2, analysisPath=analysisPath, dtype=dtype)
+        self.vid = createVideoWriter(self.filename, (self.comp.movieWidth,self.comp.movieHeight), encoderSpecs) if video else None
+
+    def _renderFrame(self, i, projs, scales=None):
+        comp = self.comp
+        imCells, imRocks = comp.canvases
+        frame = comp.frame
+        nChannelCells = self.channelCells.nChannel
+        nChannelRocks = self.channelRocks.nChannel
+        t = startStage()
+
+        # copy max projections 
+        imCells[comp.panelXZ] = np.flip(projs['maxy'][nChannelCells],axis=0)
+        imCells[comp.panelXY] = projs['maxz'][nChannelCells]
+        imCells[comp.panelYZ] = np.transpose(projs['maxx'][nChannelCells])
+
+        imRocks[comp.panelXZ] = np.flip(projs['maxy'][nChannelRocks],axis=0)
+        imRocks[comp.panelXY] = projs['maxz'][nChannelRocks]
+        imRocks[comp.panelYZ] = np.transpose(projs['maxx'][nChannelRocks])
+        
+        scaleMinCells, scaleMaxCells = getChannelScale(self.channelCells, i, scales)
+        scaleMinRocks, scaleMaxRocks = getChannelScale(self.channelRocks, i, scales)
+        if self.lutCells is not None:
+            t = endStage('composite', t)
+            # one gather per channel, the inverted rocks are masked into green
+            np.take(self.lutCells._get(scaleMinCells, scaleMaxCells), imCells, axis=0, out=frame, mode='clip')
+            np.bitwise_and(frame[:,:,1], self.lutRocks._get(scaleMinRocks, scaleMaxRocks)[imRocks], out=frame[:,:,1])
+        else:
             contrastedImCells = adjustContrast(imCells, scaleMaxCells, scaleMinCells)
             contrastedImRocks = adjustContrast(imRocks, scaleMaxRocks, scaleMinRocks)
+            t = endStage('composite', t)
 
             # invert rock channel
             contrastedImRocks = 255 - contrastedImRocks
 
-            frame = cv2.merge((contrastedImCells,contrastedImRocks,contrastedImCells))
+            frame[:,:,0] = contrastedImCells
+            frame[:,:,1] = contrastedImRocks
+            frame[:,:,2] = contrastedImCells
 
-            frame[np.where(contrastedImCells==0)] = [0,0,0]
-            
-            # time stamp
-            t = f'{i*imagingFreq // 60:02d}' + ':' + f'{i*imagingFreq % 60:02d}'
-            timeStampPos = getTimeStampPos(upperLeftXY, t, fontXY)
-            cv2.putText(frame,t,timeStampPos,fontXY.font,fontXY.fontSize,[255,255,255],fontXY.lineThickness,cv2.LINE_AA)
+            frame[contrastedImCells==0] = 0
+        t = endStage('colormap', t)
+        
+        # time stamp
+        comp._addTimeStamp(frame, getTimeStamp(i, self.imagingFreq))
 
-            # add scale bars
-            scaleBarXY._addScaleBar(frame, fontXY)
-            scaleBarXZ._addScaleBarZ(frame, fontXZ)
+        # add scale bars
+        comp._applyOverlays(frame)
+        endStage('overlays', t)
+        return frame
 
-            # write frame 
-            vid.write(frame)
+    def _writeFrame(self, i, projs):
+        frame = self._renderFrame(i, projs)
+        t = startStage()
+        self.vid.write(frame)
+        endStage('video_write', t, frame.nbytes)
 
-        vid.release()
-        cv2.destroyAllWindows()
-    except:
-        vid.release()
-        cv2.destroyAllWindows()
+    def _release(self):
+        if self.vid is not None:
+            self.vid.release()
 
 def generateZDepthColormap(lenZ, cmap):
     #generates a colormap based on z depth, red is the highest z depth, blue is the lowest
@@ -509,158 +2187,472 @@ def generateZDepthColormap(lenZ, cmap):
         zDepthColormap[slice] = cmapy.color(cmap, zDepthGrayVal)
     return zDepthColormap
 
-def invertAndScale(channel, im):
+def generateZDepthLUT(lenZ, cmap):
+    # (lenZ,3) BGR lookup table indexed by z depth
+    return np.array(generateZDepthColormap(lenZ, cmap), dtype='uint16')
+
+def blendZDepthColors(channel, contrastedIm, imBGRVals):
+    # scale z depth colours by the contrasted intensity using integer arithmetic
     # invert if rock channel
     if channel == 'rocks':
-        im = 255 - im
-    scaledIm = np.divide(im,255)
-    scaledImGrayscale = cv2.merge([scaledIm, scaledIm, scaledIm])
-    return scaledImGrayscale
-
-def makeZDepthOrthoMaxVideo(root, channel, cmap, ext='.avi'):
-
-    filename = generateUniqueFilename(channel.name + '_zdepth_orthomax', ext)
-    nChannel = channel.nChannel
-    adjMax = channel.scaleMax
-    scaleMin = channel.scaleMin
-
-    imagingFreq = getImagingFreqFromJSON(root.store.path + '/parameters.json')
-
-    maxZ = root['analysis']['max_projections']['maxz']
-    maxY = root['analysis']['max_projections']['maxy']
-    maxX = root['analysis']['max_projections']['maxx']
-    
-    lenT, lenZ, lenY, lenX = getProjectionDimensions(root)
-
-    zDepthColormap = generateZDepthColormap(lenZ, cmap)
-    
-    gap = 20
-
-    movieWidth = lenX + lenZ + gap
-    movieHeight = lenY + lenZ + gap
-    upperLeftXY = (0, lenZ+gap)
-
-    # define scale bars
-    scaleBarLength = getScaleBarLength(root, channel.voxelDims)
-    scaleBarLengthInPx = int(scaleBarLength//channel.voxelDims[0])
-    scaleBarXY = scaleBar(
-        posY = movieHeight - (scaleBarLengthInPx//10), #76
-        posX = lenX - scaleBarLengthInPx, #468
-        heightInPx = scaleBarLengthInPx//10, #30
-        lengthInPx = scaleBarLengthInPx, #416
-        length = scaleBarLength,
-        textOffset = scaleBarLength//100, #50
-    )
-    if scaleBarXY.length >= 1000:
-        scaleBarXY.length = scaleBarXY.length/1000
-        scaleBarXY.units = 'mm'
-        scaleBarXY.text = str(scaleBarXY.length) + ' ' + scaleBarXY.units
-    
-    scaleBarXZ = scaleBar(
-        posY = lenZ,
-        posX = lenX + gap,
-        heightInPx = lenZ//10, #30
-        lengthInPx = lenZ,
-        length = int(lenZ*channel.voxelDims[2]),
-        textOffset = 5, #50
-    )
+        contrastedIm = 255 - contrastedIm
+    blendedIm = (contrastedIm.astype('uint16')[..., np.newaxis] * imBGRVals) // 255
+    return blendedIm.astype('uint8')
+
+class zDepthOrthoMaxMovie:
+    def __init__(self, root, channel, cmap, ext='.avi', encoderSpecs=None, analysisPath='analysis', video=True):
+        self.filename = generateUniqueFilename(channel.name + '_zdepth_orthomax', ext) if video else None
+        self.channel = channel
+        self.projChannels = [('maxz', channel.nChannel), ('maxz_depth', channel.nChannel),
+                             ('maxy', channel.nChannel), ('maxx', channel.nChannel)]
+        self.imagingFreq = getImagingFreqFromJSON(getRootPath(root) + '/parameters.json')
+
+        _, lenZ, _, _ = getProjectionDimensions(root, analysisPath)
+        self.zDepthLUT = generateZDepthLUT(lenZ, cmap)
+
+        # z depth colours of the XZ and YZ panels are the same in every frame
+        self.imBGRValsXZ = self.zDepthLUT[:, np.newaxis, :]
+        self.imBGRValsYZ = self.zDepthLUT[np.newaxis, :, :]
+
+        dtype = getProjectionArray(root, 'maxz', analysisPath).dtype
+        self.contrastLUT = intensityLUT(dtype) if canUseLUT(dtype) else None
+
+        self.comp = createOrthoCompositor(root, channel, nCanvases=0, analysisPath=analysisPath)
+        self.vid = createVideoWriter(self.filename, (self.comp.movieWidth,self.comp.movieHeight), encoderSpecs) if video else None
+
+    def _renderFrame(self, i, projs, scales=None):
+        nChannel = self.channel.nChannel
+        scaleMin, adjMax = getChannelScale(self.channel, i, scales)
+        comp = self.comp
+        frame = comp.frame
+        t = startStage()
+        if self.contrastLUT is not None:
+            adjustContrastLUT = self.contrastLUT._get(scaleMin, adjMax).__getitem__
+        else:
+            adjustContrastLUT = lambda im: adjustContrast(im, adjMax, scaleMin)
+
+        # colour the XY projection by the z depth of each max pixel
+        imXY = projs['maxz'][nChannel]
+        contrastedImXY = adjustContrastLUT(imXY)
+        zDepths = projs['maxz_depth'][nChannel].astype(np.intp)
+        frameXY = blendZDepthColors(self.channel.name, contrastedImXY, self.zDepthLUT[zDepths])
+
+        # colour the XZ projection by z
+        imXZ = projs['maxy'][nChannel]
+        contrastedImXZ = adjustContrastLUT(imXZ)
+        frameXZ = blendZDepthColors(self.channel.name, contrastedImXZ, self.imBGRValsXZ)
+        frameXZ = np.flip(frameXZ, axis=0)
+
+        # colour the YZ projection by z
+        imYZ = np.transpose(projs['maxx'][nChannel])
+        contrastedImYZ = adjustContrastLUT(imYZ)
+        frameYZ = blendZDepthColors(self.channel.name, contrastedImYZ, self.imBGRValsYZ)
+        t = endStage('colormap', t)
+
+        # clear the previous frame, the gaps are not covered by any panel
+        frame.fill(0)
+
+        frame[comp.panelXZ] = frameXZ
+        frame[comp.panelXY] = frameXY
+        frame[comp.panelYZ] = frameYZ
+        t = endStage('composite', t)
+
+        # time stamp
+        comp._addTimeStamp(frame, getTimeStamp(i, self.imagingFreq))
+
+        # add scale bars
+        comp._applyOverlays(frame)
+        endStage('overlays', t)
+        return frame
+
+    def _writeFrame(self, i, projs):
+        frame = self._renderFrame(i, projs)
+        t = startStage()
+        self.vid.write(frame)
+        endStage('video_write', t, frame.nbytes)
+
+    def _release(self):
+        if self.vid is not None:
+            self.vid.release()
+
+def readProjections(projArrays, projChannels, i):
+    # read timepoint i of every projection once, only for the channels in use
+    projs = {}
+    t0 = startStage()
+    for projName, projArray in projArrays.items():
+        nChannels = sorted(set(nChannel for name, nChannel in projChannels if name == projName))
+        projData = projArray.get_orthogonal_selection((i, nChannels))
+        projs[projName] = dict(zip(nChannels, projData))
+        t0 = endStage('read_projections', t0, projData.nbytes,
+                      len(set(nChannel//projArray.chunks[1] for nChannel in nChannels))*getChunkCount(projArray, (i, 0)))
+    return projs
+
+def renderMovies(root, movies, analysisPath='analysis', tRange=None):
+    # render several movies in a single pass over time, the projections of each
+    # timepoint are read once and passed to every movie. tRange (t0, t1) renders
+    # only those timepoints, e.g. one segment of a segmented movie
+    lenT, _, _, _ = getProjectionDimensions(root, analysisPath)
+    t0, t1 = (0, lenT) if tRange is None else tRange
+    projChannels = [projChannel for movie in movies for projChannel in movie.projChannels]
+    projArrays = {projName: getProjectionArray(root, projName, analysisPath) for projName, _ in projChannels}
 
-    # define font
-    fontXY = font(cv2.FONT_HERSHEY_SIMPLEX)
-    fontXY.size, fontXY.lineThickness = fontXY._getFontSize(scaleBarXY)
+    try:
+        for i in tqdm(range(t0, t1)):
+            projs = readProjections(projArrays, projChannels, i)
+            for movie in movies:
+                movie._writeFrame(i, projs)
+    finally:
+        # every writer is released even if rendering or another writer failed,
+        # the first release error is raised once all are closed
+        releaseErrors = []
+        for movie in movies:
+            try:
+                movie._release()
+            except Exception as e:
+                releaseErrors.append(e)
+        cv2.destroyAllWindows()
+        if releaseErrors:
+            raise releaseErrors[0]
+
+def getMovieSpecsFromJSON(jsonFile):
+    # movie settings, missing keys fall back to the defaults
+    movieSpecs = {
+        "primaryColormap": "viridis",
+        "zDepthColormap": "gist_rainbow_r",
+        "movies": ["orthomax", "comp_orthomax", "sliced_orthomax", "zdepth_orthomax"],
+    }
+    # codec is 'mjpg' for avi files through cv2, or an ffmpeg encoder such as
+    # 'libx264' or 'libx265' to write mp4 files directly. segmentWorkers > 1 renders
+    # and encodes segments of the time axis in parallel (see makeSegmentedVideos)
+    encoderSpecs = {
+        "codec": "mjpg",
+        "fps": 10,
+        "crf": 28,
+        "preset": "medium",
+        "threads": 0,
+        "ffmpegPath": "ffmpeg",
+        "segmentWorkers": 1,
+    }
+    with open(jsonFile) as f:
+        jsonMovieSpecs = json.load(f).get("movieSpecs", {})
+    encoderSpecs.update(jsonMovieSpecs.pop("encoder", {}))
+    movieSpecs.update(jsonMovieSpecs)
+    movieSpecs["encoder"] = encoderSpecs
+    return movieSpecs
+
+def makeOrthoMaxVideos(root, channels, movieSpecs, ext=None, analysisPath='analysis', tRange=None):
+    # render every movie listed in movieSpecs in one pass over the projections
+    encoderSpecs = movieSpecs.get('encoder')
+    if ext is None:
+        ext = '.avi' if encoderSpecs is None else getVideoExt(encoderSpecs)
+    if tRange is None and encoderSpecs is not None and encoderSpecs.get('segmentWorkers', 1) > 1:
+        if shutil.which(encoderSpecs['ffmpegPath']) is not None:
+            return makeSegmentedVideos(root, channels, movieSpecs, ext, analysisPath)
+        # without ffmpeg the segments cannot be joined, render them in one go
+    movies = []
+    for channel in channels:
+        if 'orthomax' in movieSpecs['movies']:
+            movies.append(orthoMaxMovie(root, channel, movieSpecs['primaryColormap'], ext, encoderSpecs, analysisPath))
+        if 'sliced_orthomax' in movieSpecs['movies'] and 'sliced_max_projections' in root[analysisPath]:
+            movies.append(slicedOrthoMaxMovie(root, channel, 'X', movieSpecs['primaryColormap'], ext, encoderSpecs, analysisPath))
+            movies.append(slicedOrthoMaxMovie(root, channel, 'Y', movieSpecs['primaryColormap'], ext, encoderSpecs, analysisPath))
+        if 'zdepth_orthomax' in movieSpecs['movies']:
+            movies.append(zDepthOrthoMaxMovie(root, channel, movieSpecs['zDepthColormap'], ext, encoderSpecs, analysisPath))
+    if 'comp_orthomax' in movieSpecs['movies']:
+        movies.append(compOrthoMaxMovie(root, channels, ext, encoderSpecs, analysisPath))
+    renderMovies(root, movies, analysisPath, tRange)
+
+def getTimeSegments(lenT, nSegments):
+    # (start, stop) of nSegments contiguous parts of the time axis of near equal length
+    if lenT <= 0 or nSegments <= 0:
+        return []
+    bounds = [round(k*lenT/nSegments) for k in range(nSegments + 1)]
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+def renderMovieSegment(zarrFile, channels, movieSpecs, tRange, segmentDir, analysisPath='analysis'):
+    # worker of makeSegmentedVideos: writes timepoints tRange of every movie to
+    # segmentDir under the names the movies would have on their own
+    root = openRootStore(zarrFile, mode='r', consolidated=True)
+    os.chdir(segmentDir)
+    makeOrthoMaxVideos(root, channels, movieSpecs, analysisPath=analysisPath, tRange=tRange)
+    return sorted(os.listdir(segmentDir))
+
+def getVideoFrameCount(filename):
+    # number of frames recorded in the container of a video file
+    vid = cv2.VideoCapture(filename)
+    try:
+        return int(vid.get(cv2.CAP_PROP_FRAME_COUNT)) if vid.isOpened() else 0
+    finally:
+        vid.release()
 
-    fontXZ= font(cv2.FONT_HERSHEY_SIMPLEX)
-    fontXZ.size, fontXZ.lineThickness = fontXZ._getFontSize(scaleBarXZ)
+def checkVideoSegments(segmentNames, segmentDirs, segments):
+    # every worker must have written the same movies, each segment holding one
+    # frame per timepoint of its part of the time axis
+    for segmentDir, names, (start, stop) in zip(segmentDirs, segmentNames, segments):
+        if names != segmentNames[0]:
+            raise RuntimeError('segment ' + segmentDir + ' holds ' + ', '.join(names) + ' instead of ' + ', '.join(segmentNames[0]))
+        for name in names:
+            nFrames = getVideoFrameCount(os.path.join(segmentDir, name))
+            if nFrames != stop - start:
+                raise RuntimeError(f'segment {start}-{stop} of {name} holds {nFrames} frames instead of {stop - start}')
+
+def concatVideoSegments(segmentFiles, filename, ffmpegPath='ffmpeg'):
+    # join segments encoded with the same settings without reencoding. the concat
+    # demuxer continues the timestamps of each segment where the previous one ended
+    listFile = filename + '.segments.txt'
+    with open(listFile, 'w') as f:
+        for segmentFile in segmentFiles:
+            f.write("file '" + os.path.abspath(segmentFile).replace("'", "'\\''") + "'\n")
+    command = [ffmpegPath, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listFile, '-c', 'copy', filename]
+    try:
+        if subprocess.run(command).returncode != 0:
+            raise RuntimeError('ffmpeg failed to join the segments of ' + filename)
+    finally:
+        os.remove(listFile)
+
+def makeSegmentedVideos(root, channels, movieSpecs, ext='.avi', analysisPath='analysis'):
+    # render every movie of makeOrthoMaxVideos with the time axis split into one
+    # segment per worker process, each rendered and encoded independently, then
+    # joined into one movie per type with ffmpeg. the encoder threads are shared
+    # out between the workers
+    encoderSpecs = dict(movieSpecs['encoder'])
+    lenT, _, _, _ = getProjectionDimensions(root, analysisPath)
+    nWorkers = min(encoderSpecs['segmentWorkers'], lenT)
+    if nWorkers < 2:
+        # too few timepoints to split
+        return makeOrthoMaxVideos(root, channels, movieSpecs, ext, analysisPath, tRange=(0, lenT))
+    if encoderSpecs['threads'] == 0:
+        encoderSpecs['threads'] = max(1, (os.cpu_count() or 1)//nWorkers)
+    encoderSpecs['segmentWorkers'] = 1
+    segmentSpecs = dict(movieSpecs, encoder=encoderSpecs)
+    segments = getTimeSegments(lenT, nWorkers)
+
+    # segments go to a scratch directory next to the movies, on the same disk
+    workDir = tempfile.mkdtemp(prefix='.segments_', dir='.')
+    try:
+        segmentDirs = [os.path.abspath(os.path.join(workDir, str(k))) for k in range(len(segments))]
+        for segmentDir in segmentDirs:
+            os.makedirs(segmentDir)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            futures = [executor.submit(renderMovieSegment, getRootPath(root), channels, segmentSpecs, tRange, segmentDir, analysisPath)
+                       for tRange, segmentDir in zip(segments, segmentDirs)]
+            # the error of a failed worker is raised here, no movie is joined
+            segmentNames = [future.result() for future in futures]
+        checkVideoSegments(segmentNames, segmentDirs, segments)
+        for name in segmentNames[0]:
+            t = startStage()
+            filename = generateUniqueFilename(os.path.splitext(name)[0], ext)
+            concatVideoSegments([os.path.join(segmentDir, name) for segmentDir in segmentDirs], filename, encoderSpecs['ffmpegPath'])
+            endStage('video_concat', t, os.path.getsize(filename))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
 
-    vid = cv2.VideoWriter(filename,cv2.VideoWriter_fourcc(*'MJPG'),10,(movieWidth,movieHeight),1)
+def makeOrthoMaxVideo(root, channel, ext='.avi'):
+    renderMovies(root, [orthoMaxMovie(root, channel, ext=ext)])
 
-    try:
-        for i in tqdm(range(lenT)):
+def makeSlicedOrthoMaxVideos(root, channel, ext='.avi'):
+    renderMovies(root, [slicedOrthoMaxMovie(root, channel, 'X', ext=ext),
+                        slicedOrthoMaxMovie(root, channel, 'Y', ext=ext)])
 
-            # generate a scaled image for the XY projection
-            imXY = copy.copy(maxZ[i,nChannel,0])
-            contrastedImXY = adjustContrast(imXY, adjMax, scaleMin)
-            scaledImGrayscaleXY = invertAndScale(channel.name, contrastedImXY)
-
-            # apply z depth colormap based on z depths in slice
-            zDepths = maxZ[i,nChannel,1]
-            # TODO: make into functions for XY color assignment and XZ/YZ color assignment
-            imBluesXY = np.zeros([lenY, lenX]).astype(int)
-            imGreensXY = np.zeros([lenY, lenX]).astype(int)
-            imRedsXY = np.zeros([lenY, lenX]).astype(int)
-            for y in range(0,lenY):
-                for x in range(0,lenX):
-                    zDepth = int(zDepths[y,x])
-                    imBluesXY[y,x] = zDepthColormap[zDepth][0]
-                    imGreensXY[y,x] = zDepthColormap[zDepth][1]
-                    imRedsXY[y,x] = zDepthColormap[zDepth][2]
-            imBGRValsXY = cv2.merge([imBluesXY, imGreensXY, imRedsXY])
-
-            frameXY = np.multiply(scaledImGrayscaleXY,imBGRValsXY).astype('uint8')
-
-
-            # generate a scaled image for the XZ projection
-            imXZ = copy.copy(maxY[i,nChannel])
-            contrastedImXZ = adjustContrast(imXZ, adjMax, scaleMin)
-            scaledImGrayscaleXZ = invertAndScale(channel.name, contrastedImXZ)
-
-            # apply z depth colormap based on z depths in slice
-            imBluesXZ = np.zeros([lenZ, lenX]).astype(int)
-            imGreensXZ = np.zeros([lenZ, lenX]).astype(int)
-            imRedsXZ = np.zeros([lenZ, lenX]).astype(int)
-            for z in range(0,lenZ):
-                for x in range(0,lenX):
-                    zDepth = z
-                    imBluesXZ[z,x] = zDepthColormap[zDepth][0]
-                    imGreensXZ[z,x] = zDepthColormap[zDepth][1]
-                    imRedsXZ[z,x] = zDepthColormap[zDepth][2]
-            imBGRValsXZ = cv2.merge([imBluesXZ, imGreensXZ, imRedsXZ])
-
-            frameXZ = np.multiply(scaledImGrayscaleXZ,imBGRValsXZ).astype('uint8')
-            frameXZ = np.flip(frameXZ, axis=0)
-
-            # generate a scaled image for the YZ projection
-            imYZ = copy.copy(np.transpose(maxX[i,nChannel]))
-            contrastedImYZ = adjustContrast(imYZ, adjMax, scaleMin)
-            scaledImGrayscaleYZ = invertAndScale(channel.name, contrastedImYZ)
-
-            # apply z depth colormap based on z depths in slice
-            imBluesYZ = np.zeros([lenY, lenZ]).astype(int)
-            imGreensYZ = np.zeros([lenY, lenZ]).astype(int)
-            imRedsYZ = np.zeros([lenY, lenZ]).astype(int)
-            for y in range(0,lenY):
-                for z in range(0,lenZ):
-                    zDepth = z
-                    imBluesYZ[y,z] = zDepthColormap[zDepth][0]
-                    imGreensYZ[y,z] = zDepthColormap[zDepth][1]
-                    imRedsYZ[y,z] = zDepthColormap[zDepth][2]
-            imBGRValsYZ = cv2.merge([imBluesYZ, imGreensYZ, imRedsYZ])
-
-            frameYZ = np.multiply(scaledImGrayscaleYZ,imBGRValsYZ).astype('uint8')
-
-            # initialize frame 
-            frame = np.zeros([movieHeight,movieWidth,3]).astype('uint8')
-
-            frame[0:lenZ,0:lenX,:] = frameXZ
-            frame[(lenZ+gap):movieHeight,0:lenX,:] = frameXY
-            frame[(lenZ+gap):movieHeight,(lenX+gap):movieWidth,:] = frameYZ
-
-            #frame[np.where(scaledIm==0)] = [0,0,0]
-
-            # time stamp
-            t = f'{i*imagingFreq // 60:02d}' + ':' + f'{i*imagingFreq % 60:02d}'
-            timeStampPos = getTimeStampPos(upperLeftXY, t, fontXY)
-            cv2.putText(frame,t,timeStampPos,fontXY.font,fontXY.fontSize,[255,255,255],fontXY.lineThickness,cv2.LINE_AA)
-
-            # add scale bars
-            scaleBarXY._addScaleBar(frame, fontXY)
-            scaleBarXZ._addScaleBarZ(frame, fontXZ)
-
-            # write frame 
-            vid.write(frame)
+def makeCompOrthoMaxVideo(root, channels, ext='.avi'):
+    renderMovies(root, [compOrthoMaxMovie(root, channels, ext)])
 
-        vid.release()
-        cv2.destroyAllWindows()
-    except:
-        vid.release()
-        cv2.destroyAllWindows()
\ No newline at end of file
+def makeZDepthOrthoMaxVideo(root, channel, cmap, ext='.avi'):
+    renderMovies(root, [zDepthOrthoMaxMovie(root, channel, cmap, ext)])
+
+def shrinkFrame(frame, factor):
+    # area averaged downsampling of a frame by factor <= 1
+    size = (max(1, round(frame.shape[1]*factor)), max(1, round(frame.shape[0]*factor)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+class lruCache:
+    # thread safe least recently used cache bounded by the total bytes of its
+    # numpy values, values larger than the whole cache are not kept
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.items = collections.OrderedDict()
+        self.nBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _put(self, key, value):
+        if value.nbytes > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.nBytes -= self.items.pop(key).nbytes
+            self.items[key] = value
+            self.nBytes += value.nbytes
+            while self.nBytes > self.maxBytes:
+                _, evicted = self.items.popitem(last=False)
+                self.nBytes -= evicted.nbytes
+
+    def _summary(self):
+        with self.lock:
+            return {'items': len(self.items), 'bytes': self.nBytes, 'hits': self.hits, 'misses': self.misses}
+
+class frameRenderer:
+    # renders single movie frames on demand from the stored projections, with the
+    # same compositing, colormaps and overlays as the movies. projections read from
+    # the store and rendered frames are kept in LRU caches, so revisiting a
+    # timepoint or contrast setting does not touch the store again
+    def __init__(self, root, channels, movieSpecs=None, analysisPath='analysis', projectionCacheBytes=256*2**20, frameCacheBytes=256*2**20):
+        self.root = root
+        self.analysisPath = analysisPath
+        if movieSpecs is None:
+            movieSpecs = getMovieSpecsFromJSON(getRootPath(root) + '/parameters.json')
+        self.movieSpecs = movieSpecs
+        # own copies, contrast overrides are passed to each render and never stored
+        # in the channels, so concurrent renders cannot see each other's contrast
+        self.channels = [channel(c.name, c.nChannel, c.voxelDims, c.scaleMax, c.scaleMin) for c in channels]
+        self.lenT = getProjectionDimensions(root, analysisPath)[0]
+        self.projArrays = {}
+        self.movies = {}
+        self.panelLUTs = {}
+        self.projectionCache = lruCache(projectionCacheBytes)
+        self.frameCache = lruCache(frameCacheBytes)
+        # movies render into shared frame buffers, one frame at a time
+        self.lock = threading.Lock()
+
+    def _getChannel(self, channelName):
+        for c in self.channels:
+            if c.name == channelName:
+                return c
+        raise ValueError('Unknown channel ' + str(channelName))
+
+    def _getMovie(self, movieType, channelName=None, axis='X'):
+        # movie objects without a video writer, created once per type and channel
+        key = (movieType, channelName, axis if movieType == 'sliced_orthomax' else None)
+        with self.lock:
+            if key in self.movies:
+                return self.movies[key]
+            if movieType == 'orthomax':
+                movie = orthoMaxMovie(self.root, self._getChannel(channelName), self.movieSpecs['primaryColormap'],
+                                      analysisPath=self.analysisPath, video=False)
+            elif movieType == 'sliced_orthomax':
+                movie = slicedOrthoMaxMovie(self.root, self._getChannel(channelName), axis, self.movieSpecs['primaryColormap'],
+                                            analysisPath=self.analysisPath, video=False)
+            elif movieType == 'zdepth_orthomax':
+                movie = zDepthOrthoMaxMovie(self.root, self._getChannel(channelName), self.movieSpecs['zDepthColormap'],
+                                            analysisPath=self.analysisPath, video=False)
+            elif movieType == 'comp_orthomax':
+                movie = compOrthoMaxMovie(self.root, self.channels, analysisPath=self.analysisPath, video=False)
+            else:
+                raise ValueError('Unknown movie type ' + str(movieType))
+            self.movies[key] = movie
+            return movie
+
+    def _getMovieChannels(self, movie):
+        if isinstance(movie, compOrthoMaxMovie):
+            return [movie.channelCells, movie.channelRocks]
+        return [movie.channel]
+
+    def _readProjection(self, projName, i, nChannel):
+        # projection (y,x) or (slab,z,x) of one timepoint and channel, one chunk
+        # with the default projection chunking
+        key = (projName, i, nChannel)
+        projData = self.projectionCache._get(key)
+        if projData is None:
+            if projName not in self.projArrays:
+                self.projArrays[projName] = getProjectionArray(self.root, projName, self.analysisPath)
+            projArray = self.projArrays[projName]
+            t0 = startStage()
+            projData = projArray[i, nChannel]
+            endStage('read_projections', t0, projData.nbytes, getChunkCount(projArray, (i, nChannel)))
+            projData.flags.writeable = False
+            self.projectionCache._put(key, projData)
+        return projData
+
+    def renderFrame(self, movieType, i, channelName=None, contrast=None, axis='X', maxSize=None):
+        # BGR frame of timepoint i. contrast is (scaleMin, scaleMax) of the movie's
+        # channel, or a dict of those by channel name, and defaults to the channel
+        # settings. with maxSize the frame is shrunk to fit in maxSize x maxSize
+        if not 0 <= i < self.lenT:
+            raise IndexError('Timepoint ' + str(i) + ' out of range for ' + str(self.lenT) + ' timepoints')
+        movie = self._getMovie(movieType, channelName, axis)
+        movieChannels = self._getMovieChannels(movie)
+        if contrast is not None and not isinstance(contrast, dict):
+            contrast = {movieChannels[0].name: contrast}
+        # the frame is rendered with and cached under the same scales
+        scales = {c.name: tuple(float(v) for v in getChannelScale(c, i, contrast)) for c in movieChannels}
+        key = (movieType, channelName, axis if movieType == 'sliced_orthomax' else None, i, tuple(sorted(scales.items())), maxSize)
+        frame = self.frameCache._get(key)
+        if frame is not None:
+            return frame
+
+        projs = collections.defaultdict(dict)
+        for projName, nChannel in movie.projChannels:
+            projs[projName][nChannel] = self._readProjection(projName, i, nChannel)
+        with self.lock:
+            frame = movie._renderFrame(i, projs, scales).copy()
+
+        if maxSize is not None and max(frame.shape[:2]) > maxSize:
+            frame = shrinkFrame(frame, maxSize/max(frame.shape[:2]))
+        frame.flags.writeable = False
+        self.frameCache._put(key, frame)
+        return frame
+
+    def renderPanel(self, projName, i, channelName, contrast=None, slab=0, level=0):
+        # one projection ('maxz', 'maxy', 'maxx' or a slab of 'sliced_maxx' or
+        # 'sliced_maxy') oriented and coloured as in the movies, without overlays.
+        # level shrinks the panel by 2**level
+        if projName not in ['maxz', 'maxy', 'maxx', 'sliced_maxx', 'sliced_maxy']:
+            raise ValueError('Unknown projection ' + str(projName))
+        if not 0 <= i < self.lenT:
+            raise IndexError('Timepoint ' + str(i) + ' out of range for ' + str(self.lenT) + ' timepoints')
+        c = self._getChannel(channelName)
+        scaleMin, scaleMax = (float(v) for v in getChannelScale(c, i, None if contrast is None else {c.name: contrast}))
+        key = ('panel', projName, channelName, i, slab if projName.startswith('sliced') else None, scaleMin, scaleMax, level)
+        panel = self.frameCache._get(key)
+        if panel is not None:
+            return panel
+
+        im = self._readProjection(projName, i, c.nChannel)
+        if projName.startswith('sliced'):
+            if not 0 <= slab < im.shape[0]:
+                raise IndexError('Slab ' + str(slab) + ' out of range for ' + str(im.shape[0]) + ' slabs')
+            im = im[slab]
+        # same orientation as the movie panels
+        if projName == 'maxx':
+            im = np.transpose(im)
+        elif projName != 'maxz':
+            im = np.flip(im, axis=0)
+        if c.name not in self.panelLUTs:
+            self.panelLUTs[c.name] = createColormapLUT(im.dtype, c, cmapy.cmap(self.movieSpecs['primaryColormap']))
+        lut = self.panelLUTs[c.name]
+        if lut is not None:
+            panel = lut._get(scaleMin, scaleMax)[im]
+        else:
+            contrastedIm = adjustContrast(im, scaleMax, scaleMin)
+            if c.name == 'rocks':
+                contrastedIm = 255 - contrastedIm
+            panel = cv2.applyColorMap(contrastedIm, cmapy.cmap(self.movieSpecs['primaryColormap']))
+            panel[im==0] = 0
+
+        if level > 0:
+            panel = shrinkFrame(panel, 1/2**level)
+        panel.flags.writeable = False
+        self.frameCache._put(key, panel)
+        return panel
+
+    def renderTile(self, projName, i, channelName, level, tileY, tileX, tileSize=256, contrast=None, slab=0):
+        # tileSize x tileSize tile of a panel shrunk by 2**level, tiles at the
+        # bottom and right edges are smaller
+        panel = self.renderPanel(projName, i, channelName, contrast, slab, level)
+        if not (0 <= tileY*tileSize < panel.shape[0] and 0 <= tileX*tileSize < panel.shape[1]):
+            raise IndexError('Tile ' + str((tileY, tileX)) + ' out of range at level ' + str(level))
+        return panel[tileY*tileSize:(tileY+1)*tileSize, tileX*tileSize:(tileX+1)*tileSize]
+
+    def _cacheStats(self):
+        return {'projections': self.projectionCache._summary(), 'frames': self.frameCache._summary()}
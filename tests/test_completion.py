@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import zarr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createSourceDataset(zarrFile, shape=(6, 2, 4, 8, 10)):
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile)
+    source = np.random.default_rng(0).integers(0, 1000, shape).astype('uint16')
+    root.create_group('0').array('0', source, chunks=(1, 1) + shape[2:], dimension_separator=dv.chunkKeySeparator)
+    return root, source
+
+def test_checkpoint_writes_every_interval(tmp_path):
+    group = zarr.open_group(str(tmp_path / 'group.zarr'), mode='w')
+    completed = np.zeros((4, 2), dtype=bool)
+    checkpoint = dv.completionCheckpoint(group, completed, interval=3)
+    checkpoint._mark((0, 0))
+    checkpoint._mark((0, 1))
+    assert 'completed' not in group.attrs
+    checkpoint._mark((1, 0))
+    assert group.attrs['completed'] == ['11', '10', '00', '00']
+    checkpoint._mark(2)
+    checkpoint._flush()
+    assert group.attrs['completed'] == ['11', '10', '11', '00']
+
+@pytest.mark.parametrize('prefetchThreads', [0, 2])
+def test_interrupted_projections_keep_written_blocks(tmp_path, monkeypatch, prefetchThreads):
+    root, source = createSourceDataset(str(tmp_path / 'source.zarr'))
+    projectVolume = dv.projectVolume
+    nCalls = []
+
+    def failingProjectVolume(*args, **kwargs):
+        nCalls.append(1)
+        if len(nCalls) > 5:
+            raise RuntimeError('interrupted')
+        return projectVolume(*args, **kwargs)
+
+    monkeypatch.setattr(dv, 'projectVolume', failingProjectVolume)
+    with pytest.raises(RuntimeError):
+        dv.calcOrthoMaxProjections(root, slicedMaxProjections=False, intensityHistograms=False, prefetchThreads=prefetchThreads)
+    group = root['analysis/max_projections']
+    assert dv.getGroupCompletedBlocks(group, 'max_projections').sum() == 5
+
+    monkeypatch.setattr(dv, 'projectVolume', projectVolume)
+    dv.calcOrthoMaxProjections(root, slicedMaxProjections=False, intensityHistograms=False, prefetchThreads=prefetchThreads)
+    # the group attrs are cached, read them again
+    group = root['analysis/max_projections']
+    assert dv.getGroupCompletedBlocks(group, 'max_projections').all()
+    np.testing.assert_array_equal(group['maxz'][:], source.max(axis=2))
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createSourceDataset(zarrFile, shape=(4, 1, 3, 6, 8)):
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile)
+    source = np.random.default_rng(0).integers(0, 1000, shape).astype('uint16')
+    root.create_group('0').array('0', source, chunks=(1, 1) + shape[2:], dimension_separator=dv.chunkKeySeparator)
+    return root, zarrFile + '/0/0'
+
+def touchTimepoint(arrayPath, t, mtime):
+    for dirPath, _, fileNames in os.walk(os.path.join(arrayPath, str(t))):
+        for fileName in fileNames:
+            os.utime(os.path.join(dirPath, fileName), ns=(mtime, mtime))
+
+def test_stamps_of_given_timepoints(tmp_path):
+    root, arrayPath = createSourceDataset(str(tmp_path / 'source.zarr'))
+    for t in range(4):
+        touchTimepoint(arrayPath, t, (t + 1)*10**9)
+    stamps = dv.getSourceStamps(root)
+    assert stamps == [(t + 1)*10**9 for t in range(4)]
+
+    touchTimepoint(arrayPath, 0, 9*10**9)
+    touchTimepoint(arrayPath, 3, 8*10**9)
+    # timepoints left out keep the stamps passed in
+    assert dv.getSourceStamps(root, timepoints=range(2, 4), stamps=stamps) == [10**9, 2*10**9, 3*10**9, 8*10**9]
+    assert dv.getSourceStamps(root) == [9*10**9, 2*10**9, 3*10**9, 8*10**9]
+
+def test_projections_reuse_passed_stamps(tmp_path, monkeypatch):
+    root, _ = createSourceDataset(str(tmp_path / 'source.zarr'))
+    stamps = dv.getSourceStamps(root)
+
+    def failingStamps(*args, **kwargs):
+        raise AssertionError('source chunks statted again')
+
+    monkeypatch.setattr(dv, 'getSourceStamps', failingStamps)
+    dv.checkProjectionFingerprints(root, stamps=stamps)
+    dv.calcOrthoMaxProjections(root, stamps=stamps)
+    assert root['analysis/max_projections'].attrs['sourceStamps'] == stamps
+
+def test_watch_stats_new_timepoints(tmp_path, monkeypatch):
+    root, _ = createSourceDataset(str(tmp_path / 'source.zarr'))
+    getSourceStamps = dv.getSourceStamps
+    statted = []
+
+    def recordingStamps(root, res_lvl=0, timepoints=None, stamps=None):
+        statted.append(None if stamps is None else list(timepoints))
+        return getSourceStamps(root, res_lvl, timepoints, stamps)
+
+    def growSource(root, lenT):
+        # the acquisition writes one more timepoint after each update
+        resArray = root['0']['0']
+        if resArray.shape[0] < 6:
+            resArray.append(np.ones((1,) + resArray.shape[1:], dtype=resArray.dtype))
+
+    monkeypatch.setattr(dv, 'getSourceStamps', recordingStamps)
+    lenT = dv.watchMaxProjections(root, slicedMaxProjections=False, pollInterval=0, settleFrames=1, timeout=0.5,
+                                  callback=growSource)
+    assert lenT == 6
+    # every timepoint is statted on the first update, then only those not projected yet
+    assert statted[0] is None
+    assert statted[1:3] == [[3, 4], [4, 5]]
+    np.testing.assert_array_equal(root['analysis/max_projections/maxz'][4:], 1)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def test_histogram_uint8():
+    im = np.array([[0, 1, 255], [255, 128, 7]], dtype='uint8')
+    binWidth = dv.getHistogramBinWidth(im.dtype)
+    hist = dv.calcHistogram(im, binWidth)
+    assert binWidth == 1
+    assert hist.shape == (dv.nHistogramBins,)
+    assert hist.sum() == im.size
+    assert hist[255] == 2 and hist[128] == 1 and hist[0] == 1
+
+def test_histogram_uint16():
+    im = np.array([0, 63, 64, 65535], dtype='uint16')
+    hist = dv.calcHistogram(im, dv.getHistogramBinWidth(im.dtype))
+    assert hist[0] == 2 and hist[1] == 1 and hist[-1] == 1
+
+def test_histogram_signed_clips_to_range():
+    im = np.array([-5, 0, 70000], dtype='int32')
+    hist = dv.calcHistogram(im, 64)
+    assert hist.sum() == im.size
+    assert hist[0] == 2 and hist[-1] == 1
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createProjectedDataset(zarrFile, shape=(5, 2, 3, 12, 16)):
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile)
+    source = np.random.default_rng(0).integers(0, 4000, shape).astype('uint16')
+    root.create_group('0').array('0', source, chunks=(1, 1) + shape[2:], dimension_separator=dv.chunkKeySeparator)
+    dv.calcOrthoMaxProjections(root, slicedMaxProjections=False)
+    return root
+
+def sampleLine(maxZ, line, width):
+    rows, cols = dv.getKymographPoints(line, width)
+    return np.moveaxis(maxZ[:, :, rows, cols].max(axis=2), 0, 1)
+
+def test_kymograph_rows_written_in_whole_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(dv, 'kymographTimepointsPerChunk', 2)
+    zarrFile = str(tmp_path / 'kymo.zarr')
+    root = createProjectedDataset(zarrFile)
+    line = ((1, 2), (14, 9))
+    kymograph = dv.calcKymograph(root, 'diagonal', line, width=3)
+
+    assert kymograph.chunks[1] == 2
+    np.testing.assert_array_equal(kymograph[:], sampleLine(root['analysis/max_projections/maxz'][:], line, 3))
+    # each channel holds three time chunks, the last one partly filled
+    chunkDir = os.path.join(zarrFile, 'analysis', 'kymographs', 'diagonal')
+    assert sorted(os.listdir(chunkDir)) == ['.zarray', '.zattrs', '0', '1']
+    assert sorted(os.listdir(os.path.join(chunkDir, '0'))) == ['0', '1', '2']
+
+def test_kymograph_resumes_within_a_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(dv, 'kymographTimepointsPerChunk', 2)
+    root = createProjectedDataset(str(tmp_path / 'kymo.zarr'))
+    line = ((0, 5), (15, 5))
+    expected = dv.calcKymograph(root, 'row', line)[:]
+
+    # as if the calculation stopped after three timepoints
+    maxGroup = root['analysis/max_projections']
+    kymograph = root['analysis/kymographs/row']
+    kymograph[:, 3:] = 0
+    kymograph.attrs.update({'lenT': 3, 'input': dv.getInputFingerprint(maxGroup, 3)})
+
+    np.testing.assert_array_equal(dv.calcKymograph(root, 'row', line)[:], expected)
+    assert root['analysis/kymographs/row'].attrs['lenT'] == 5
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import numpy as np
+import zarr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createBaselineDataset(zarrFile, shape=(3, 2, 6, 10, 13), nSlices=4):
+    # nested source array like bioformats2raw output, and projections written the
+    # way the original scripts did: through zarr.open, float64, '.' chunk keys and
+    # maxz holding the max and its z index on a length 2 axis
+    lenT, lenCh, lenZ, lenY, lenX = shape
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 20001, shape).astype('uint16')
+    dv.createRootStore(zarrFile)
+    root = zarr.open(zarrFile, mode='r+')
+    root.create_group('0').array('0', source, chunks=(1, 1, lenZ, lenY, lenX), dimension_separator='/')
+    maxGroup = root.create_group('analysis').create_group('max_projections')
+    maxZ = maxGroup.zeros('maxz', shape=(lenT,lenCh,2,lenY,lenX), chunks=(1,lenCh,2,lenY,lenX))
+    maxX = maxGroup.zeros('maxx', shape=(lenT,lenCh,lenZ,lenY), chunks=(1,lenCh,lenZ,lenY))
+    maxY = maxGroup.zeros('maxy', shape=(lenT,lenCh,lenZ,lenX), chunks=(1,lenCh,lenZ,lenX))
+    slicedGroup = root['analysis'].create_group('sliced_max_projections')
+    slicedMaxX = slicedGroup.zeros('sliced_maxx', shape=(lenT,lenCh,nSlices,lenZ,lenY), chunks=(1,1,2,lenZ,lenY))
+    sliceStarts = dv.getSliceStarts(lenX, nSlices)
+    for i in range(lenT):
+        for j in range(lenCh):
+            frame = source[i, j]
+            maxZ[i,j] = [np.max(frame,axis=0), np.argmax(frame,axis=0)]
+            maxX[i,j] = np.max(frame,axis=2)
+            maxY[i,j] = np.max(frame,axis=1)
+            for k, (start, stop) in enumerate(zip(sliceStarts, sliceStarts[1:] + [lenX])):
+                slicedMaxX[i,j,k] = np.max(frame[:, :, start:stop], axis=2)
+    return source, sliceStarts
+
+def test_migrate_baseline_projections(tmp_path):
+    zarrFile = str(tmp_path / 'baseline.zarr')
+    source, sliceStarts = createBaselineDataset(zarrFile)
+    assert os.path.exists(zarrFile + '/analysis/max_projections/maxz/0.0.0.0.0')
+
+    root = dv.openRootStore(zarrFile, mode='r+')
+    # the old arrays are read with their '.' chunk keys
+    assert root['analysis/max_projections/maxx'][:].max() == source.max()
+
+    migrated = dv.migrateProjectionArrays(root)
+    assert sorted(migrated) == ['maxx', 'maxy', 'maxz', 'sliced_maxx']
+    assert not dv.getLegacyProjectionArrays(root)
+
+    root = dv.openRootStore(zarrFile, mode='r')
+    maxGroup = root['analysis/max_projections']
+    assert maxGroup['maxz'].dtype == source.dtype
+    np.testing.assert_array_equal(maxGroup['maxz'][:], source.max(axis=2))
+    np.testing.assert_array_equal(maxGroup['maxz_depth'][:], source.argmax(axis=2))
+    np.testing.assert_array_equal(maxGroup['maxx'][:], source.max(axis=4))
+    np.testing.assert_array_equal(maxGroup['maxy'][:], source.max(axis=3))
+    slicedMaxX = np.stack([source[..., start:stop].max(axis=4) for start, stop in zip(sliceStarts, sliceStarts[1:] + [source.shape[4]])], axis=2)
+    np.testing.assert_array_equal(root['analysis/sliced_max_projections/sliced_maxx'][:], slicedMaxX)
@@ -0,0 +1,89 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import zarr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createFailingFFmpeg(tmp_path):
+    # reads nothing and exits with an error, like ffmpeg rejecting its arguments
+    ffmpegPath = tmp_path / 'ffmpeg'
+    ffmpegPath.write_text('#!/bin/sh\nexit 1\n')
+    ffmpegPath.chmod(0o755)
+    return str(ffmpegPath)
+
+def test_ffmpeg_writer_release_raises(tmp_path):
+    writer = dv.ffmpegWriter(str(tmp_path / 'out.mp4'), 10, (8, 6), ffmpegPath=createFailingFFmpeg(tmp_path))
+    writer.proc.wait()
+    with pytest.raises(BrokenPipeError):
+        for _ in range(100):
+            writer.write(np.zeros((6, 8, 3), dtype='uint8'))
+    with pytest.raises(RuntimeError):
+        writer.release()
+
+class recordingMovie:
+    # stands in for the movie classes, optionally failing to write or release
+    def __init__(self, writeError=None, releaseError=None):
+        self.projChannels = [('maxz', 0)]
+        self.writeError = writeError
+        self.releaseError = releaseError
+        self.released = False
+
+    def _writeFrame(self, i, projs):
+        if self.writeError is not None:
+            raise self.writeError
+
+    def _release(self):
+        self.released = True
+        if self.releaseError is not None:
+            raise self.releaseError
+
+def createProjectionRoot(tmp_path, lenT=2):
+    root = zarr.open(str(tmp_path / 'movies.zarr'), mode='w')
+    group = root.create_group('analysis').create_group('max_projections')
+    group.zeros('maxz', shape=(lenT, 1, 4, 5), dtype='uint16')
+    group.zeros('maxx', shape=(lenT, 1, 3, 4), dtype='uint16')
+    group.zeros('maxy', shape=(lenT, 1, 3, 5), dtype='uint16')
+    return root
+
+def test_render_movies_raises_write_errors(tmp_path):
+    root = createProjectionRoot(tmp_path)
+    movies = [recordingMovie(writeError=BrokenPipeError()), recordingMovie()]
+    with pytest.raises(BrokenPipeError):
+        dv.renderMovies(root, movies)
+    assert all(movie.released for movie in movies)
+
+def test_render_movies_raises_release_errors(tmp_path):
+    root = createProjectionRoot(tmp_path)
+    movies = [recordingMovie(releaseError=RuntimeError('ffmpeg failed')), recordingMovie()]
+    with pytest.raises(RuntimeError):
+        dv.renderMovies(root, movies)
+    assert all(movie.released for movie in movies)
+
+def test_time_segments():
+    assert dv.getTimeSegments(10, 3) == [(0, 3), (3, 7), (7, 10)]
+    assert dv.getTimeSegments(2, 4) == [(0, 1), (1, 2)]
+    assert dv.getTimeSegments(0, 4) == []
+
+def writeVideo(filename, nFrames):
+    vid = dv.createVideoWriter(filename, (16, 8))
+    for _ in range(nFrames):
+        vid.write(np.zeros((8, 16, 3), dtype='uint8'))
+    vid.release()
+
+def test_check_video_segments(tmp_path):
+    segmentDirs = [str(tmp_path / str(k)) for k in range(2)]
+    for segmentDir in segmentDirs:
+        os.makedirs(segmentDir)
+    writeVideo(os.path.join(segmentDirs[0], 'movie.avi'), 3)
+    writeVideo(os.path.join(segmentDirs[1], 'movie.avi'), 2)
+    segmentNames = [['movie.avi'], ['movie.avi']]
+    dv.checkVideoSegments(segmentNames, segmentDirs, [(0, 3), (3, 5)])
+    with pytest.raises(RuntimeError):
+        dv.checkVideoSegments(segmentNames, segmentDirs, [(0, 3), (3, 6)])
+    with pytest.raises(RuntimeError):
+        dv.checkVideoSegments([['movie.avi'], []], segmentDirs, [(0, 3), (3, 5)])
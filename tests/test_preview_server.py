@@ -0,0 +1,52 @@
+import importlib.util
+import os
+import sys
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+from test_renderer import createChannels, createProjectedDataset, renderConcurrently, slowDownRenders
+
+scriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'previewServer.py')
+spec = importlib.util.spec_from_file_location('previewServer', scriptPath)
+previewServer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(previewServer)
+
+def test_default_contrast_images_do_not_change(tmp_path, monkeypatch):
+    zarrFile = str(tmp_path / 'preview.zarr')
+    root = createProjectedDataset(zarrFile)
+    # caches too small to keep an image, so every request renders
+    renderer = dv.frameRenderer(root, createChannels(), frameCacheBytes=1)
+    monkeypatch.setattr(previewServer.previewHandler, 'renderer', renderer)
+    monkeypatch.setattr(previewServer.previewHandler, 'responseCache', dv.lruCache(1))
+    monkeypatch.setattr(previewServer.previewHandler, 'projectionTag', previewServer.getProjectionTag(zarrFile, root))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), previewServer.previewHandler)
+    serverThread = threading.Thread(target=server.serve_forever, daemon=True)
+    serverThread.start()
+    try:
+        url = 'http://127.0.0.1:' + str(server.server_port) + '/'
+
+        def get(query):
+            with urllib.request.urlopen(url + query) as response:
+                return response.read(), response.headers['ETag']
+
+        defaultQuery = 'frame?movie=orthomax&channel=cells&t=1'
+        panelQuery = 'panel?proj=maxz&channel=cells&t=1'
+        expected = get(defaultQuery)
+        expectedPanel = get(panelQuery)
+        slowDownRenders(monkeypatch)
+        results = renderConcurrently([lambda: get(defaultQuery),
+                                      lambda: get('frame?movie=orthomax&channel=cells&t=1&min=100&max=200'),
+                                      lambda: get('frame?movie=orthomax&channel=cells&t=1&max=300'),
+                                      lambda: get(panelQuery)])
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert all(result == expected for result in results[0])
+    assert all(result == expectedPanel for result in results[3])
+    assert results[1][0][0] != expected[0] and results[1][0][1] != expected[1]
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def createProjectedDataset(zarrFile, shape=(3, 2, 6, 24, 32)):
+    # small two channel dataset with its projections and the parameters.json the
+    # movies read their settings from
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile)
+    source = np.random.default_rng(0).integers(0, 4000, shape).astype('uint16')
+    root.create_group('0').array('0', source, chunks=(1, 1) + shape[2:], dimension_separator=dv.chunkKeySeparator)
+    dv.calcOrthoMaxProjections(root)
+    parameters = {
+        "imagingParameters": {"imagingFrequency": 10},
+        "channels": [{"name": "cells", "channelNumber": 0, "scaleMin": 0, "scaleMax": 3000},
+                     {"name": "rocks", "channelNumber": 1, "scaleMin": 0, "scaleMax": 3000}],
+    }
+    with open(zarrFile + '/parameters.json', 'w') as f:
+        json.dump(parameters, f)
+    return root
+
+def createChannels():
+    return [dv.channel('cells', 0, [1.0, 1.0, 2.0], 3000, 0), dv.channel('rocks', 1, [1.0, 1.0, 2.0], 3000, 0)]
+
+def renderConcurrently(renders, duration=0.3):
+    # repeat every render from its own thread for duration seconds, all threads at once
+    results = [[] for _ in renders]
+    barrier = threading.Barrier(len(renders))
+
+    def worker(k):
+        barrier.wait()
+        stop = time.perf_counter() + duration
+        while time.perf_counter() < stop:
+            results[k].append(renders[k]())
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(len(renders))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def slowDownRenders(monkeypatch):
+    # renders take long enough for the other threads to run while one is underway
+    for movieClass in [dv.orthoMaxMovie, dv.compOrthoMaxMovie]:
+        def slowRenderFrame(self, *args, renderFrame=movieClass._renderFrame, **kwargs):
+            time.sleep(0.002)
+            return renderFrame(self, *args, **kwargs)
+        monkeypatch.setattr(movieClass, '_renderFrame', slowRenderFrame)
+
+def test_contrast_overrides_do_not_leak(tmp_path, monkeypatch):
+    root = createProjectedDataset(str(tmp_path / 'render.zarr'))
+    reference = dv.frameRenderer(root, createChannels())
+    expected = {movieType: reference.renderFrame(movieType, 1, 'cells').copy() for movieType in ['orthomax', 'comp_orthomax']}
+    expectedPanel = reference.renderPanel('maxz', 1, 'cells').copy()
+
+    # the frame cache is kept small so frames are rendered again on every request
+    slowDownRenders(monkeypatch)
+    renderer = dv.frameRenderer(root, createChannels(), frameCacheBytes=1)
+    renders = [lambda: renderer.renderFrame('orthomax', 1, 'cells'),
+               lambda: renderer.renderFrame('orthomax', 1, 'cells', contrast=(100, 200)),
+               lambda: renderer.renderFrame('comp_orthomax', 1),
+               lambda: renderer.renderFrame('comp_orthomax', 1, contrast={'cells': (100, 200), 'rocks': (50, 60)}),
+               lambda: renderer.renderPanel('maxz', 1, 'cells'),
+               lambda: renderer.renderPanel('maxz', 1, 'cells', contrast=(100, 200))]
+    results = renderConcurrently(renders)
+    assert all(np.array_equal(frame, expected['orthomax']) for frame in results[0])
+    assert all(np.array_equal(frame, expected['comp_orthomax']) for frame in results[2])
+    assert all(np.array_equal(panel, expectedPanel) for panel in results[4])
+    assert not np.array_equal(results[1][0], expected['orthomax'])
+    assert [c.scaleMin for c in renderer.channels] == [0, 0] and [c.scaleMax for c in renderer.channels] == [3000, 3000]
@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def test_slabs_cover_axis():
+    assert dv.getSlabBounds(420, voxelSize=0.65, thickness=100) == [[0, 154], [154, 308], [266, 420]]
+
+def test_slabs_exact_fit():
+    assert dv.getSlabBounds(300, voxelSize=1, thickness=100) == [[0, 100], [100, 200], [200, 300]]
+
+def test_overlapping_slabs_cover_axis():
+    bounds = dv.getSlabBounds(250, voxelSize=1, thickness=100, stride=60)
+    assert bounds == [[0, 100], [60, 160], [120, 220], [150, 250]]
+
+def test_slab_thicker_than_axis():
+    assert dv.getSlabBounds(50, voxelSize=1, thickness=100) == [[0, 50]]
+
+def test_default_slices_cover_axis():
+    bounds = dv.getSlabBounds(100, nSlices=20)
+    assert bounds[0][0] == 0 and bounds[-1][1] == 100 and len(bounds) == 20
@@ -0,0 +1,23 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dictyviz as dv
+
+def test_routed_store_pickles(tmp_path):
+    zarrFile = str(tmp_path / 'routed.zarr')
+    dv.createRootStore(zarrFile)
+    root = dv.openRootStore(zarrFile, mode='r+', analysisStore='sqlite')
+    group = root.create_group('analysis')
+    group.array('values', np.arange(10), chunks=(5,))
+
+    store = pickle.loads(pickle.dumps(root.store))
+    assert isinstance(store, dv.routedStore)
+    with store.prefixLock:
+        assert 'analysis/values/.zarray' in store
+    unpickled = pickle.loads(pickle.dumps(root))
+    np.testing.assert_array_equal(unpickled['analysis/values'][:], np.arange(10))